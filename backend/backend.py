@@ -1,12 +1,25 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile, status
+from fastapi import FastAPI, HTTPException, File, UploadFile, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import asyncio
+import hashlib
+import json
 import os
-import shutil
+import time
+import uuid
 from pathlib import Path
 
 #local imports
 from pages import ChatPage, SettingsPage
 from pydantic_models import *
+from utils.executors import run_in_pool
+from utils.job_queue import QUEUED, RUNNING, JobQueue
+from utils.metrics import (
+    CACHE_ENTRIES, CACHE_REQUESTS, QUEUE_ACTIVE, QUEUE_REJECTED, QUEUE_WAITING, REGISTRY, TracingMiddleware
+)
+from utils.model_pool import ModelBusyError, get_model_pool
+from utils.scheduler import BULK, INTERACTIVE, SchedulerBusyError, get_scheduler, scheduler_lane
+from utils.session_store import DEFAULT_SESSION_ID
 
 app = FastAPI()
 
@@ -19,45 +32,218 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Times each request to its last byte and logs its stage spans as one JSON line
+app.add_middleware(TracingMiddleware)
 
 chat_page = ChatPage()
-settings_page = SettingsPage()
+settings_page = SettingsPage(chat_page)
+ingest_jobs = JobQueue(num_workers=lambda: chat_page.chat_files.config["ingest_workers"])
+# Ingest jobs not finished yet, by (collection, file hash), so a file uploaded
+# again before its first upload is ingested joins that job
+pending_uploads: Dict[tuple, tuple] = {}
+
+
+def stream_tokens(request: Request, token_stream, metadata: dict = None) -> StreamingResponse:
+    """
+    Stream model output as NDJSON frames, ending with a frame of timing
+    stats and whatever the token stream recorded in metadata.
+    """
+    metadata = {} if metadata is None else metadata
+    async def frames():
+        start = time.perf_counter()
+        first_token_at = None
+        num_chunks = 0
+        num_chars = 0
+
+        def stats():
+            end = time.perf_counter()
+            return {
+                "time_to_first_token": (first_token_at - start) if first_token_at else None,
+                "total_time": end - start,
+                "chunks": num_chunks,
+                "characters": num_chars,
+            }
+
+        try:
+            async for chunk in token_stream:
+                if await request.is_disconnected():
+                    print(f"Client disconnected, cancelled stream after {num_chunks} chunks")
+                    return
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                num_chunks += 1
+                num_chars += len(chunk)
+                yield json.dumps({"type": "token", "content": chunk}) + "\n"
+            yield json.dumps({"type": "done", "stats": stats(), **metadata}) + "\n"
+        except asyncio.CancelledError:
+            print(f"Client disconnected, cancelled stream after {num_chunks} chunks")
+            raise
+        except SchedulerBusyError as e:
+            yield json.dumps({"type": "error", "detail": str(e), "retry_after": e.retry_after, "stats": stats()}) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": str(e), "stats": stats()}) + "\n"
+        finally:
+            # Closing the generator aborts the pending request to Ollama
+            await token_stream.aclose()
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
+
+
+def stream_results(request: Request, results, total: int) -> StreamingResponse:
+    """
+    Stream the answers of a batch as NDJSON result frames, in the order
+    they complete, ending with a frame of throughput stats.
+    """
+    async def frames():
+        start = time.perf_counter()
+        succeeded = 0
+        failed = 0
+
+        def stats():
+            elapsed = time.perf_counter() - start
+            return {
+                "questions": total,
+                "succeeded": succeeded,
+                "failed": failed,
+                "total_time": elapsed,
+                "questions_per_second": (succeeded + failed) / elapsed if elapsed else None,
+            }
+
+        try:
+            async for result in results:
+                if await request.is_disconnected():
+                    print(f"Client disconnected, cancelled batch after {succeeded + failed} of {total} answers")
+                    return
+                if "error" in result:
+                    failed += 1
+                else:
+                    succeeded += 1
+                yield json.dumps({"type": "result", **result}) + "\n"
+            yield json.dumps({"type": "done", "stats": stats()}) + "\n"
+        except asyncio.CancelledError:
+            print(f"Client disconnected, cancelled batch after {succeeded + failed} of {total} answers")
+            raise
+        except SchedulerBusyError as e:
+            yield json.dumps({"type": "error", "detail": str(e), "retry_after": e.retry_after, "stats": stats()}) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": str(e), "stats": stats()}) + "\n"
+        finally:
+            # Stops the answers still being generated
+            await results.aclose()
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
+
+
+def require_model(model: Optional[str]) -> None:
+    if model is not None and not chat_page.has_model(model):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Model '{model}' is not available"
+        )
+
+def model_busy(e: ModelBusyError) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+
+def too_many_requests(e: SchedulerBusyError) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def admit(lane: str = INTERACTIVE) -> None:
+    # Turn a request away before retrieval or search work is done for it
+    try:
+        get_scheduler().admit(lane)
+    except SchedulerBusyError as e:
+        raise too_many_requests(e)
+
 
 @app.post("/ask", response_model=NormalChatResponse)
 async def ask(query: NormalChatRequest):
+    await chat_page.aload("chat_history")
+    require_model(query.model)
+    admit()
     try:
-        response = chat_page.ask(query.query)
-        return NormalChatResponse(text=response)
+        session_id = query.session_id or DEFAULT_SESSION_ID
+        metadata = {}
+        response = await chat_page.aask(query.query, session_id=session_id, metadata=metadata, model=query.model)
+        return NormalChatResponse(text=response, session_id=session_id, **metadata)
+    except ModelBusyError as e:
+        raise model_busy(e)
+    except SchedulerBusyError as e:
+        raise too_many_requests(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.post("/ask-stream")
+async def ask_stream(query: NormalChatRequest, request: Request):
+    await chat_page.aload("chat_history")
+    require_model(query.model)
+    admit()
+    metadata = {}
+    return stream_tokens(request, chat_page.stream_ask(query.query, query.session_id, metadata, query.model), metadata)
+    
 @app.get("/get-models", response_model=GetModelsResponse)
 async def get_models():
+    await chat_page.aload()
     return chat_page.get_models()
 
 @app.post("/set-model", response_model=SetModelResponse)
 async def set_model(update_model: SetModelRequest):
     try:
-        chat_page.set_model(update_model.update_model)
+        await chat_page.aload()
+        result = chat_page.set_model(update_model.update_model)
+        if result["success"]:
+            # Load the new model in the background so the first question doesn't wait for it
+            asyncio.ensure_future(warm_up_in_background(update_model.update_model))
         return SetModelResponse(success=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def warm_up_in_background(model: str):
+    try:
+        await chat_page.aload("chat_history")
+        result = await chat_page.awarm_up_model(model)
+        print(f"Warmed up {model} in {result['load_duration']:.2f}s")
+    except Exception as e:
+        print(f"Error warming up {model}: {str(e)}")
+
+@app.post("/warm-up-model", response_model=WarmUpModelResponse)
+async def warm_up_model(request: WarmUpModelRequest):
+    try:
+        await chat_page.aload("chat_history")
+        return await chat_page.awarm_up_model(request.model)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/get-current-model", response_model=GetCurrentModelResponse)
 async def get_current_model():
+    await chat_page.aload()
     return chat_page.get_current_model()
 
 
+def save_upload(source, path: Path) -> str:
+    """Copy an upload to path, returning the SHA-256 of its contents"""
+    digest = hashlib.sha256()
+    with path.open("wb") as buffer:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+            buffer.write(block)
+    return digest.hexdigest()
+
 @app.post("/add-document", 
           response_model=AddDocumentResponse,
-          status_code=status.HTTP_201_CREATED)
-async def add_document(file: UploadFile = File(...)):
+          status_code=status.HTTP_202_ACCEPTED)
+async def add_document(response: Response, file: UploadFile = File(...), collection: Optional[str] = None):
     # Validate file existence
     if not file:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="No file uploaded"
         )
+    await chat_page.aload("chat_files")
+    require_collections([collection] if collection else None)
     
     # Validate file type
     if not file.filename.lower().endswith('.pdf'):
@@ -71,44 +257,146 @@ async def add_document(file: UploadFile = File(...)):
         temp_dir = Path("temp")
         temp_dir.mkdir(exist_ok=True)
         
-        # Generate safe filename and create full path
+        # Generate safe filename and create full path, unique per upload
+        # so concurrent uploads of the same file don't overwrite each other
         safe_filename = file.filename.replace(" ", "_")
-        temp_file_path = temp_dir / safe_filename
+        temp_file_path = temp_dir / f"{uuid.uuid4().hex}_{safe_filename}"
         
-        # Save uploaded file to temporary location
+        # Save uploaded file to temporary location, fingerprinting it on the way
         try:
-            with temp_file_path.open("wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            digest = await run_in_pool(save_upload, file.file, temp_file_path)
         finally:
             await file.close()  # Ensure file is closed using await
-            
-        # Process document using ChatWithFiles
-        success = chat_page.add_document(str(temp_file_path))
-        
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to process document"
-            )
-            
-        return AddDocumentResponse(
-            success=True
-        )
-        
+
     except Exception as e:
-        # Log the error (you should replace this with proper logging)
-        print(f"Error processing document: {str(e)}")
-        
+        print(f"Error saving document: {str(e)}")
+        if 'temp_file_path' in locals() and temp_file_path.exists():
+            temp_file_path.unlink()
+
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error processing document: {str(e)}"
+            detail=f"Error saving document: {str(e)}"
         )
-        
-    finally:
-        # Clean up temporary file
-        if 'temp_file_path' in locals() and temp_file_path.exists():
+
+    # Re-uploading a file the collection already has is a no-op
+    existing = await chat_page.afind_document(collection, file.filename, digest)
+    if existing["unchanged"]:
+        temp_file_path.unlink()
+        response.status_code = status.HTTP_200_OK
+        return AddDocumentResponse(
+            success=True,
+            document_id=existing["document_id"],
+            collection=collection,
+            unchanged=True,
+            pages_skipped=existing["pages"],
+            pages_updated=0,
+            pages_removed=0
+        )
+
+    # The catalog only records the file hash once ingestion ends
+    upload_key = (collection or "default", digest)
+    if upload_key in pending_uploads:
+        temp_file_path.unlink()
+        pending_job, pending_document_id = pending_uploads[upload_key]
+        return AddDocumentResponse(
+            success=True, job_id=pending_job.id, document_id=pending_document_id, collection=collection
+        )
+
+    # Process document using ChatWithFiles in the background. A revision
+    # of a stored document keeps its id and only re-embeds changed pages.
+    document_id = existing["document_id"] or uuid.uuid4().hex
+    async def ingest(job):
+        # Embedding calls of ingest jobs give way to interactive requests
+        with scheduler_lane(BULK):
+            success = await chat_page.aadd_document(
+                str(temp_file_path), job.update_progress, collection, document_id, file.filename, digest
+            )
+        if not success:
+            raise RuntimeError("Failed to process document")
+
+    def cleanup():
+        pending_uploads.pop(upload_key, None)
+        if temp_file_path.exists():
             temp_file_path.unlink()
+
+    job = ingest_jobs.submit(ingest, name=safe_filename, cleanup=cleanup)
+    pending_uploads[upload_key] = (job, document_id)
+    return AddDocumentResponse(success=True, job_id=job.id, document_id=document_id, collection=collection)
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return JobStatusResponse(**job.to_dict())
+
+@app.post("/jobs/{job_id}/cancel", response_model=JobStatusResponse)
+async def cancel_job(job_id: str):
+    job = ingest_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return JobStatusResponse(**job.to_dict())
     
+def require_collections(names: Optional[List[str]]) -> None:
+    missing = [name for name in names or [] if not chat_page.has_collection(name)]
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Collection not found: {', '.join(missing)}"
+        )
+
+@app.get("/collections", response_model=ListCollectionsResponse)
+async def list_collections():
+    await chat_page.aload("chat_files")
+    return ListCollectionsResponse(collections=await chat_page.alist_collections())
+
+@app.post("/collections",
+          response_model=CollectionInfo,
+          status_code=status.HTTP_201_CREATED)
+async def create_collection(request: CreateCollectionRequest):
+    await chat_page.aload("chat_files")
+    if chat_page.has_collection(request.name):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Collection already exists: {request.name}"
+        )
+    try:
+        return CollectionInfo(**await chat_page.acreate_collection(request.name))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@app.delete("/collections/{name}", response_model=DeleteCollectionResponse)
+async def delete_collection(name: str):
+    await chat_page.aload("chat_files")
+    require_collections([name])
+    try:
+        await chat_page.adelete_collection(name)
+        return DeleteCollectionResponse(success=True)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@app.get("/collections/{name}/documents", response_model=ListDocumentsResponse)
+async def list_documents(name: str):
+    await chat_page.aload("chat_files")
+    require_collections([name])
+    return ListDocumentsResponse(collection=name, documents=await chat_page.alist_documents(name))
+
+@app.delete("/collections/{name}/documents/{document_id}", response_model=DeleteDocumentResponse)
+async def delete_document(name: str, document_id: str):
+    await chat_page.aload("chat_files")
+    require_collections([name])
+    try:
+        removed = await chat_page.adelete_document(name, document_id)
+        return DeleteDocumentResponse(success=True, chunks_removed=removed)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
 @app.post("/chat-with-file", 
           response_model=ChatWithFileResponse,
           status_code=status.HTTP_200_OK)
@@ -118,10 +406,15 @@ async def chat_with_file(request: ChatWithFileRequest):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Query cannot be empty"
         )
+    await chat_page.aload("chat_files")
+    require_collections(request.collections)
+    require_model(request.model)
+    admit()
     
     try:
         # Use the ChatWithFiles instance to get response
-        response = chat_page.chat_with_file(request.request)
+        metadata = {}
+        response = await chat_page.achat_with_file(request.request, metadata, request.collections, request.model)
         
         if not response:
             raise HTTPException(
@@ -129,32 +422,95 @@ async def chat_with_file(request: ChatWithFileRequest):
                 detail="No relevant information found"
             )
             
-        return ChatWithFileResponse(response=response)
+        return ChatWithFileResponse(response=response, **metadata)
         
+    except ModelBusyError as e:
+        raise model_busy(e)
+    except SchedulerBusyError as e:
+        raise too_many_requests(e)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error generating response: {str(e)}"
         )
 
+@app.post("/chat-with-file-stream")
+async def chat_with_file_stream(query: ChatWithFileRequest, request: Request):
+    if not query.request.strip():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Query cannot be empty"
+        )
+    await chat_page.aload("chat_files")
+    require_collections(query.collections)
+    require_model(query.model)
+    admit()
+    metadata = {}
+    return stream_tokens(
+        request, chat_page.stream_chat_with_file(query.request, metadata, query.collections, query.model), metadata
+    )
+
+@app.post("/chat-with-file-batch")
+async def chat_with_file_batch(query: ChatWithFileBatchRequest, request: Request):
+    if not query.questions or any(not question.strip() for question in query.questions):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Questions cannot be empty"
+        )
+    await chat_page.aload("chat_files")
+    max_questions = chat_page.get_batch_max_questions()
+    if len(query.questions) > max_questions:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch can hold at most {max_questions} questions"
+        )
+    if query.concurrency is not None and query.concurrency < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Concurrency must be at least 1"
+        )
+    require_collections(query.collections)
+    require_model(query.model)
+    admit(BULK)
+    return stream_results(
+        request,
+        chat_page.stream_chat_with_file_batch(query.questions, query.collections, query.model, query.concurrency),
+        len(query.questions)
+    )
+
 @app.post("/perform-web-search", response_model=WebSearchResponse)
 async def perform_web_search(query: NormalChatRequest):
+    await chat_page.aload("chat_web")
+    require_model(query.model)
+    admit()
     try:
         # Get raw response from web search
-        reply = chat_page.perform_web_search(query.query)
-        
-        
-        
-        return WebSearchResponse(reply=reply)
+        metadata = {}
+        reply = await chat_page.aperform_web_search(query.query, metadata, query.model)
+
+        return WebSearchResponse(reply=reply, **metadata)
+    except ModelBusyError as e:
+        raise model_busy(e)
+    except SchedulerBusyError as e:
+        raise too_many_requests(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/perform-web-search-stream")
+async def perform_web_search_stream(query: NormalChatRequest, request: Request):
+    await chat_page.aload("chat_web")
+    require_model(query.model)
+    admit()
+    metadata = {}
+    return stream_tokens(request, chat_page.stream_web_search(query.query, metadata, query.model), metadata)
+
 
 @app.get("/get-config", 
          response_model=ConfigResponse,
          status_code=status.HTTP_200_OK)
 async def get_config():
     try:
+        await chat_page.aload("chat_files", "chat_web")
         config = settings_page.get_config()
         return ConfigResponse(**config)
     except Exception as e:
@@ -168,26 +524,123 @@ async def get_config():
          status_code=status.HTTP_200_OK)
 async def update_config(config: UpdateConfigRequest):
     try:
+        await chat_page.aload("chat_files", "chat_web")
         settings_page.update_config(
             embedding_model=config.embedding_model,
             chunk_size=config.chunk_size,
             chunk_overlap=config.chunk_overlap,
-            top_k=config.top_k
+            top_k=config.top_k,
+            index_type=config.index_type,
+            ann_promotion_threshold=config.ann_promotion_threshold,
+            ivf_nlist=config.ivf_nlist,
+            ivf_nprobe=config.ivf_nprobe,
+            pq_m=config.pq_m,
+            pq_nbits=config.pq_nbits,
+            hnsw_m=config.hnsw_m,
+            hnsw_ef_construction=config.hnsw_ef_construction,
+            hnsw_ef_search=config.hnsw_ef_search,
+            model_options={
+                model: options.model_dump(exclude_none=True) for model, options in config.model_options.items()
+            } if config.model_options else None
         )
         # Return the updated configuration
         return ConfigResponse(**settings_page.get_config())
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
     
+@app.get("/embedding-cache-stats",
+         response_model=EmbeddingCacheStatsResponse,
+         status_code=status.HTTP_200_OK)
+async def embedding_cache_stats():
+    await chat_page.aload("chat_files")
+    return EmbeddingCacheStatsResponse(**settings_page.get_embedding_cache_stats())
+
+@app.get("/response-cache-stats",
+         response_model=ResponseCacheStatsResponse,
+         status_code=status.HTTP_200_OK)
+async def response_cache_stats():
+    await chat_page.aload("chat_files")
+    return ResponseCacheStatsResponse(**settings_page.get_response_cache_stats())
+
+@app.get("/web-cache-stats",
+         response_model=WebCacheStatsResponse,
+         status_code=status.HTTP_200_OK)
+async def web_cache_stats():
+    await chat_page.aload("chat_web")
+    return WebCacheStatsResponse(**settings_page.get_web_cache_stats())
+
+@app.get("/model-pool-stats",
+         response_model=ModelPoolStatsResponse,
+         status_code=status.HTTP_200_OK)
+async def model_pool_stats():
+    await chat_page.aload("chat_history")
+    return ModelPoolStatsResponse(**chat_page.get_model_pool_stats())
+
+@app.get("/scheduler-stats",
+         response_model=SchedulerStatsResponse,
+         status_code=status.HTTP_200_OK)
+async def scheduler_stats():
+    return SchedulerStatsResponse(lanes=get_scheduler().stats())
+
+# Cumulative lookup counters of each cache's stats, exported by result
+CACHE_RESULTS = {
+    "embedding": {"hit": "hits", "miss": "misses"},
+    "response": {"hit": "hits", "semantic_hit": "semantic_hits", "miss": "misses"},
+    "web_search": {"hit": "search_hits", "miss": "search_misses"},
+    "web_page": {"hit": "page_hits", "revalidated": "page_revalidations", "miss": "page_misses"},
+}
+
+def update_gauges() -> None:
+    caches = settings_page.get_loaded_cache_stats()
+    if "web" in caches:
+        caches["web_search"] = caches["web_page"] = caches.pop("web")
+    for cache, results in CACHE_RESULTS.items():
+        if cache in caches:
+            for result, key in results.items():
+                CACHE_REQUESTS.set_total(caches[cache][key], cache=cache, result=result)
+    for cache, key in (("embedding", "entries"), ("response", "entries"), ("web_search", "searches"),
+                       ("web_page", "pages"), ("web_store", "chunks")):
+        if cache in caches:
+            CACHE_ENTRIES.set(caches[cache][key], cache=cache)
+
+    for lane, stats in get_scheduler().stats().items():
+        QUEUE_ACTIVE.set(stats["active"], queue="scheduler", name=lane)
+        QUEUE_WAITING.set(stats["waiting"], queue="scheduler", name=lane)
+        QUEUE_REJECTED.set_total(stats["rejected"], queue="scheduler", name=lane)
+    for model, stats in get_model_pool().stats()["models"].items():
+        QUEUE_ACTIVE.set(stats["active"], queue="model", name=model)
+        QUEUE_WAITING.set(stats["waiting"], queue="model", name=model)
+        QUEUE_REJECTED.set_total(stats["rejected"], queue="model", name=model)
+    statuses = [job.status for job in ingest_jobs.jobs.values()]
+    QUEUE_ACTIVE.set(statuses.count(RUNNING), queue="jobs", name="ingest")
+    QUEUE_WAITING.set(statuses.count(QUEUED), queue="jobs", name="ingest")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    update_gauges()
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/web-store-stats",
+         response_model=WebStoreStatsResponse,
+         status_code=status.HTTP_200_OK)
+async def web_store_stats():
+    await chat_page.aload("chat_web")
+    return WebStoreStatsResponse(**settings_page.get_web_store_stats())
+
 @app.post("/clear-vector-db", 
           response_model=ClearVectorDBResponse,
           status_code=status.HTTP_200_OK)
 async def clear_vector_db(request: ClearVectorDBRequest):
     try:
-        settings_page.clear_vector_db(request.request)
+        await chat_page.aload("chat_files", "chat_web")
+        # Ingest jobs would write into the stores being deleted
+        await ingest_jobs.cancel_all()
+        await settings_page.aclear_vector_db(request.request)
         return ClearVectorDBResponse(response=True)
     
     except Exception as e:
@@ -196,6 +649,10 @@ async def clear_vector_db(request: ClearVectorDBRequest):
             detail=str(e)
         )
 
+@app.on_event("shutdown")
+async def shutdown():
+    await ingest_jobs.shutdown()
+
 @app.get("/")
 async def root():
     return {"message": "This is a backend for Ollama Web UI"}
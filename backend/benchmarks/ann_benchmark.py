@@ -0,0 +1,107 @@
+"""
+Recall/latency benchmark of the ANN index types against the flat baseline.
+
+    python benchmarks/ann_benchmark.py --num-vectors 200000 --dim 768
+    python benchmarks/ann_benchmark.py --store-dir ../temp/vector_store
+
+Vectors come from a persisted vector store or are generated as Gaussian
+clusters (roughly how document embeddings are distributed). Each index
+type is built with the same helpers the app uses, then swept over its
+search parameter, reporting recall@k against exact search and per-query
+latency.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.vector_index import DEFAULT_INDEX_CONFIG, build_index, reconstruct_all  # noqa: E402
+
+
+def load_vectors(store_dir: str) -> np.ndarray:
+    with open(os.path.join(store_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    generation = manifest["generation"]
+    vectors = reconstruct_all(faiss.read_index(os.path.join(store_dir, f"index.{generation}.faiss")))
+    segment = np.fromfile(os.path.join(store_dir, f"segment.{generation}.f32"), dtype="float32")
+    return np.vstack([vectors, segment.reshape(-1, manifest["dim"])])
+
+
+def synthetic_vectors(num_vectors: int, dim: int, clusters: int = 100) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(clusters, dim)).astype("float32")
+    labels = rng.integers(clusters, size=num_vectors)
+    return centers[labels] + 0.3 * rng.normal(size=(num_vectors, dim)).astype("float32")
+
+
+def measure(index, queries: np.ndarray, k: int):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies) * 1000
+
+
+def recall(results: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(r) & set(t)) for r, t in zip(results, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--store-dir", help="persisted vector store to read vectors from")
+    parser.add_argument("--num-vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[32, 64, 128])
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)
+    vectors = load_vectors(args.store_dir) if args.store_dir else synthetic_vectors(args.num_vectors, args.dim)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype("float32")
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, {args.queries} queries, k={args.k}\n")
+
+    config = dict(DEFAULT_INDEX_CONFIG)
+    print(f"{'index':<10} {'param':<20} {'build s':>8} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8}")
+
+    start = time.perf_counter()
+    flat = build_index(vectors, "flat", config)
+    build_time = time.perf_counter() - start
+    truth, latencies = measure(flat, queries, args.k)
+    print(f"{'flat':<10} {'-':<20} {build_time:>8.2f} {1.0:>7.3f} "
+          f"{np.percentile(latencies, 50):>8.3f} {np.percentile(latencies, 99):>8.3f}")
+
+    sweeps = {
+        "ivf_flat": ("ivf_nprobe", args.nprobe),
+        "ivf_pq": ("ivf_nprobe", args.nprobe),
+        "hnsw": ("hnsw_ef_search", args.ef_search),
+    }
+    for kind, (param, values) in sweeps.items():
+        start = time.perf_counter()
+        index = build_index(vectors, kind, config)
+        build_time = time.perf_counter() - start
+        for value in values:
+            if param == "ivf_nprobe":
+                faiss.extract_index_ivf(index).nprobe = value
+            else:
+                faiss.downcast_index(index).hnsw.efSearch = value
+            results, latencies = measure(index, queries, args.k)
+            print(f"{kind:<10} {f'{param}={value}':<20} {build_time:>8.2f} {recall(results, truth):>7.3f} "
+                  f"{np.percentile(latencies, 50):>8.3f} {np.percentile(latencies, 99):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+The backend app with web search answered by fake_web.py, for bench_suite.py.
+
+    BENCH_SEARCH_URL=http://127.0.0.1:8889 uvicorn bench_app:app
+
+Everything else is the unmodified backend; only WebSearchRAG.search, the
+call to DuckDuckGo, is pointed at the stub search engine.
+"""
+import os
+from typing import Dict, List
+
+import httpx
+
+from backend import app  # noqa: F401
+from utils.chat_with_web import WebSearchRAG
+
+SEARCH_URL = os.environ["BENCH_SEARCH_URL"]
+
+
+def stub_search(self, query: str, max_results: int) -> List[Dict]:
+    response = httpx.get(f"{SEARCH_URL}/search", params={"q": query}, timeout=self.config["fetch_timeout"])
+    response.raise_for_status()
+    return response.json()["results"][:max_results]
+
+
+WebSearchRAG.search = stub_search
@@ -0,0 +1,337 @@
+"""
+Offline benchmark of the backend's hot paths against stub servers.
+
+    python benchmarks/bench_suite.py --save-baseline benchmarks/results/baseline.json
+    python benchmarks/bench_suite.py --baseline benchmarks/results/baseline.json
+
+Starts fake_ollama.py, fake_web.py and the backend in a throwaway working
+directory, so no network, Ollama or existing index is touched. Then it
+runs each scenario:
+
+    ingest        /add-document with generated PDFs of several sizes, to job completion
+    file_chat     /chat-with-file over the ingested documents, concurrently
+    web_search    /perform-web-search through the stub search engine and pages
+    history       /ask turns in one session, showing how latency grows with history
+
+Each scenario reports throughput, p50/p99 latency and the backend's peak
+RSS. The response cache is off so every request runs the full pipeline.
+Given a baseline, scenarios whose throughput drops, or whose p99 latency
+or peak RSS grows, by more than --tolerance are reported as regressions
+and the exit status is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BENCHMARK_DIR, "..")
+
+# Fixture PDFs generated for the ingest scenario, name -> pages
+FIXTURES = {"small": 5, "medium": 40, "large": 150}
+QUICK_FIXTURES = {"small": 3, "medium": 10}
+FIXTURE_WORDS = (
+    "valve pressure torque bolt gasket sensor relay circuit voltage current calibration "
+    "inspection interval maintenance warranty filter pump seal bearing housing assembly"
+).split()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def make_fixture_pdf(path: str, pages: int, seed: int) -> None:
+    import fitz
+    rng = random.Random(seed)
+    document = fitz.open()
+    for number in range(pages):
+        page = document.new_page()
+        lines = [
+            f"Section {number}. Part PN-{seed * 1000 + number}: " + " ".join(rng.choice(FIXTURE_WORDS) for _ in range(10))
+            for _ in range(40)
+        ]
+        page.insert_text((50, 50), "\n".join(lines), fontsize=9)
+    document.save(path)
+
+
+def peak_rss_mb(pid: int):
+    """High-water mark of the process's resident memory, None where /proc isn't available"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 1024 / 1024
+    except Exception:
+        return None
+
+
+class Servers:
+    """The stub servers and the backend, running in a temporary working directory"""
+
+    def __init__(self, args):
+        self.args = args
+        self.root = tempfile.mkdtemp(prefix="bench-")
+        self.cwd = os.path.join(self.root, "backend")
+        self.ollama_port = free_port()
+        self.web_port = free_port()
+        self.backend_port = free_port()
+        self.processes = []
+        self.backend = None
+
+    def __enter__(self):
+        os.makedirs(self.cwd)
+        os.makedirs(os.path.join(self.root, "config"))
+        config = {
+            "embedding_model": "fake-embed:latest",
+            "response_cache_enabled": False,
+            # Every stub page is on one host, unlike real search results
+            "fetch_per_host_limit": 8,
+        }
+        with open(os.path.join(self.root, "config", "config.json"), "w") as f:
+            json.dump(config, f)
+
+        python = sys.executable
+        self.start([python, os.path.join(BENCHMARK_DIR, "fake_ollama.py"), "--port", str(self.ollama_port),
+                    "--token-latency", str(self.args.token_latency), "--tokens", str(self.args.tokens)])
+        self.start([python, os.path.join(BENCHMARK_DIR, "fake_web.py"), "--port", str(self.web_port)])
+        env = {
+            **os.environ,
+            # bench_app.py wraps the backend, sending its web searches to the stub
+            "PYTHONPATH": os.pathsep.join([os.path.abspath(BACKEND_DIR), BENCHMARK_DIR]),
+            "OLLAMA_HOST": f"http://127.0.0.1:{self.ollama_port}",
+            "BENCH_SEARCH_URL": f"http://127.0.0.1:{self.web_port}",
+        }
+        self.backend = self.start(
+            [python, "-m", "uvicorn", "bench_app:app", "--port", str(self.backend_port), "--log-level", "warning"],
+            cwd=self.cwd, env=env
+        )
+        self.wait_ready(f"http://127.0.0.1:{self.backend_port}/")
+        return self
+
+    def start(self, command, **kwargs) -> subprocess.Popen:
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+        self.processes.append(process)
+        return process
+
+    def wait_ready(self, url: str, timeout: float = 60) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if any(process.poll() is not None for process in self.processes):
+                raise RuntimeError("A benchmark server exited during startup")
+            try:
+                if httpx.get(url).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{url} didn't come up within {timeout}s")
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def summarize(latencies: list, wall: float, rss, **extra) -> dict:
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "mean": sum(latencies) / len(latencies),
+        "peak_rss_mb": rss,
+        **extra,
+    }
+
+
+async def run_concurrently(count: int, concurrency: int, request) -> tuple:
+    """Run request(i) for i in range(count), at most concurrency at a time; returns (latencies, wall)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await request(i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(count)))
+    return latencies, time.perf_counter() - start
+
+
+async def bench_ingest(client, servers, fixtures: dict) -> dict:
+    latencies, pages = [], 0
+    start = time.perf_counter()
+    for seed, (name, count) in enumerate(fixtures.items()):
+        path = os.path.join(servers.root, f"{name}.pdf")
+        make_fixture_pdf(path, count, seed)
+        upload_start = time.perf_counter()
+        with open(path, "rb") as f:
+            response = await client.post("/add-document", files={"file": (f"{name}.pdf", f, "application/pdf")})
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        while True:
+            job = (await client.get(f"/jobs/{job_id}")).json()
+            if job["status"] not in ("queued", "running"):
+                break
+            await asyncio.sleep(0.05)
+        if job["status"] != "succeeded":
+            raise RuntimeError(f"Ingest of {name}.pdf {job['status']}: {job['error']}")
+        latencies.append(time.perf_counter() - upload_start)
+        pages += count
+    wall = time.perf_counter() - start
+    return summarize(latencies, wall, peak_rss_mb(servers.backend.pid), pages_per_second=pages / wall)
+
+
+async def bench_file_chat(client, servers, count: int, concurrency: int) -> dict:
+    async def request(i):
+        response = await client.post("/chat-with-file", json={"request": f"What is the torque for part PN-{1000 + i}?"})
+        response.raise_for_status()
+    latencies, wall = await run_concurrently(count, concurrency, request)
+    return summarize(latencies, wall, peak_rss_mb(servers.backend.pid))
+
+
+async def bench_web_search(client, servers, count: int, concurrency: int) -> dict:
+    async def request(i):
+        response = await client.post("/perform-web-search", json={"query": f"how are {i} bridges surveyed"})
+        response.raise_for_status()
+        if isinstance(response.json()["reply"], dict):
+            raise RuntimeError(f"Web search failed: {response.json()['reply']}")
+    latencies, wall = await run_concurrently(count, concurrency, request)
+    return summarize(latencies, wall, peak_rss_mb(servers.backend.pid))
+
+
+async def bench_history(client, servers, turns: int) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for turn in range(turns):
+        turn_start = time.perf_counter()
+        response = await client.post("/ask", json={"query": f"Tell me fact number {turn}.", "session_id": "bench"})
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - turn_start)
+    wall = time.perf_counter() - start
+    window = max(1, turns // 5)
+    first = sum(latencies[:window]) / window
+    last = sum(latencies[-window:]) / window
+    return summarize(latencies, wall, peak_rss_mb(servers.backend.pid), latency_growth=last / first)
+
+
+async def run(args) -> dict:
+    fixtures = QUICK_FIXTURES if args.quick else FIXTURES
+    scale = 4 if args.quick else 1
+    results = {}
+    with Servers(args) as servers:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{servers.backend_port}", timeout=300) as client:
+            # One request per subsystem first, so lazy initialization isn't timed
+            (await client.post("/ask", json={"query": "warm up", "session_id": "warm-up"})).raise_for_status()
+            results["ingest"] = await bench_ingest(client, servers, fixtures)
+            results["file_chat"] = await bench_file_chat(client, servers, args.requests // scale, args.concurrency)
+            results["web_search"] = await bench_web_search(client, servers, args.requests // (2 * scale), args.concurrency)
+            results["history"] = await bench_history(client, servers, args.turns // scale)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of results against baseline beyond tolerance, as messages"""
+    regressions = []
+    for scenario, current in results.items():
+        previous = baseline.get(scenario)
+        if previous is None:
+            continue
+        if current["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(f"{scenario}: throughput {current['throughput']:.2f}/s, baseline {previous['throughput']:.2f}/s")
+        if current["p99"] > previous["p99"] * (1 + tolerance):
+            regressions.append(f"{scenario}: p99 {current['p99'] * 1000:.0f}ms, baseline {previous['p99'] * 1000:.0f}ms")
+        if current["peak_rss_mb"] and previous.get("peak_rss_mb") and current["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{scenario}: peak RSS {current['peak_rss_mb']:.0f}MB, baseline {previous['peak_rss_mb']:.0f}MB")
+    return regressions
+
+
+def print_results(results: dict, baseline: dict = None) -> None:
+    print(f"{'scenario':<12} {'requests':>8} {'throughput':>12} {'p50':>9} {'p99':>9} {'peak RSS':>10}")
+    for scenario, r in results.items():
+        rss = f"{r['peak_rss_mb']:.0f}MB" if r["peak_rss_mb"] else "n/a"
+        print(f"{scenario:<12} {r['requests']:>8} {r['throughput']:>10.2f}/s {r['p50'] * 1000:>7.0f}ms "
+              f"{r['p99'] * 1000:>7.0f}ms {rss:>10}")
+        if baseline and scenario in baseline:
+            b = baseline[scenario]
+            print(f"{'  baseline':<12} {b['requests']:>8} {b['throughput']:>10.2f}/s {b['p50'] * 1000:>7.0f}ms "
+                  f"{b['p99'] * 1000:>7.0f}ms {(b.get('peak_rss_mb') or 0):>8.0f}MB")
+    if "ingest" in results:
+        print(f"ingest: {results['ingest']['pages_per_second']:.1f} pages/s")
+    if "history" in results:
+        print(f"history: last turns take {results['history']['latency_growth']:.2f}x as long as the first")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=80, help="file chat requests, half as many web searches")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=40, help="turns of the history scenario")
+    parser.add_argument("--tokens", type=int, default=32, help="tokens the fake model generates per answer")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="seconds per generated token")
+    parser.add_argument("--quick", action="store_true", help="smaller fixtures and fewer requests")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--save-baseline", help="write the results as the baseline to compare later runs with")
+    parser.add_argument("--baseline", help="compare against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "save_baseline", "baseline")},
+        "results": results,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
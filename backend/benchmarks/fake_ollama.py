@@ -0,0 +1,139 @@
+"""
+Stand-in for the Ollama API for offline benchmarks.
+
+    python benchmarks/fake_ollama.py --port 11535 --token-latency 0.005
+
+Serves the endpoints the backend uses: /api/tags, /api/ps, /api/embed,
+/api/chat and /api/generate. Embeddings are deterministic pseudo-random
+unit vectors seeded by the text, so repeated runs index identical data.
+Generations stream a fixed number of tokens after a prompt-evaluation
+delay proportional to the prompt length, and report eval counts and
+durations like Ollama does.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The backend answers with the last model listed
+MODELS = ["fake-embed:latest", "fake-chat:latest"]
+WORDS = "the model answers from the retrieved context with a short and direct reply".split()
+
+
+def embed(text: str, dim: int) -> list:
+    rng = random.Random(hashlib.sha256(text.encode()).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def prompt_text(body: dict) -> str:
+    if "messages" in body:
+        return "".join(str(message.get("content", "")) for message in body["messages"])
+    return body.get("prompt", "")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings: argparse.Namespace = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, payload: dict):
+        data = (json.dumps(payload) + "\n").encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            self.send_json({"models": [
+                {"name": name, "model": name, "modified_at": "2024-01-01T00:00:00Z", "size": 1, "digest": name, "details": {}}
+                for name in MODELS
+            ]})
+        elif self.path.startswith("/api/ps"):
+            self.send_json({"models": [{"name": name, "model": name} for name in MODELS]})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/embed":
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            time.sleep(self.settings.embed_latency * len(texts))
+            self.send_json({"model": body["model"], "embeddings": [embed(text, self.settings.dim) for text in texts]})
+        elif self.path in ("/api/chat", "/api/generate"):
+            self.generate(body)
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def generate(self, body: dict):
+        settings = self.settings
+        prompt = prompt_text(body)
+        prompt_tokens = max(1, len(prompt) // 4)
+        # An empty generate request only loads the model
+        tokens = settings.tokens if prompt else 0
+        prompt_seconds = settings.prompt_latency * prompt_tokens / 1000
+        chat = self.path == "/api/chat"
+
+        def frame(text: str, done: bool) -> dict:
+            payload = {"model": body["model"], "created_at": "2024-01-01T00:00:00Z", "done": done}
+            if chat:
+                payload["message"] = {"role": "assistant", "content": text}
+            else:
+                payload["response"] = text
+            if done:
+                payload.update(
+                    done_reason="stop", load_duration=0,
+                    prompt_eval_count=prompt_tokens, prompt_eval_duration=int(prompt_seconds * 1e9),
+                    eval_count=tokens, eval_duration=int(tokens * settings.token_latency * 1e9),
+                    total_duration=int((prompt_seconds + tokens * settings.token_latency) * 1e9),
+                )
+            return payload
+
+        time.sleep(prompt_seconds)
+        words = [WORDS[i % len(WORDS)] + " " for i in range(tokens)]
+        if not body.get("stream", True):
+            time.sleep(tokens * settings.token_latency)
+            final = frame("".join(words), True)
+            return self.send_json(final)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for word in words:
+            time.sleep(settings.token_latency)
+            self.send_chunk(frame(word, False))
+        self.send_chunk(frame("", True))
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11535)
+    parser.add_argument("--dim", type=int, default=256, help="embedding dimension")
+    parser.add_argument("--tokens", type=int, default=32, help="tokens generated per answer")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="seconds per generated token")
+    parser.add_argument("--prompt-latency", type=float, default=0.02, help="seconds per 1000 prompt tokens")
+    parser.add_argument("--embed-latency", type=float, default=0.0005, help="seconds per embedded text")
+    Handler.settings = parser.parse_args()
+    ThreadingHTTPServer((Handler.settings.host, Handler.settings.port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
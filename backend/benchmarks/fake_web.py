@@ -0,0 +1,97 @@
+"""
+Stand-in search engine and web pages for offline benchmarks.
+
+    python benchmarks/fake_web.py --port 8889
+
+/search?q=... answers with search results in the backend's own format
+({"title", "link", "snippet"}), pointing each query at --results pages of
+this server chosen by hashing the query. bench_app.py routes the
+backend's web search here.
+/pages/<n>.html serves a deterministic article with an ETag, answering
+conditional requests with 304 like a cache-friendly site.
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+TOPICS = ["rivers", "volcanoes", "bridges", "satellites", "orchards", "glaciers", "harbors", "deserts"]
+WORDS = (
+    "history design climate engineering survey report measure record structure energy "
+    "region season material network pressure surface current system observation method"
+).split()
+
+
+def page_html(number: int, paragraphs: int) -> str:
+    rng = random.Random(number)
+    topic = TOPICS[number % len(TOPICS)]
+    body = "".join(
+        "<p>" + " ".join(rng.choice(WORDS) for _ in range(60)) + f" {topic} {number}.</p>"
+        for _ in range(paragraphs)
+    )
+    return (
+        f"<html><head><title>Article {number} about {topic}</title><script>var x = 1;</script></head>"
+        f"<body><h1>Article {number} about {topic}</h1>{body}</body></html>"
+    )
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings: argparse.Namespace = None
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, body: bytes, content_type: str, status: int = 200, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/search":
+            query = parse_qs(url.query).get("q", [""])[0]
+            first = int(hashlib.sha256(query.encode()).hexdigest()[:8], 16) % self.settings.pages
+            base = f"http://{self.headers['Host']}"
+            results = [
+                {
+                    "title": f"Article {number}",
+                    "link": f"{base}/pages/{number}.html",
+                    "snippet": f"Result {rank} for {query}",
+                }
+                for rank, number in enumerate((first + i) % self.settings.pages for i in range(self.settings.results))
+            ]
+            self.send(json.dumps({"query": query, "results": results}).encode(), "application/json")
+        elif url.path.startswith("/pages/") and url.path.endswith(".html"):
+            number = int(url.path[len("/pages/"):-len(".html")])
+            etag = f'"page-{number}"'
+            time.sleep(self.settings.page_latency)
+            if self.headers.get("If-None-Match") == etag:
+                self.send(b"", "text/html", 304, {"ETag": etag})
+            else:
+                self.send(page_html(number, self.settings.paragraphs).encode(), "text/html", headers={"ETag": etag})
+        else:
+            self.send(b"not found", "text/plain", 404)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8889)
+    parser.add_argument("--pages", type=int, default=200, help="distinct pages served")
+    parser.add_argument("--results", type=int, default=3, help="results per search")
+    parser.add_argument("--paragraphs", type=int, default=8, help="paragraphs per page")
+    parser.add_argument("--page-latency", type=float, default=0.01, help="seconds before a page is served")
+    Handler.settings = parser.parse_args()
+    ThreadingHTTPServer((Handler.settings.host, Handler.settings.port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Fire concurrent requests at a running backend and check that they overlap.
+
+    python benchmarks/load_test.py --url http://localhost:8000 --concurrency 4
+
+Each /ask request is sent together with a /get-models probe. If the request
+path blocks the event loop the wall time approaches the sum of the request
+latencies and the probes wait behind generations; with the async path the
+wall time is close to the slowest request and probes return immediately.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+async def timed(client, method, path, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, path, **kwargs)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run(url: str, concurrency: int, question: str):
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        start = time.perf_counter()
+        asks = [timed(client, "POST", "/ask", json={"query": question}) for _ in range(concurrency)]
+        probes = [timed(client, "GET", "/get-models") for _ in range(concurrency)]
+        results = await asyncio.gather(*asks, *probes)
+        wall = time.perf_counter() - start
+
+    ask_times = results[:concurrency]
+    probe_times = results[concurrency:]
+    serial = sum(ask_times)
+    print(f"requests:          {concurrency}")
+    print(f"wall time:         {wall:.2f}s")
+    print(f"sum of latencies:  {serial:.2f}s")
+    print(f"slowest request:   {max(ask_times):.2f}s")
+    print(f"overlap factor:    {serial / wall:.2f}x (1.0x means fully serialized)")
+    print(f"max /get-models:   {max(probe_times) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--question", default="Write a short paragraph about the sea.")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.concurrency, args.question))
@@ -0,0 +1,60 @@
+"""
+Measure what the metrics and tracing instrumentation costs per request.
+
+    python benchmarks/metrics_overhead.py --iterations 100000
+
+Times a span outside any request, a span inside a request trace, the
+Ollama token accounting done after every generation, and rendering
+/metrics. A chat request records about ten spans and one generation, so
+its overhead is roughly ten traced spans plus one LLM call record, to be
+compared with generation times of hundreds of milliseconds.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.metrics import REGISTRY, record_llm_call, span, start_trace  # noqa: E402
+
+LLM_INFO = {
+    "model": "benchmark", "prompt_eval_count": 512, "prompt_eval_duration": 120_000_000,
+    "eval_count": 128, "eval_duration": 2_400_000_000, "load_duration": 0,
+}
+
+
+def per_call(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def untraced_span():
+    with span("benchmark"):
+        pass
+
+
+def run(iterations: int, spans_per_request: int):
+    results = {"span, no trace": per_call(untraced_span, iterations)}
+
+    trace, _ = start_trace("benchmark")
+    results["span, traced"] = per_call(untraced_span, iterations)
+    # The trace keeps its spans until the request ends, don't let it grow across the whole run
+    trace.spans.clear()
+    results["llm call record"] = per_call(lambda: (record_llm_call("benchmark", LLM_INFO), trace.spans.clear()), iterations)
+    results["render /metrics"] = per_call(REGISTRY.render, max(1, iterations // 1000))
+
+    for name, seconds in results.items():
+        print(f"{name:<18} {seconds * 1e6:8.2f}us")
+    request = spans_per_request * results["span, traced"] + results["llm call record"]
+    print(f"per request        {request * 1e6:8.2f}us ({spans_per_request} spans and one generation)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--spans-per-request", type=int, default=10)
+    args = parser.parse_args()
+    run(args.iterations, args.spans_per_request)
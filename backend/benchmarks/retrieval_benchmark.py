@@ -0,0 +1,168 @@
+"""
+Retrieval quality and latency of dense, BM25 and hybrid retrieval on a fixture corpus.
+
+    python benchmarks/retrieval_benchmark.py
+    python benchmarks/retrieval_benchmark.py --num-chunks 20000 --k 3
+    python benchmarks/retrieval_benchmark.py --ollama-model nomic-embed-text
+
+The corpus is generated deterministically: chunks of maintenance-manual
+style text about a handful of topics at named sites, each mentioning a
+unique part number and error code. Half of the queries ask about an
+identifier ("What does error E-4F2A mean?"), half paraphrase a chunk's
+topic sentence. Each query has exactly one relevant chunk; recall@k and
+MRR are reported with per-query latency percentiles.
+
+Without --ollama-model the dense side uses a hashing bag-of-words
+embedding over alphabetic words only, standing in for how embedding models
+blur identifiers into subword pieces. Use a real model for absolute
+numbers; the stand-in is for comparing retrievers offline.
+"""
+import argparse
+import hashlib
+import os
+import random
+import re
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.bm25_index import BM25Index  # noqa: E402
+from utils.rank_fusion import maximal_marginal_relevance, reciprocal_rank_fusion  # noqa: E402
+
+TOPICS = {
+    "hydraulic pump": ["pressure", "seal", "leak", "fluid", "valve", "flow"],
+    "cooling fan": ["airflow", "bearing", "noise", "blade", "temperature", "speed"],
+    "control board": ["firmware", "relay", "voltage", "fuse", "connector", "reset"],
+    "drive belt": ["tension", "pulley", "wear", "alignment", "slip", "motor"],
+    "sensor array": ["calibration", "signal", "drift", "probe", "reading", "cable"],
+}
+# Site names that make each chunk's topic sentence specific to it
+SITES = ("north south east west upper lower inner outer main spare front rear left right central "
+         "primary backup harbor river valley ridge forest desert canyon meadow summit coastal "
+         "alpine granite copper silver amber cobalt crimson indigo ivory jade onyx scarlet").split()
+FILLER = ("check the unit before service and record the result in the maintenance log "
+          "replace worn parts with approved spares and test the assembly after fitting").split()
+
+
+def make_corpus(num_chunks: int, seed: int = 0):
+    rng = random.Random(seed)
+    chunks, queries = [], []
+    for i in range(num_chunks):
+        topic = rng.choice(list(TOPICS))
+        words = rng.sample(TOPICS[topic], 3)
+        site = " ".join(rng.sample(SITES, 3))
+        part = f"PN-{10000 + i}"
+        code = f"E-{rng.getrandbits(16):04X}"
+        filler = " ".join(rng.choice(FILLER) for _ in range(30))
+        chunks.append(
+            f"At the {site} station the {topic} {words[0]} depends on the {words[1]} and {words[2]}. "
+            f"Part {part} covers this assembly. Error {code} means the {topic} {words[1]} failed. {filler}"
+        )
+        if i % 2:
+            queries.append((f"What does error {code} mean?", i))
+        else:
+            queries.append((f"How do {words[1]} and {words[2]} affect the {topic} {words[0]} at {site}?", i))
+    return chunks, queries
+
+
+class HashingEmbeddings:
+    """Signed feature hashing of alphabetic words, L2 normalized"""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype="float32")
+        for word in re.findall(r"[a-z]+", text.lower()):
+            digest = int(hashlib.md5(word.encode()).hexdigest(), 16)
+            vector[digest % self.dim] += 1 if (digest >> 64) & 1 else -1
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def embed_documents(self, texts):
+        return np.vstack([self.embed(text) for text in texts])
+
+
+class OllamaStandIn:
+    def __init__(self, model: str):
+        from langchain_ollama import OllamaEmbeddings
+        self.embeddings = OllamaEmbeddings(model=model)
+
+    def embed_documents(self, texts):
+        return np.asarray(self.embeddings.embed_documents(list(texts)), dtype="float32")
+
+
+def evaluate(name, retrieve, queries, k):
+    hits, reciprocal_ranks, latencies = 0, 0.0, []
+    for query, relevant in queries:
+        start = time.perf_counter()
+        ranked = retrieve(query)[:k]
+        latencies.append((time.perf_counter() - start) * 1000)
+        if relevant in ranked:
+            hits += 1
+            reciprocal_ranks += 1 / (ranked.index(relevant) + 1)
+    latencies = np.array(latencies)
+    print(f"{name:<14} recall@{k} {hits / len(queries):6.3f}   MRR {reciprocal_ranks / len(queries):6.3f}   "
+          f"p50 {np.percentile(latencies, 50):7.2f} ms   p95 {np.percentile(latencies, 95):7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--num-chunks", type=int, default=5000)
+    parser.add_argument("--num-queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--rrf-k", type=int, default=60)
+    parser.add_argument("--mmr-lambda", type=float, default=0.5)
+    parser.add_argument("--ollama-model", help="embed with this Ollama model instead of the offline stand-in")
+    args = parser.parse_args()
+
+    chunks, queries = make_corpus(args.num_chunks)
+    queries = random.Random(1).sample(queries, min(args.num_queries, len(queries)))
+    embeddings = OllamaStandIn(args.ollama_model) if args.ollama_model else HashingEmbeddings()
+
+    start = time.perf_counter()
+    chunk_vectors = embeddings.embed_documents(chunks)
+    index = faiss.IndexFlatL2(chunk_vectors.shape[1])
+    index.add(chunk_vectors)
+    print(f"Embedded and indexed {len(chunks)} chunks in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    bm25 = BM25Index()
+    bm25.add([str(i) for i in range(len(chunks))], chunks)
+    print(f"Built BM25 index in {time.perf_counter() - start:.1f}s")
+
+    query_vectors = dict(zip([q for q, _ in queries], embeddings.embed_documents([q for q, _ in queries])))
+
+    def dense(query, k=args.k):
+        _, ids = index.search(query_vectors[query][None, :], k)
+        return [int(i) for i in ids[0]]
+
+    def sparse(query, k=args.k):
+        return [int(doc_id) for doc_id, _ in bm25.search(query, k)]
+
+    def hybrid(query):
+        return [int(i) for i in reciprocal_rank_fusion(
+            [[str(i) for i in dense(query, args.fetch_k)], [str(i) for i in sparse(query, args.fetch_k)]],
+            args.rrf_k
+        )]
+
+    def hybrid_mmr(query):
+        candidates = hybrid(query)[:args.fetch_k]
+        positions = maximal_marginal_relevance(
+            query_vectors[query], chunk_vectors[candidates], args.k, args.mmr_lambda
+        )
+        return [candidates[p] for p in positions]
+
+    print(f"\n{len(queries)} queries, {len(chunks)} chunks")
+    evaluate("dense", dense, queries, args.k)
+    evaluate("bm25", sparse, queries, args.k)
+    evaluate("hybrid (rrf)", hybrid, queries, args.k)
+    evaluate("hybrid + mmr", hybrid_mmr, queries, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Report import and initialization time per backend component.
+
+    python benchmarks/startup_benchmark.py
+
+Every component is measured in a fresh interpreter so import caching from
+one measurement doesn't hide the cost of the next. Components that need
+Ollama report the error instead of a time when it isn't reachable.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# (name, module to import, expression constructing the component)
+COMPONENTS = [
+    ("backend app", "backend", None),
+    ("ModelData", "pages", "pages.ModelData().get_names()"),
+    ("ChatWithHistory", "utils.chat_with_history", "utils.chat_with_history.ChatWithHistory(pages.ModelData())"),
+    ("ChatWithFiles", "utils.chat_with_file", "utils.chat_with_file.ChatWithFiles(pages.ModelData())"),
+    ("WebSearchRAG", "utils.chat_with_web", "utils.chat_with_web.WebSearchRAG(pages.ModelData())"),
+]
+
+MEASURE = """
+import importlib, json, time
+start = time.perf_counter()
+module = importlib.import_module({module!r})
+import_time = time.perf_counter() - start
+result = {{"import": import_time, "init": None, "error": None}}
+if {init!r}:
+    import pages, utils
+    start = time.perf_counter()
+    try:
+        eval({init!r})
+        result["init"] = time.perf_counter() - start
+    except Exception as e:
+        result["error"] = str(e)
+print(json.dumps(result))
+"""
+
+
+def measure(module: str, init: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(module=module, init=init)],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per component, the best is reported")
+    args = parser.parse_args()
+
+    print(f"{'component':<18} {'import ms':>10} {'init ms':>10}")
+    for name, module, init in COMPONENTS:
+        runs = [measure(module, init) for _ in range(args.repeat)]
+        import_ms = min(run["import"] for run in runs) * 1000
+        inits = [run["init"] for run in runs if run["init"] is not None]
+        if inits:
+            init_ms = f"{min(inits) * 1000:>10.1f}"
+        elif init:
+            init_ms = f"  error: {runs[-1]['error']}"
+        else:
+            init_ms = f"{'-':>10}"
+        print(f"{name:<18} {import_ms:>10.1f} {init_ms}")
+
+
+if __name__ == "__main__":
+    main()
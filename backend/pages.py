@@ -1,87 +1,217 @@
-import ollama
 from typing import List, Dict, Any
+import asyncio
 import os
 import shutil
-from utils.chat_with_history import ChatWithHistory
-from utils.chat_with_file import ChatWithFiles
-from utils.chat_with_web import WebSearchRAG
+import threading
+from utils.model_options import get_model_options, warm_up_model
+from utils.session_store import DEFAULT_SESSION_ID
+
+# The chat subsystems pull in langchain, faiss, PyMuPDF and the web scraping
+# stack, so they are imported and constructed on first use rather than at
+# startup. The server accepts connections before Ollama has been contacted.
+# Async handlers construct what they need through ChatPage.aload, which
+# does the work in a thread so a slow Ollama doesn't stall the event loop.
 
 class ModelData:
     def __init__(self):
-        self.model_list = ollama.list()
-        self.model_names = [model.model for model in self.model_list.models]
-        # Set default model to the last one in the list
-        self.current_model = self.model_names[-1] if self.model_names else None
+        self._model_names = None
+        self._current_model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model_names is not None
+
+    def _load(self):
+        with self._lock:
+            if self._model_names is None:
+                import ollama
+                self.model_list = ollama.list()
+                self._model_names = [model.model for model in self.model_list.models]
+                # Set default model to the last one in the list
+                if self._current_model is None:
+                    self._current_model = self._model_names[-1] if self._model_names else None
+
+    @property
+    def model_names(self):
+        self._load()
+        return self._model_names
 
     def get_names(self):
         return self.model_names
     
     def set_model(self, current_model):
         if current_model in self.model_names:
-            self.current_model = current_model
+            self._current_model = current_model
             return True
         return False
 
     def get_current_model(self):
-        return self.current_model
+        self._load()
+        return self._current_model
    
 
     
 class ChatPage:
     def __init__(self):
         self.model_data = ModelData()
-        self.chat_history = ChatWithHistory(self.model_data)
-        self.chat_files = ChatWithFiles(self.model_data)
-        self.chat_web = WebSearchRAG(self.model_data)
-    
-    def ask(self, question: str, is_rag: bool = False) -> str:
-        if is_rag:
-            return self.chat_files.ask(question)
-        return self.chat_history.ask(question)
+        self._chat_history = None
+        self._chat_files = None
+        self._chat_web = None
+        self._init_lock = threading.Lock()
+
+    def is_loaded(self, subsystem: str) -> bool:
+        return getattr(self, f"_{subsystem}") is not None
+
+    async def aload(self, *subsystems: str) -> None:
+        """Fetch the model list and construct the named subsystems off the event loop"""
+        if not self.model_data.loaded:
+            await asyncio.to_thread(self.model_data._load)
+        for name in subsystems:
+            if not self.is_loaded(name):
+                await asyncio.to_thread(getattr, self, name)
+
+    @property
+    def chat_history(self):
+        with self._init_lock:
+            if self._chat_history is None:
+                from utils.chat_with_history import ChatWithHistory
+                self._chat_history = ChatWithHistory(self.model_data)
+            return self._chat_history
+
+    @property
+    def chat_files(self):
+        with self._init_lock:
+            if self._chat_files is None:
+                from utils.chat_with_file import ChatWithFiles
+                self._chat_files = ChatWithFiles(self.model_data)
+            return self._chat_files
+
+    @property
+    def chat_web(self):
+        with self._init_lock:
+            if self._chat_web is None:
+                from utils.chat_with_web import WebSearchRAG
+                self._chat_web = WebSearchRAG(self.model_data)
+            return self._chat_web
     
     def get_models(self) -> Dict[str, List[str]]:
         return {"models": self.model_data.get_names()}
     
     def set_model(self, current_model):
+        # Requests that don't name a model use the current one
         success = self.model_data.set_model(current_model)
-        if success:
-            # Reinitialize chat history with the same ModelData instance
-            self.chat_history = ChatWithHistory(self.model_data)
-            return {"success": True}
-        return {"success": False}
+        return {"success": success}
+
+    def has_model(self, model: str) -> bool:
+        return model in self.model_data.get_names()
+
+    def get_model_pool_stats(self) -> Dict[str, Any]:
+        return self.chat_history.model_pool.stats()
     
     def get_current_model(self) -> Dict[str, str]:
         return {"get_current_model": self.model_data.get_current_model()}
-    
-    def add_document(self, file_path: str) -> bool:
-        return self.chat_files.add_document(file_path)
-    
 
-    def perform_web_search(self, query: str) -> str:
-        return self.chat_web.ask(query)
+    def set_model_options(self, model_options: Dict[str, Dict[str, Any]]) -> None:
+        self.chat_files.set_model_options(model_options)
+        self.chat_web.set_model_options(model_options)
+        # Chat history picks up the saved options when it is rebuilt
+        with self._init_lock:
+            self._chat_history = None
+
+    async def awarm_up_model(self, model: str = None) -> Dict[str, Any]:
+        model = model or self.model_data.get_current_model()
+        return await warm_up_model(model, get_model_options(self.chat_history.config, model))
     
-    def chat_with_file(self, query: str) -> str:
-        return self.chat_files.ask(query)
+    async def aask(self, question: str, is_rag: bool = False, session_id: str = None, metadata: dict = None,
+                   model: str = None) -> str:
+        if is_rag:
+            return await self.chat_files.aask(question, metadata, model=model)
+        return await self.chat_history.aask(question, session_id or DEFAULT_SESSION_ID, metadata, model)
+
+    async def aadd_document(self, file_path: str, progress_callback=None, collection: str = None,
+                            document_id: str = None, name: str = None, digest: str = None) -> bool:
+        return await self.chat_files.aadd_document(file_path, progress_callback, collection, document_id, name, digest)
+
+    async def afind_document(self, collection: str, name: str, digest: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.chat_files.find_document, collection, name, digest)
+
+    def has_collection(self, name: str) -> bool:
+        return self.chat_files.has_collection(name)
+
+    async def alist_collections(self) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.chat_files.list_collections)
+
+    async def acreate_collection(self, name: str) -> Dict[str, Any]:
+        # Creating the store may probe the embedding model for its dimension
+        return await asyncio.to_thread(self.chat_files.create_collection, name)
+
+    async def adelete_collection(self, name: str) -> None:
+        await self.chat_files.adelete_collection(name)
+
+    async def alist_documents(self, collection: str) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.chat_files.list_documents, collection)
+
+    async def adelete_document(self, collection: str, document_id: str) -> int:
+        return await self.chat_files.adelete_document(collection, document_id)
+
+    async def aperform_web_search(self, query: str, metadata: dict = None, model: str = None) -> str:
+        return await self.chat_web.aask(query, metadata, model)
+
+    async def achat_with_file(self, query: str, metadata: dict = None, collections: List[str] = None,
+                              model: str = None) -> str:
+        return await self.chat_files.aask(query, metadata, collections, model)
+
+    def stream_ask(self, question: str, session_id: str = None, metadata: dict = None, model: str = None):
+        return self.chat_history.astream(question, session_id or DEFAULT_SESSION_ID, metadata, model)
+
+    def stream_chat_with_file(self, query: str, metadata: dict = None, collections: List[str] = None,
+                              model: str = None):
+        return self.chat_files.astream(query, metadata, collections, model)
+
+    def stream_chat_with_file_batch(self, questions: List[str], collections: List[str] = None,
+                                    model: str = None, concurrency: int = None):
+        return self.chat_files.abatch_ask(questions, collections, model, concurrency)
+
+    def get_batch_max_questions(self) -> int:
+        return self.chat_files.config["batch_max_questions"]
+
+    def stream_web_search(self, query: str, metadata: dict = None, model: str = None):
+        return self.chat_web.astream(query, metadata, model)
 
 
 class SettingsPage:
-    def __init__(self):
-        self.model_data = ModelData()
-        self.chat_files = ChatWithFiles(self.model_data)
-        self.web_search = WebSearchRAG(self.model_data)
+    def __init__(self, chat_page: ChatPage):
+        # Share the chat page's stores so each index is loaded once and
+        # config changes apply to the instances that serve requests
+        self.chat_page = chat_page
+        self.model_data = chat_page.model_data
+
+    @property
+    def chat_files(self):
+        return self.chat_page.chat_files
+
+    @property
+    def web_search(self):
+        return self.chat_page.chat_web
+
     def get_config(self) -> Dict[str, Any]:
         return {
             "embedding_model": self.chat_files.get_embedding_model(),
             "chunk_size": self.chat_files.get_chunk_size(),
             "chunk_overlap": self.chat_files.get_chunk_overlap(),
-            "top_k": self.web_search.get_top_k()
+            "top_k": self.web_search.get_top_k(),
+            **self.chat_files.get_index_config(),
+            "model_options": self.chat_files.get_model_options()
         }
 
     def update_config(self, 
                          embedding_model: str = None,
                          chunk_size: int = None,
                          chunk_overlap: int = None,
-                         top_k: int = None) -> None:
+                         top_k: int = None,
+                         model_options: Dict[str, Dict[str, Any]] = None,
+                         **index_options) -> None:
         if embedding_model:
             self.chat_files.set_embedding_model(embedding_model)
         if chunk_size:
@@ -89,27 +219,57 @@ class SettingsPage:
         if chunk_overlap:
             self.chat_files.set_chunk_overlap(chunk_overlap)
         if top_k:
+            # Both read top_k from the shared config, keep their copies in step
+            self.chat_files.set_top_k(top_k)
             self.web_search.set_top_k(top_k)
+        index_options = {key: value for key, value in index_options.items() if value is not None}
+        if index_options:
+            self.chat_files.set_index_config(**index_options)
+            self.web_search.set_index_config(**index_options)
+        if model_options:
+            self.chat_page.set_model_options(model_options)
+
+    def get_embedding_cache_stats(self) -> Dict[str, Any]:
+        return self.chat_files.get_embedding_cache_stats()
+
+    def get_response_cache_stats(self) -> Dict[str, Any]:
+        return self.chat_files.response_cache.stats()
+
+    def get_web_cache_stats(self) -> Dict[str, Any]:
+        return self.web_search.web_cache.stats()
+
+    def get_web_store_stats(self) -> Dict[str, Any]:
+        return self.web_search.get_store_stats()
+
+    def get_loaded_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Stats of the caches of subsystems already loaded, so a metrics scrape doesn't load any"""
+        stats = {}
+        loaded = [name for name in ("chat_history", "chat_files", "chat_web") if self.chat_page.is_loaded(name)]
+        if loaded:
+            # The response cache is shared by all three
+            stats["response"] = getattr(self.chat_page, loaded[0]).response_cache.stats()
+        if self.chat_page.is_loaded("chat_files"):
+            stats["embedding"] = self.chat_files.get_embedding_cache_stats()
+        if self.chat_page.is_loaded("chat_web"):
+            stats["web"] = self.web_search.web_cache.stats()
+            stats["web_store"] = self.web_search.get_store_stats()
+        return stats
 
         
 
-    def clear_vector_db(self, request: str) -> bool:
+    async def aclear_vector_db(self, request: str) -> bool:
         try:
-            directories = [self.chat_files.vector_store_dir, self.web_search.vector_store_dir]
-            for directory in directories:
-                print(f"Checking existence of {directory}")
-                if os.path.exists(directory):
-                    print(f"Directory exists: {directory}")
-                    shutil.rmtree(directory)
-                    print(f"Successfully deleted {directory}")
-                else:
-                    print(f"Directory does not exist: {directory}")
-
-            print("Vector stores removed successfully")
-
-            # reinit vector stores
-            self.chat_files.initialize_vector_store()
-            self.web_search.initialize_vector_store()
+            directories = [
+                self.chat_files.vector_store_dir,
+                self.chat_files.collections_dir,
+                self.web_search.vector_store_dir
+            ]
+            # Background writes are stopped and the index locks held, so
+            # nothing writes to the stores while their files are deleted.
+            # Both reopen empty stores on the way out.
+            async with self.chat_files.aclosed(), self.web_search.aclosed():
+                await asyncio.to_thread(self.remove_directories, directories)
+            self.chat_files.response_cache.invalidate("file", "web")
 
             return True
         
@@ -117,4 +277,17 @@ class SettingsPage:
             print(f"Error removing vector stores: {str(e)}")
             return False
 
+    @staticmethod
+    def remove_directories(directories: List[str]) -> None:
+        for directory in directories:
+            print(f"Checking existence of {directory}")
+            if os.path.exists(directory):
+                print(f"Directory exists: {directory}")
+                shutil.rmtree(directory)
+                print(f"Successfully deleted {directory}")
+            else:
+                print(f"Directory does not exist: {directory}")
+
+        print("Vector stores removed successfully")
+
         
\ No newline at end of file
@@ -5,9 +5,20 @@ from typing import List, Dict, Any, Optional, Union
 # Request/Response models
 class NormalChatRequest(BaseModel):
     query: str
+    session_id: Optional[str] = None
+    # Model to answer with, the current model if not given
+    model: Optional[str] = None
+
+class CacheInfo(BaseModel):
+    hit: bool
+    tier: Optional[str] = None
+    similarity: Optional[float] = None
+    age: Optional[float] = None
 
 class NormalChatResponse(BaseModel):
     text: str
+    session_id: Optional[str] = None
+    cache: Optional[CacheInfo] = None
 
 class GetModelsResponse(BaseModel):
     models: List[str]
@@ -21,22 +32,93 @@ class SetModelResponse(BaseModel):
 class GetCurrentModelResponse(BaseModel):
     get_current_model: str
 
+class WarmUpModelRequest(BaseModel):
+    model: Optional[str] = None
+
+class WarmUpModelResponse(BaseModel):
+    model: str
+    load_duration: float
+
+class ModelOptions(BaseModel):
+    # Ollama takes a duration ("30m") or seconds, -1 keeps the model loaded
+    keep_alive: Optional[Union[int, str]] = None
+    num_ctx: Optional[int] = None
+
 class WebSearchRequest(BaseModel):
     query: str
 
 class WebSearchResponse(BaseModel):
     reply: str
+    cache: Optional[CacheInfo] = None
 
 class AddDocumentResponse(BaseModel):
     success: bool
+    job_id: Optional[str] = None
+    document_id: Optional[str] = None
+    collection: Optional[str] = None
+    # An identical file is already in the collection, nothing was queued
+    unchanged: bool = False
+    pages_skipped: Optional[int] = None
+    pages_updated: Optional[int] = None
+    pages_removed: Optional[int] = None
     # message: Optional[str] = None
     # filename: Optional[str] = None
 
+class JobStatusResponse(BaseModel):
+    job_id: str
+    name: str
+    status: str
+    progress: Dict[str, Any]
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
 class ChatWithFileRequest(BaseModel):
     request: str  
+    # Collections to search, the default collection if not given
+    collections: Optional[List[str]] = None
+    model: Optional[str] = None
+
+class ChatWithFileBatchRequest(BaseModel):
+    questions: List[str]
+    collections: Optional[List[str]] = None
+    model: Optional[str] = None
+    # Answers generated at once, batch_concurrency from the config if not given
+    concurrency: Optional[int] = None
 
 class ChatWithFileResponse(BaseModel):
     response: str
+    cache: Optional[CacheInfo] = None
+
+class CollectionInfo(BaseModel):
+    name: str
+    documents: int
+    chunks: int
+    created_at: float
+
+class ListCollectionsResponse(BaseModel):
+    collections: List[CollectionInfo]
+
+class CreateCollectionRequest(BaseModel):
+    name: str
+
+class DeleteCollectionResponse(BaseModel):
+    success: bool
+
+class DocumentInfo(BaseModel):
+    document_id: str
+    name: str
+    added_at: float
+    chunks: int
+
+class ListDocumentsResponse(BaseModel):
+    collection: str
+    documents: List[DocumentInfo]
+
+class DeleteDocumentResponse(BaseModel):
+    success: bool
+    chunks_removed: int
 
 class ClearVectorDBRequest(BaseModel):
     request: str
@@ -48,9 +130,100 @@ class ConfigResponse(BaseModel):
     chunk_size: int
     chunk_overlap: int
     top_k: int
+    index_type: str = "flat"
+    ann_promotion_threshold: int = 100000
+    ivf_nlist: int = 0
+    ivf_nprobe: int = 16
+    pq_m: int = 16
+    pq_nbits: int = 8
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    model_options: Dict[str, ModelOptions] = {}
 
 class UpdateConfigRequest(BaseModel):
     embedding_model: Optional[str] = None
     chunk_size: Optional[int] = None
     chunk_overlap: Optional[int] = None
-    top_k: Optional[int] = None
\ No newline at end of file
+    top_k: Optional[int] = None
+    index_type: Optional[str] = None
+    ann_promotion_threshold: Optional[int] = None
+    ivf_nlist: Optional[int] = None
+    ivf_nprobe: Optional[int] = None
+    pq_m: Optional[int] = None
+    pq_nbits: Optional[int] = None
+    hnsw_m: Optional[int] = None
+    hnsw_ef_construction: Optional[int] = None
+    hnsw_ef_search: Optional[int] = None
+    model_options: Optional[Dict[str, ModelOptions]] = None
+
+class EmbeddingCacheStatsResponse(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    max_entries: int
+    hit_rate: float
+
+class ResponseCacheStatsResponse(BaseModel):
+    hits: int
+    semantic_hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    entries: int
+    max_entries: int
+    hit_rate: float
+
+class WebCacheStatsResponse(BaseModel):
+    search_hits: int
+    search_misses: int
+    page_hits: int
+    page_revalidations: int
+    page_misses: int
+    evictions: int
+    searches: int
+    pages: int
+    size_bytes: int
+    max_bytes: int
+
+class ModelSlotStats(BaseModel):
+    limit: int
+    active: int
+    waiting: int
+    served: int
+    rejected: int
+    avg_queue_seconds: float
+    max_queue_seconds: float
+
+class ModelPoolStatsResponse(BaseModel):
+    models: Dict[str, ModelSlotStats]
+    resident: List[str]
+    loads: int
+    clients: int
+
+class LaneStats(BaseModel):
+    concurrency: int
+    max_queue: int
+    active: int
+    waiting: int
+    served: int
+    rejected: int
+    avg_queue_seconds: float
+    p50_queue_seconds: float
+    p95_queue_seconds: float
+    max_queue_seconds: float
+
+class SchedulerStatsResponse(BaseModel):
+    lanes: Dict[str, LaneStats]
+
+class WebStoreStatsResponse(BaseModel):
+    chunks: int
+    pages: int
+    inserted: int
+    duplicates: int
+    duplicate_rate: float
+    replaced: int
+    evictions: int
+    max_chunks: int
+    eviction: str
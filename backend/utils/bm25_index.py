@@ -0,0 +1,85 @@
+import math
+import re
+import threading
+from collections import Counter
+from heapq import nlargest
+from typing import Dict, Iterable, List, Tuple
+
+# Keeps identifiers like PN-1003, E0x1F or v2.3.1 together as one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; compound identifiers also yield their parts"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-_./:]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-memory Okapi BM25 inverted index kept in step with the vector store.
+    Documents are added and removed incrementally by docstore id; only term
+    frequencies are stored, not the text.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Tuple[str, ...]] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                if doc_id in self._doc_lengths:
+                    self._remove(doc_id)
+                tokens = tokenize(text)
+                counts = Counter(tokens)
+                for term, count in counts.items():
+                    self._postings.setdefault(term, {})[doc_id] = count
+                self._doc_terms[doc_id] = tuple(counts)
+                self._doc_lengths[doc_id] = len(tokens)
+                self._total_length += len(tokens)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self._doc_lengths:
+                    self._remove(doc_id)
+
+    def _remove(self, doc_id: str) -> None:
+        for term in self._doc_terms.pop(doc_id):
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """The k best (doc_id, score) pairs for query"""
+        with self._lock:
+            num_docs = len(self._doc_lengths)
+            if not num_docs:
+                return []
+            average_length = self._total_length / num_docs
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+            return nlargest(k, scores.items(), key=lambda item: item[1])
@@ -1,23 +1,46 @@
+import asyncio
 import json
 import os
-from langchain_community.vectorstores import FAISS
-from langchain_community.docstore.in_memory import InMemoryDocstore
+import shutil
+import threading
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Dict, List
 from langchain_ollama import OllamaEmbeddings, ChatOllama
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.document_loaders import PyMuPDFLoader
-import faiss
+from utils.embedding_cache import CachedEmbeddings, chunk_hash, get_embedding_cache
+from utils.context_packer import check_chunk_budget, pack_context
+from utils.document_collections import (
+    COLLECTION_NAME_PATTERN, DEFAULT_COLLECTION, Collection, document_name, hash_file, validate_collection_name
+)
+from utils.executors import run_in_pool
+from utils.metrics import record_span, span
+from utils.model_options import OLLAMA_BASE_URL, get_model_options
+from utils.model_pool import DEFAULT_MODEL_POOL_CONFIG, ModelBusyError, get_model_pool
+from utils.rank_fusion import maximal_marginal_relevance, reciprocal_rank_fusion
+from utils.scheduler import BULK, DEFAULT_SCHEDULER_CONFIG, SchedulerBusyError, get_scheduler, scheduler_lane
+from utils.response_cache import DEFAULT_RESPONSE_CACHE_CONFIG, fingerprint, get_response_cache
+from utils.vector_index import DEFAULT_INDEX_CONFIG, INDEX_TYPES, apply_search_params
 
 class ChatWithFiles:
-    def __init__(self, model_data, vector_store_dir: str = "../temp/vector_store", config_path: str = "../config/config.json"):
+    def __init__(self, model_data, vector_store_dir: str = "../temp/vector_store", config_path: str = "../config/config.json",
+                 collections_dir: str = "../temp/collections"):
         current_model = model_data.get_current_model()
         if not current_model:
             raise ValueError("No model selected")
         
+        # The default collection keeps the original store location, named ones live under collections_dir
         self.vector_store_dir = vector_store_dir
+        self.collections_dir = collections_dir
         self.config_path = config_path
+        self.model_data = model_data
+        self.collections: Dict[str, Collection] = {}
+        # Collections are loaded in worker threads, one load per collection
+        self._collections_lock = threading.RLock()
 
         # Load configuration (create it if it doesn't exist)
         self.load_config()
@@ -26,15 +49,21 @@ class ChatWithFiles:
             self.save_config()
 
         # Initialize embeddings and language model
-        self.embeddings = OllamaEmbeddings(
-            model=self.config["embedding_model"],
-            base_url="http://localhost:11434"
+        # Every call to Ollama goes through the shared scheduler
+        self.scheduler = get_scheduler(self.config)
+        # Embeddings go through the on-disk cache shared by file and web RAG
+        self.embeddings = CachedEmbeddings(
+            OllamaEmbeddings(
+                model=self.config["embedding_model"],
+                base_url=OLLAMA_BASE_URL
+            ),
+            get_embedding_cache(max_entries=self.config["embedding_cache_max_entries"]),
+            self.scheduler
         )
         
-        self.llm = ChatOllama(
-            model=current_model,
-            base_url="http://localhost:11434"
-        )
+        # Chat clients come from the shared pool, so each request can pick its model
+        self.model_pool = get_model_pool(self.config)
+        self.response_cache = get_response_cache(self.config)
         
         # Create directory for vector store if it doesn't exist
         os.makedirs(self.vector_store_dir, exist_ok=True)
@@ -48,7 +77,30 @@ class ChatWithFiles:
             "embedding_model": "nomic-embed-text",
             "chunk_size": 1000,
             "chunk_overlap": 100,
-            "top_k": 3
+            "top_k": 3,
+            # Tokens of retrieved text put into the prompt, filled most relevant chunk first
+            "context_token_budget": 1500,
+            "embedding_cache_max_entries": 200000,
+            "embed_batch_size": 64,
+            "embed_concurrency": 2,
+            "ingest_workers": 2,
+            "embedding_dims": {},
+            # "hybrid" fuses BM25 keyword matches with vector search, "dense" is vector search only
+            "retrieval_mode": "hybrid",
+            # Candidates taken from each retriever before fusion and re-ranking
+            "retrieval_fetch_k": 20,
+            "rrf_k": 60,
+            # "mmr" re-ranks the fused candidates for diversity, "none" keeps the fused order
+            "retrieval_rerank": "none",
+            "mmr_lambda": 0.5,
+            # Answers generated at once for /chat-with-file-batch, and the questions one batch may hold
+            "batch_concurrency": 4,
+            "batch_max_questions": 10000,
+            "model_options": {},
+            **DEFAULT_MODEL_POOL_CONFIG,
+            **DEFAULT_SCHEDULER_CONFIG,
+            **DEFAULT_RESPONSE_CACHE_CONFIG,
+            **DEFAULT_INDEX_CONFIG
         }
         
         if os.path.exists(self.config_path):
@@ -67,23 +119,124 @@ class ChatWithFiles:
             json.dump(self.config, f)
 
     def initialize_vector_store(self):
-        # Check if the FAISS index exists, if not, create one
-        if os.path.exists(os.path.join(self.vector_store_dir, "index.faiss")):
-            self.vector_store = FAISS.load_local(
-                self.vector_store_dir,
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
-        else:
-            # Initialize an empty FAISS index if none exists
-            single_vector = self.embeddings.embed_query("dummy text")
-            index = faiss.IndexFlatL2(len(single_vector))
-            self.vector_store = FAISS(
-                embedding_function=self.embeddings,
-                index=index,
-                docstore=InMemoryDocstore(),
-                index_to_docstore_id={}
+        """(Re)open the collections, loading the default one now and the others on first use"""
+        self.close()
+        self.collections = {}
+        self.get_collection(DEFAULT_COLLECTION)
+
+    @property
+    def vector_store(self):
+        return self.get_collection(DEFAULT_COLLECTION).vector_store
+
+    def collection_dir(self, name: str) -> str:
+        if name == DEFAULT_COLLECTION:
+            return self.vector_store_dir
+        return os.path.join(self.collections_dir, name)
+
+    def collection_names(self) -> List[str]:
+        names = [DEFAULT_COLLECTION]
+        if os.path.isdir(self.collections_dir):
+            names += sorted(
+                name for name in os.listdir(self.collections_dir)
+                if name != DEFAULT_COLLECTION and os.path.isdir(os.path.join(self.collections_dir, name))
             )
+        return names
+
+    def has_collection(self, name: str) -> bool:
+        if name == DEFAULT_COLLECTION:
+            return True
+        return bool(COLLECTION_NAME_PATTERN.match(name or "")) and os.path.isdir(self.collection_dir(name))
+
+    def open_collection(self, name: str) -> Collection:
+        """The collection's catalog, without loading its index"""
+        with self._collections_lock:
+            if name not in self.collections:
+                if not self.has_collection(name):
+                    raise ValueError(f"Collection not found: {name}")
+                self.collections[name] = Collection(name, self.collection_dir(name), self.config)
+            return self.collections[name]
+
+    def get_collection(self, name: str) -> Collection:
+        with self._collections_lock:
+            collection = self.open_collection(name)
+            if not collection.loaded:
+                collection.load(self.embeddings, self.get_embedding_dim)
+            return collection
+
+    async def aget_collection(self, name: str) -> Collection:
+        """get_collection, loading the store (and maybe probing the embedding model) in a thread"""
+        collection = self.collections.get(name)
+        if collection is not None and collection.loaded:
+            return collection
+        return await asyncio.to_thread(self.get_collection, name)
+
+    def create_collection(self, name: str) -> Dict:
+        validate_collection_name(name)
+        if self.has_collection(name):
+            raise ValueError(f"Collection already exists: {name}")
+        os.makedirs(self.collection_dir(name))
+        return self.get_collection(name).info()
+
+    async def adelete_collection(self, name: str) -> None:
+        if name == DEFAULT_COLLECTION:
+            raise ValueError("The default collection can't be deleted")
+        collection = await asyncio.to_thread(self.open_collection, name)
+        # Let in-flight writes and compaction finish before the files go
+        async with collection.index_lock:
+            collection.close()
+            del self.collections[name]
+            await run_in_pool(shutil.rmtree, collection.directory)
+        self.documents_changed()
+
+    def list_collections(self) -> List[Dict]:
+        return [self.open_collection(name).info() for name in self.collection_names()]
+
+    def list_documents(self, name: str) -> List[Dict]:
+        return self.open_collection(name).catalog.documents()
+
+    async def adelete_document(self, name: str, document_id: str) -> int:
+        """Remove one document's chunks from a collection by their ids, without a rebuild"""
+        collection = await self.aget_collection(name)
+        if not await asyncio.to_thread(collection.catalog.has_document, document_id):
+            raise ValueError(f"Document not found: {document_id}")
+        removed = await collection.adelete_document(document_id)
+        self.documents_changed()
+        return removed
+
+    def documents_changed(self) -> None:
+        # Answers given before documents were added or removed may be stale
+        self.response_cache.invalidate("file")
+
+    def close(self) -> None:
+        for collection in self.collections.values():
+            collection.close()
+
+    @asynccontextmanager
+    async def aclosed(self):
+        """
+        Stop compactions and hold every collection's index lock with its
+        store closed, so the files on disk can be replaced. The collections
+        are reopened when the block exits.
+        """
+        async with AsyncExitStack() as stack:
+            for collection in list(self.collections.values()):
+                await collection.astop_compaction()
+                await stack.enter_async_context(collection.index_lock)
+            self.close()
+            try:
+                yield
+            finally:
+                await asyncio.to_thread(self.initialize_vector_store)
+                # The chain holds a retriever bound to the old store
+                self.setup_rag_chain()
+
+    def get_embedding_dim(self) -> int:
+        # Probing the model costs a round trip to Ollama, so the answer is kept in config
+        model = self.config["embedding_model"]
+        if model not in self.config["embedding_dims"]:
+            self.config["embedding_dims"][model] = len(self.embeddings.embed_query("dummy text"))
+            self.save_config()
+        return self.config["embedding_dims"][model]
 
     def setup_rag_chain(self):
         # Define the prompt template
@@ -97,26 +250,118 @@ class ChatWithFiles:
             Answer:
         """)
 
-        def format_docs(docs):
-            return "\n\n".join([doc.page_content for doc in docs])
+        # Retrieval happens first so the context can key the response cache
+        self.prompt = prompt
 
-        # Create the retriever for RAG
-        retriever = self.vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={'k': 3}
-        )
+    def answer_chain(self, model: str):
+        return self.prompt | self.create_llm(model) | StrOutputParser()
 
-        # Setup the chain
-        self.chain = (
-            {
-                "context": retriever | format_docs,
-                "question": RunnablePassthrough()
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
+    def format_docs(self, docs) -> str:
+        # Neighbouring chunks of a page are merged, dropping the text repeated by chunk_overlap
+        return pack_context(
+            docs,
+            self.config["context_token_budget"],
+            lambda doc: (doc.metadata.get("source"), doc.metadata.get("page"))
         )
 
+    def retrieval_params(self) -> tuple:
+        """(top_k, rerank, hybrid, fetch_k) from the current config"""
+        top_k = self.config["top_k"]
+        rerank = self.config["retrieval_rerank"] == "mmr"
+        hybrid = self.config["retrieval_mode"] == "hybrid"
+        fetch_k = max(self.config["retrieval_fetch_k"], top_k) if rerank or hybrid else top_k
+        return top_k, rerank, hybrid, fetch_k
+
+    async def aretrieve(self, question: str, collections: List[str] = None) -> tuple:
+        """
+        Return the question's embedding and the context built from the top_k
+        chunks of the given collections, the default one if none are named.
+        In hybrid mode the vector and BM25 rankings are merged with
+        reciprocal rank fusion, so exact part numbers and error codes are
+        found even when their embeddings aren't close to the question's.
+        """
+        selected = [await self.aget_collection(name) for name in dict.fromkeys(collections or [DEFAULT_COLLECTION])]
+        vector = await self.embeddings.aembed_query(question)
+        start = time.perf_counter()
+        _, _, hybrid, fetch_k = self.retrieval_params()
+        results = await asyncio.gather(*(
+            collection.asearch(question, vector, fetch_k, hybrid) for collection in selected
+        ))
+        context = self.format_docs(await self.arank(vector, selected, results))
+        record_span("retrieve", time.perf_counter() - start, start, collections=len(selected))
+        return vector, context
+
+    async def arank(self, vector: List[float], selected: List[Collection], results: list) -> list:
+        """The top_k chunks for one question, from each selected collection's (dense, sparse) candidates"""
+        top_k, rerank, hybrid, fetch_k = self.retrieval_params()
+        # Distances from one embedding model compare across collections. BM25
+        # scores depend on each collection's term statistics, but are close
+        # enough to interleave before fusion.
+        dense = sorted((hit for hits, _ in results for hit in hits), key=lambda hit: hit[1])[:fetch_k]
+        docs = [doc for doc, _ in dense]
+
+        if hybrid:
+            sparse = sorted(
+                ((doc_id, score, collection) for collection, (_, hits) in zip(selected, results) for doc_id, score in hits),
+                key=lambda hit: -hit[1]
+            )[:fetch_k]
+            docs_by_id = {doc.id: doc for doc in docs}
+            fused = reciprocal_rank_fusion(
+                [[doc.id for doc in docs], [doc_id for doc_id, _, _ in sparse]],
+                self.config["rrf_k"]
+            )
+            candidates = fused[:fetch_k] if rerank else fused[:top_k]
+            owners = {doc_id: collection for doc_id, _, collection in sparse}
+            missing = [doc_id for doc_id in candidates if doc_id not in docs_by_id]
+            if missing:
+                found = await run_in_pool(
+                    lambda: [owners[doc_id].vector_store.docstore.search(doc_id) for doc_id in missing]
+                )
+                # A chunk deleted since BM25 returned it comes back as a "not found" string
+                docs_by_id.update((doc_id, doc) for doc_id, doc in zip(missing, found) if isinstance(doc, Document))
+            docs = [docs_by_id[doc_id] for doc_id in candidates if doc_id in docs_by_id]
+
+        if rerank and docs:
+            # Chunk embeddings come from the embedding cache filled at ingest
+            doc_vectors = await self.embeddings.aembed_documents([doc.page_content for doc in docs])
+            positions = await run_in_pool(
+                maximal_marginal_relevance, vector, doc_vectors, top_k, self.config["mmr_lambda"]
+            )
+            docs = [docs[position] for position in positions]
+
+        return docs[:top_k]
+
+    async def abatch_retrieve(self, questions: List[str], collections: List[str] = None) -> List[tuple]:
+        """
+        aretrieve for many questions at once: the questions are embedded in
+        embed_batch_size batches and each collection is searched once with
+        the matrix of their embeddings. Returns (vector, context) per question.
+        """
+        selected = [await self.aget_collection(name) for name in dict.fromkeys(collections or [DEFAULT_COLLECTION])]
+        batch_size = self.config["embed_batch_size"]
+        vectors = []
+        for batch_start in range(0, len(questions), batch_size):
+            vectors.extend(await self.embeddings.aembed_documents(questions[batch_start:batch_start + batch_size]))
+        start = time.perf_counter()
+        _, _, hybrid, fetch_k = self.retrieval_params()
+        per_collection = await asyncio.gather(*(
+            collection.asearch_batch(questions, vectors, fetch_k, hybrid) for collection in selected
+        ))
+        contexts = []
+        for position, vector in enumerate(vectors):
+            results = [collection_results[position] for collection_results in per_collection]
+            contexts.append(self.format_docs(await self.arank(vector, selected, results)))
+        record_span("retrieve", time.perf_counter() - start, start, collections=len(selected), questions=len(questions))
+        return list(zip(vectors, contexts))
+
+    def get_top_k(self) -> int:
+        return self.config["top_k"]
+
+    def set_top_k(self, k: int) -> None:
+        self.config["top_k"] = k
+        self.save_config()
+        self.setup_rag_chain()
+
     # Configuration getters and setters
     def get_embedding_model(self) -> str:
         return self.config["embedding_model"]
@@ -124,14 +369,61 @@ class ChatWithFiles:
     def set_embedding_model(self, model: str) -> None:
         self.config["embedding_model"] = model
         self.save_config()
-        self.embeddings = OllamaEmbeddings(model=model)
+        self.embeddings = CachedEmbeddings(
+            OllamaEmbeddings(model=model, base_url=OLLAMA_BASE_URL),
+            get_embedding_cache(max_entries=self.config["embedding_cache_max_entries"]),
+            self.scheduler
+        )
         self.initialize_vector_store()
         self.setup_rag_chain()
 
+    def get_embedding_cache_stats(self) -> dict:
+        return self.embeddings.cache.stats()
+
+    def create_llm(self, model: str) -> ChatOllama:
+        return self.model_pool.llm(model, get_model_options(self.config, model))
+
+    @property
+    def llm(self) -> ChatOllama:
+        # The client of the default model, for requests that don't pick one
+        return self.create_llm(self.model_data.get_current_model())
+
+    def get_model_options(self) -> dict:
+        return self.config["model_options"]
+
+    def set_model_options(self, model_options: dict) -> None:
+        """Merge per-model keep_alive/num_ctx overrides; the pool hands out clients built with them"""
+        for model, options in model_options.items():
+            merged = {**self.config["model_options"].get(model, {}), **options}
+            self.config["model_options"][model] = {key: value for key, value in merged.items() if value is not None}
+        self.save_config()
+
+    def get_index_config(self) -> dict:
+        return {key: self.config[key] for key in DEFAULT_INDEX_CONFIG}
+
+    def set_index_config(self, **options) -> None:
+        index_type = options.get("index_type")
+        if index_type and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}, expected one of {', '.join(INDEX_TYPES)}")
+        options = {key: value for key, value in options.items() if value is not None}
+        check_chunk_budget(
+            options.get("chunk_size", self.config["chunk_size"]),
+            options.get("context_token_budget", self.config["context_token_budget"])
+        )
+        self.config.update(options)
+        self.save_config()
+        for collection in self.collections.values():
+            if collection.loaded:
+                apply_search_params(collection.vector_store.index, self.config)
+                # Promotes or demotes the index in the background if the type changed
+                collection.schedule_compaction()
+
     def get_chunk_size(self) -> int:
         return self.config["chunk_size"]
 
     def set_chunk_size(self, size: int) -> None:
+        # A chunk bigger than the context budget would be cut down in every answer
+        check_chunk_budget(size, self.config["context_token_budget"])
         self.config["chunk_size"] = size
         self.save_config()
 
@@ -142,35 +434,275 @@ class ChatWithFiles:
         self.config["chunk_overlap"] = overlap
         self.save_config()
 
-    def add_document(self, file_path: str) -> bool:
+    def find_document(self, collection: str, name: str, digest: str) -> Dict:
+        """The stored document an upload replaces, and whether it is byte-for-byte the same"""
+        target = self.open_collection(collection or DEFAULT_COLLECTION)
+        document_id, unchanged = target.catalog.find_document(name, digest)
+        pages = len(target.catalog.page_hashes(document_id)) if unchanged else 0
+        return {"document_id": document_id, "unchanged": unchanged, "pages": pages}
+
+    def iter_chunk_batches(self, file_path: str, known_pages: Dict[int, str] = None, scan: dict = None):
+        """
+        Lazily parse and split a PDF, yielding (pages_parsed, total_pages, chunks)
+        batches. Pages whose hash is the one in known_pages are not split.
+        scan is filled with the number of pages parsed and skipped and the
+        hashes of the pages that were split.
+        """
+        # PyMuPDF is only needed for ingestion, keep it out of startup
+        from langchain_community.document_loaders import PyMuPDFLoader
+        loader = PyMuPDFLoader(file_path)
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.config["chunk_size"],
+            chunk_overlap=self.config["chunk_overlap"],
+            add_start_index=True
+        )
+        batch_size = self.config["embed_batch_size"]
+        known_pages = known_pages or {}
+        scan = {} if scan is None else scan
+        scan.update({"pages_parsed": 0, "pages_skipped": 0, "page_hashes": {}})
+
+        total_pages = None
+        batch = []
+        for page in loader.lazy_load():
+            number = page.metadata.get("page", scan["pages_parsed"])
+            scan["pages_parsed"] += 1
+            total_pages = page.metadata.get("total_pages", total_pages)
+            page_hash = chunk_hash(page.page_content)
+            if known_pages.get(number) == page_hash:
+                scan["pages_skipped"] += 1
+                continue
+            scan["page_hashes"][number] = page_hash
+            batch.extend(text_splitter.split_documents([page]))
+            while len(batch) >= batch_size:
+                yield scan["pages_parsed"], total_pages, batch[:batch_size]
+                batch = batch[batch_size:]
+        if batch:
+            yield scan["pages_parsed"], total_pages, batch
+
+    async def aingest_pdf(self, file_path: str, collection: Collection, document_id: str, digest: str,
+                          progress_callback=None) -> dict:
+        """
+        Stream a PDF into a collection: pages are parsed in the worker pool
+        while earlier batches are being embedded, so parsing and embedding
+        overlap and only a few batches are held in memory at a time.
+        Pages unchanged since the document was last uploaded are skipped.
+        The chunks of changed and removed pages are deleted once the new
+        ones are in. If the ingest fails or is cancelled before that, the
+        chunks it added are deleted again and the document is left as it
+        was. Returns the final progress counts.
+        """
+        known = await asyncio.to_thread(collection.catalog.page_hashes, document_id)
+        # Chunks of no known page predate page tracking and are always replaced
+        stale = set(await asyncio.to_thread(collection.catalog.page_chunk_ids, document_id))
+        scan = {}
+        # Ids are chosen up front, so a batch cut off mid-write can still be rolled back
+        added = []
+        batches = self.iter_chunk_batches(file_path, known, scan)
+        workers = self.config["embed_concurrency"]
+        queue = asyncio.Queue(maxsize=workers)
+        progress = {
+            "pages_parsed": 0,
+            "total_pages": None,
+            "pages_skipped": 0,
+            "pages_updated": 0,
+            "pages_removed": 0,
+            "chunks_embedded": 0,
+            "collection": collection.name,
+            "document_id": document_id,
+        }
+
+        async def produce():
+            replaced = set()
+            while True:
+                # PDF parsing is CPU-bound, keep it off the event loop
+                with span("parse"):
+                    item = await run_in_pool(next, batches, None)
+                # Old chunks of a changed page are looked up before its new chunks are added
+                changed = [page for page in scan["page_hashes"] if page not in replaced]
+                if changed:
+                    stale.update(await asyncio.to_thread(collection.catalog.page_chunk_ids, document_id, changed))
+                    replaced.update(changed)
+                progress["pages_skipped"] = scan["pages_skipped"]
+                progress["pages_updated"] = len(scan["page_hashes"])
+                if item is None:
+                    break
+                progress["pages_parsed"], progress["total_pages"], batch = item
+                await queue.put(batch)
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                for chunk in batch:
+                    chunk.metadata["document_id"] = document_id
+                vectors = await self.embeddings.aembed_documents([chunk.page_content for chunk in batch])
+                ids = [uuid.uuid4().hex for _ in batch]
+                added.extend(ids)
+                await collection.aadd_embeddings(document_id, batch, vectors, ids)
+                self.documents_changed()
+                progress["chunks_embedded"] += len(batch)
+                if progress_callback:
+                    progress_callback(dict(progress))
+
+        tasks = [asyncio.create_task(produce())]
+        tasks += [asyncio.create_task(consume()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if added:
+                await asyncio.shield(collection.adelete_chunks(added))
+                self.documents_changed()
+            raise
+
+        async def finish():
+            parsed = scan["pages_parsed"]
+            progress["pages_parsed"] = parsed
+            progress["pages_removed"] = sum(1 for page in known if page >= parsed)
+            stale.update(await asyncio.to_thread(collection.catalog.page_chunk_ids, document_id, (), parsed))
+            if stale:
+                await collection.adelete_chunks(list(stale))
+                self.documents_changed()
+            await asyncio.to_thread(collection.catalog.record_pages, document_id, scan["page_hashes"], parsed, digest)
+            if progress_callback:
+                progress_callback(dict(progress))
+            return progress
+
+        # From here on the new version replaces the old one, a cancellation lets it finish
+        return await asyncio.shield(finish())
+
+    async def aadd_document(self, file_path: str, progress_callback=None, collection: str = None,
+                            document_id: str = None, name: str = None, digest: str = None) -> bool:
+        """
+        Add a PDF to a collection, or update the stored document it revises:
+        one with the same name, or document_id if given. Re-uploading a
+        file already in the collection changes nothing.
+        """
         try:
             if file_path.endswith(".pdf"):
-                loader = PyMuPDFLoader(file_path)
-                documents = loader.load()
+                target = await self.aget_collection(collection or DEFAULT_COLLECTION)
+                name = name or document_name(file_path)
+                digest = digest or await run_in_pool(hash_file, file_path)
+                existing, unchanged = await asyncio.to_thread(target.catalog.find_document, name, digest)
+                if unchanged:
+                    if progress_callback:
+                        pages = len(await asyncio.to_thread(target.catalog.page_hashes, existing))
+                        progress_callback({
+                            "pages_parsed": 0, "total_pages": pages, "pages_skipped": pages, "pages_updated": 0,
+                            "pages_removed": 0, "chunks_embedded": 0, "collection": target.name, "document_id": existing,
+                        })
+                    return True
+
+                document_id = document_id or existing or uuid.uuid4().hex
+                is_new = not await asyncio.to_thread(target.catalog.has_document, document_id)
+                await asyncio.to_thread(target.catalog.add_document, document_id, name)
+                try:
+                    progress = await self.aingest_pdf(file_path, target, document_id, digest, progress_callback)
+                except BaseException:
+                    if is_new:
+                        # A failed or cancelled first upload leaves nothing searchable behind
+                        await asyncio.shield(target.adelete_document(document_id))
+                        self.documents_changed()
+                    raise
 
-                if not documents:
+                if is_new and not progress["chunks_embedded"]:
+                    await asyncio.to_thread(target.catalog.remove_document, document_id)
                     return False
-            
-                # Split documents into chunks
-                text_splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=self.config["chunk_size"],
-                    chunk_overlap=self.config["chunk_overlap"]
-                )
-                chunks = text_splitter.split_documents(documents)
-                
-                # Add chunks to the vector store
-                self.vector_store.add_documents(chunks)
-                
-                # Save the updated vector store
-                self.vector_store.save_local(self.vector_store_dir)
+
+                target.schedule_compaction()
                 return True
-                
+
         except Exception as e:
             print(f"Error processing document: {str(e)}")
             return False
 
-    def ask(self, question: str) -> str:
+    async def aask(self, question: str, metadata: dict = None, collections: List[str] = None,
+                   model: str = None) -> str:
+        model = model or self.model_data.get_current_model()
         try:
-            return self.chain.invoke(question)
+            vector, context = await self.aretrieve(question, collections)
+            return await self.response_cache.aanswer(
+                "file", model, question,
+                lambda: self.model_pool.ainvoke(
+                    model, get_model_options(self.config, model), self.answer_chain(model),
+                    {"context": context, "question": question}
+                ),
+                context_fingerprint=fingerprint(context),
+                vector=vector,
+                metadata=metadata
+            )
+        except (ModelBusyError, SchedulerBusyError):
+            raise
         except Exception as e:
             return f"Error generating response: {str(e)}"
+
+    async def abatch_ask(self, questions: List[str], collections: List[str] = None, model: str = None,
+                         concurrency: int = None):
+        """
+        Answer many questions about the same collections, yielding
+        {"index", "question", "response" or "error", "cache"} per question in
+        the order the answers complete. Retrieval is done for the whole batch
+        by abatch_retrieve, then up to concurrency answers are generated at
+        once. The batch runs in the bulk scheduler lane, so it can't hold up
+        interactive chats; the lane's and the model's concurrency cap it too.
+        """
+        model = model or self.model_data.get_current_model()
+        options = get_model_options(self.config, model)
+        concurrency = max(1, min(concurrency or self.config["batch_concurrency"], len(questions)))
+        # Bounded, so a slow reader holds back generation instead of piling up answers
+        results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+
+        async def answer(index: int, question: str, vector: List[float], context: str) -> dict:
+            metadata = {}
+            try:
+                response = await self.response_cache.aanswer(
+                    "file", model, question,
+                    lambda: self.model_pool.ainvoke(
+                        model, options, self.answer_chain(model), {"context": context, "question": question}
+                    ),
+                    context_fingerprint=fingerprint(context),
+                    vector=vector,
+                    metadata=metadata
+                )
+                return {"index": index, "question": question, "response": response, **metadata}
+            except Exception as e:
+                return {"index": index, "question": question, "error": str(e)}
+
+        async def worker(pending):
+            # Workers share one iterator, each takes the next question when it's done with one
+            for index, (question, (vector, context)) in pending:
+                await results.put(await answer(index, question, vector, context))
+
+        with scheduler_lane(BULK):
+            retrieved = await self.abatch_retrieve(questions, collections)
+            pending = enumerate(zip(questions, retrieved))
+            # Tasks copy the current context, so their Ollama calls stay in the bulk lane
+            workers = [asyncio.create_task(worker(pending)) for _ in range(concurrency)]
+        try:
+            for _ in questions:
+                yield await results.get()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def astream(self, question: str, metadata: dict = None, collections: List[str] = None,
+                      model: str = None):
+        model = model or self.model_data.get_current_model()
+        vector, context = await self.aretrieve(question, collections)
+        async for chunk in self.response_cache.astream(
+            "file", model, question,
+            lambda: self.model_pool.astream(
+                model, get_model_options(self.config, model), self.answer_chain(model),
+                {"context": context, "question": question}
+            ),
+            context_fingerprint=fingerprint(context),
+            vector=vector,
+            metadata=metadata
+        ):
+            yield chunk
@@ -1,15 +1,32 @@
-from langchain_ollama import OllamaLLM
-from langchain_core.messages import HumanMessage, AIMessage
+import asyncio
+import json
+import os
+from langchain_ollama import ChatOllama
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from utils.model_options import get_model_options
+from utils.model_pool import DEFAULT_MODEL_POOL_CONFIG, get_model_pool
+from utils.scheduler import BULK, DEFAULT_SCHEDULER_CONFIG, scheduler_lane
+from utils.response_cache import DEFAULT_RESPONSE_CACHE_CONFIG, fingerprint, get_response_cache
+from utils.session_store import DEFAULT_SESSION_ID, get_session_store
 
 class ChatWithHistory:
-    def __init__(self, model_data):  # Accept ModelData instance as parameter
+    def __init__(self, model_data, config_path: str = "../config/config.json"):  # Accept ModelData instance as parameter
         current_model = model_data.get_current_model()
         if not current_model:
             raise ValueError("No model selected")
-            
-        self.llm = OllamaLLM(model=current_model)
-        self.chat_history = []
+
+        self.config_path = config_path
+        self.model_data = model_data
+        self.load_config()
+
+        # Messages go through Ollama's chat API and the model's own template,
+        # so each turn's prompt starts with exactly the previous turn's prompt
+        # and the model is kept loaded, letting Ollama reuse its prompt cache
+        self.model_pool = get_model_pool(self.config)
+        self.sessions = get_session_store(idle_seconds=self.config["session_idle_seconds"])
+        self.response_cache = get_response_cache(self.config)
 
         self.prompt_template = ChatPromptTemplate.from_messages([
             ("system", "You are an AI named Marcus, you answer questions with simple answers"),
@@ -17,10 +34,163 @@ class ChatWithHistory:
             ("human", "{input}"),
         ])
 
-        self.chain = self.prompt_template | self.llm
+        self.summary_prompt = ChatPromptTemplate.from_template("""
+            Update the summary of a conversation with the new turns below. Keep
+            facts, names, numbers and open questions; drop small talk. Reply
+            with the updated summary only.
+
+            Current summary: {summary}
+
+            New turns:
+            {transcript}
+
+            Updated summary:
+        """)
+
+    def create_llm(self, model: str) -> ChatOllama:
+        return self.model_pool.llm(model, get_model_options(self.config, model))
+
+    @property
+    def llm(self) -> ChatOllama:
+        # The client of the default model, for requests that don't pick one
+        return self.create_llm(self.model_data.get_current_model())
+
+    def chain(self, model: str):
+        return self.prompt_template | self.create_llm(model) | StrOutputParser()
+
+    def summary_chain(self, model: str):
+        return self.summary_prompt | self.create_llm(model) | StrOutputParser()
+
+    def load_config(self):
+        default_config = {
+            "history_token_budget": 2048,
+            "session_idle_seconds": 1800,
+            "model_options": {},
+            **DEFAULT_MODEL_POOL_CONFIG,
+            **DEFAULT_SCHEDULER_CONFIG,
+            **DEFAULT_RESPONSE_CACHE_CONFIG
+        }
+
+        if os.path.exists(self.config_path):
+            with open(self.config_path, 'r') as f:
+                self.config = {**default_config, **json.load(f)}
+        else:
+            self.config = default_config
+
+    def build_history(self, session) -> list:
+        """
+        Summary of older turns followed by every turn not yet summarized.
+        The history only changes at its start when a summary is folded in,
+        so between summaries the prompt prefix stays byte-identical and
+        Ollama only evaluates the new turn. Turns beyond twice the budget
+        (a summary still in flight) are dropped to protect num_ctx.
+        """
+        budget = self.config["history_token_budget"]
+        recent = []
+        used = 0
+        for message in reversed(session.messages):
+            used += message.tokens
+            if used > 2 * budget:
+                break
+            recent.append(message)
+
+        history = []
+        if session.summary:
+            history.append(SystemMessage(content=f"Summary of the conversation so far: {session.summary}"))
+        for message in reversed(recent):
+            message_class = HumanMessage if message.role == "human" else AIMessage
+            history.append(message_class(content=message.content))
+        return history
+
+    @staticmethod
+    def history_fingerprint(session) -> str:
+        # The same question only gets the same answer in the same conversation state
+        return fingerprint(session.summary, *(f"{m.role}:{m.content}" for m in session.messages))
+
+    def record_turn(self, session, question: str, response: str) -> None:
+        self.sessions.append(session, "human", question)
+        self.sessions.append(session, "ai", response)
+
+    async def aget_session(self, session_id: str):
+        # The session store reads and writes SQLite, keep it off the event loop
+        return await asyncio.to_thread(self.sessions.get, session_id)
+
+    async def arecord_turn(self, session, question: str, response: str) -> None:
+        await asyncio.to_thread(self.record_turn, session, question, response)
+
+    def turns_to_summarize(self, session) -> list:
+        """Oldest turns to fold into the summary, bringing the session back to half the budget"""
+        budget = self.config["history_token_budget"]
+        if session.tokens <= budget:
+            return []
+        excess = session.tokens - budget // 2
+        turns = []
+        for message in session.messages:
+            if excess <= 0:
+                break
+            turns.append(message)
+            excess -= message.tokens
+        return turns
+
+    @staticmethod
+    def transcript(turns: list) -> str:
+        return "\n".join(f"{'User' if m.role == 'human' else 'Assistant'}: {m.content}" for m in turns)
+
+    async def asummarize(self, session, model: str) -> None:
+        session.summarizing = True
+        try:
+            turns = self.turns_to_summarize(session)
+            if turns:
+                # Summaries use the model that answered, which is already loaded,
+                # and wait behind the questions users are waiting on
+                with scheduler_lane(BULK):
+                    summary = await self.model_pool.ainvoke(
+                        model, get_model_options(self.config, model), self.summary_chain(model),
+                        {"summary": session.summary or "(none)", "transcript": self.transcript(turns)}
+                    )
+                await asyncio.to_thread(self.sessions.set_summary, session, summary.strip(), turns[-1].seq)
+        except Exception as e:
+            print(f"Error summarizing session {session.id}: {str(e)}")
+        finally:
+            session.summarizing = False
+
+    def schedule_summary(self, session, model: str) -> None:
+        # Runs after the answer is returned, so it never adds to the turn's latency
+        if not session.summarizing and self.turns_to_summarize(session):
+            session.summarizing = True
+            asyncio.ensure_future(self.asummarize(session, model))
+
+    async def aask(self, question, session_id: str = DEFAULT_SESSION_ID, metadata: dict = None, model: str = None):
+        model = model or self.model_data.get_current_model()
+        session = await self.aget_session(session_id)
+        response = await self.response_cache.aanswer(
+            "chat", model, question,
+            lambda: self.model_pool.ainvoke(
+                model, get_model_options(self.config, model), self.chain(model),
+                {"input": question, "chat_history": self.build_history(session)}
+            ),
+            context_fingerprint=self.history_fingerprint(session),
+            metadata=metadata
+        )
+        await self.arecord_turn(session, question, response)
+        self.schedule_summary(session, model)
+        return response
 
-    def ask(self, question):
-        response = self.chain.invoke({"input": question, "chat_history": self.chat_history})
-        self.chat_history.append(HumanMessage(content=question))
-        self.chat_history.append(AIMessage(content=response))
-        return response
\ No newline at end of file
+    async def astream(self, question, session_id: str = DEFAULT_SESSION_ID, metadata: dict = None, model: str = None):
+        model = model or self.model_data.get_current_model()
+        session = await self.aget_session(session_id)
+        chunks = []
+        async for chunk in self.response_cache.astream(
+            "chat", model, question,
+            lambda: self.model_pool.astream(
+                model, get_model_options(self.config, model), self.chain(model),
+                {"input": question, "chat_history": self.build_history(session)}
+            ),
+            context_fingerprint=self.history_fingerprint(session),
+            metadata=metadata
+        ):
+            chunks.append(chunk)
+            yield chunk
+        # Only record the turn once the whole answer has been generated
+        await self.arecord_turn(session, question, "".join(chunks))
+        self.schedule_summary(session, model)
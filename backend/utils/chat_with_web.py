@@ -1,20 +1,29 @@
 import json
 import os
+from contextlib import asynccontextmanager
 from typing import List, Dict, Any
 from langchain_community.vectorstores import FAISS
-from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_ollama import OllamaEmbeddings, ChatOllama
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 from langchain.docstore.document import Document
-from duckduckgo_search import DDGS
-from bs4 import BeautifulSoup
-import requests
-import html2text
+import asyncio
 import re
-import faiss
+from utils.context_packer import pack_context
+from utils.embedding_cache import CachedEmbeddings, chunk_hash, get_embedding_cache
+from utils.executors import run_in_pool, run_in_pool_shielded
+from utils.locks import ReadWriteLock
+from utils.metrics import span
+from utils.model_options import OLLAMA_BASE_URL, get_model_options
+from utils.model_pool import DEFAULT_MODEL_POOL_CONFIG, ModelBusyError, get_model_pool
+from utils.scheduler import DEFAULT_SCHEDULER_CONFIG, SchedulerBusyError, get_scheduler
+from utils.response_cache import DEFAULT_RESPONSE_CACHE_CONFIG, get_response_cache
+from utils.vector_index import DEFAULT_INDEX_CONFIG, INDEX_TYPES, apply_search_params, nearest, needs_rebuild, rebuild_index
+from utils.vector_persistence import IncrementalPersistence
+from utils.web_cache import DEFAULT_WEB_CACHE_CONFIG, get_web_cache
+from utils.web_fetcher import WebFetcher
+from utils.web_store import DEFAULT_WEB_STORE_CONFIG, WebStoreCatalog
 
 class WebSearchRAG:
     def __init__(self,model_data,vector_store_dir: str = "../temp/web_search_vectors", config_path: str = "../config/config.json"):
@@ -24,20 +33,38 @@ class WebSearchRAG:
         
         self.vector_store_dir = vector_store_dir
         self.config_path = config_path
+        self.model_data = model_data
+        self._index_lock = None
+        self._store_tasks = set()
 
         self.load_config()
 
         if not os.path.exists(self.config_path):
             self.save_config()
         
-        self.embeddings = OllamaEmbeddings(
-            model=self.config["embedding_model"],
-            base_url="http://localhost:11434"
+        # Every call to Ollama goes through the shared scheduler
+        self.scheduler = get_scheduler(self.config)
+        # Embeddings go through the on-disk cache shared by file and web RAG
+        self.embeddings = CachedEmbeddings(
+            OllamaEmbeddings(
+                model=self.config["embedding_model"],
+                base_url=OLLAMA_BASE_URL
+            ),
+            get_embedding_cache(max_entries=self.config["embedding_cache_max_entries"]),
+            self.scheduler
         )
         
-        self.llm = ChatOllama(
-            model=current_model,
-            base_url="http://localhost:11434"
+        # Chat clients come from the shared pool, so each request can pick its model
+        self.model_pool = get_model_pool(self.config)
+        self.response_cache = get_response_cache(self.config)
+        
+        # Search results and extracted pages are reused across queries
+        self.web_cache = get_web_cache(self.config)
+        self.fetcher = WebFetcher(
+            timeout=self.config["fetch_timeout"],
+            deadline=self.config["fetch_deadline"],
+            per_host_limit=self.config["fetch_per_host_limit"],
+            cache=self.web_cache
         )
         
         os.makedirs(vector_store_dir, exist_ok=True)
@@ -50,7 +77,28 @@ class WebSearchRAG:
             "num_chunks": 3,
             "chunk_size": 1000,
             "chunk_overlap": 100,
-            "top_k": 3
+            "top_k": 3,
+            # Tokens of retrieved text put into the prompt, filled most relevant chunk first
+            "context_token_budget": 1500,
+            "embedding_cache_max_entries": 200000,
+            "fetch_timeout": 10,
+            "fetch_deadline": 15,
+            "fetch_per_host_limit": 2,
+            "embedding_dims": {},
+            "model_options": {},
+            **DEFAULT_MODEL_POOL_CONFIG,
+            **DEFAULT_SCHEDULER_CONFIG,
+            **DEFAULT_RESPONSE_CACHE_CONFIG,
+            **DEFAULT_WEB_CACHE_CONFIG,
+            **DEFAULT_WEB_STORE_CONFIG,
+            # "query" ranks only the pages fetched for the current question,
+            # "global" searches every chunk kept from earlier searches
+            "web_retrieval_mode": "query",
+            # Fill up top_k from the persistent store when the fetched pages fall short
+            "web_retrieval_fallback": True,
+            "embed_batch_size": 64,
+            "embed_concurrency": 2,
+            **DEFAULT_INDEX_CONFIG
         }
         
         if os.path.exists(self.config_path):
@@ -65,21 +113,94 @@ class WebSearchRAG:
             json.dump(self.config, f)
 
     def initialize_vector_store(self):
-        if os.path.exists(os.path.join(self.vector_store_dir, "index.faiss")):
+        self.persistence = IncrementalPersistence(self.vector_store_dir)
+        self._compaction = None
+
+        self.vector_store = self.persistence.load(self.embeddings)
+        if self.vector_store is not None:
+            apply_search_params(self.vector_store.index, self.config)
+        elif os.path.exists(os.path.join(self.vector_store_dir, "index.faiss")):
+            # Index saved with save_local by an older version, migrate it
             self.vector_store = FAISS.load_local(
                 self.vector_store_dir,
                 self.embeddings,
                 allow_dangerous_deserialization=True
             )
+            self.persistence.compact(self.vector_store)
         else:
-            single_vector = self.embeddings.embed_query("dummy text")
-            index = faiss.IndexFlatL2(len(single_vector))
-            self.vector_store = FAISS(
-                embedding_function=self.embeddings,
-                index=index,
-                docstore=InMemoryDocstore(),
-                index_to_docstore_id={}
-            )
+            self.vector_store = self.persistence.create(self.embeddings, self.get_embedding_dim())
+
+        # Tracks which page each chunk came from, for dedup, replacement and eviction
+        self.catalog = WebStoreCatalog(os.path.join(self.vector_store_dir, "catalog.sqlite"))
+        self.catalog.reconcile(self.vector_store)
+
+    def get_embedding_dim(self) -> int:
+        # Probing the model costs a round trip to Ollama, so the answer is kept in config
+        model = self.config["embedding_model"]
+        if model not in self.config["embedding_dims"]:
+            self.config["embedding_dims"][model] = len(self.embeddings.embed_query("dummy text"))
+            self.save_config()
+        return self.config["embedding_dims"][model]
+
+    @property
+    def index_lock(self) -> ReadWriteLock:
+        # Writes to the index hold it exclusively, searches share it
+        if self._index_lock is None:
+            self._index_lock = ReadWriteLock()
+        return self._index_lock
+
+    async def asearch(self, vector: List[float], k: int) -> List[Document]:
+        """Search the persistent store, excluding writes that modify the index in place"""
+        async with self.index_lock.shared():
+            # Shielded, so a cancelled request doesn't release the lock mid-search
+            return await run_in_pool_shielded(self.vector_store.similarity_search_by_vector, vector, k=k)
+
+    def schedule_compaction(self) -> None:
+        """
+        Compact the on-disk store in the background once the append log has
+        grown enough, promoting the index to the configured ANN type first
+        when it has crossed the promotion threshold.
+        """
+        if not (self.persistence.needs_compaction() or needs_rebuild(self.vector_store.index, self.config)):
+            return
+        if self._compaction is not None and not self._compaction.done():
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Called outside the server loop, the next async ingest picks it up
+            return
+
+        async def compact():
+            async with self.index_lock:
+                if needs_rebuild(self.vector_store.index, self.config):
+                    # Training an IVF index or building an HNSW graph is CPU heavy
+                    self.vector_store.index = await run_in_pool_shielded(
+                        rebuild_index, self.vector_store.index, self.config
+                    )
+                await run_in_pool_shielded(self.persistence.compact, self.vector_store)
+
+        self._compaction = asyncio.ensure_future(compact())
+
+    @asynccontextmanager
+    async def aclosed(self):
+        """
+        Stop background stores and compaction and hold the index lock with
+        the store closed, so its files can be replaced. The store is
+        reopened when the block exits.
+        """
+        tasks = [task for task in list(self._store_tasks) + [self._compaction] if task is not None and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        async with self.index_lock:
+            self.persistence.close()
+            self.catalog.close()
+            try:
+                yield
+            finally:
+                await asyncio.to_thread(self.initialize_vector_store)
+                self.setup_chain()
 
     def setup_chain(self):
         prompt = ChatPromptTemplate.from_template("""
@@ -92,24 +213,27 @@ class WebSearchRAG:
             Answer:
         """)
 
-        def format_docs(docs):
-            return "\n\n".join([f"{doc.page_content}\nSource: {doc.metadata.get('url', 'N/A')}" for doc in docs])
+        # aquery_context retrieves itself, so the chunks it returns count as used
+        self.prompt = prompt
 
-        retriever = self.vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={'k': self.config["top_k"]}
-        )
+    def answer_chain(self, model: str):
+        return self.prompt | self.create_llm(model) | StrOutputParser()
 
-        self.chain = (
-            {
-                "context": retriever | format_docs,
-                "question": RunnablePassthrough()
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
+    def format_docs(self, docs) -> str:
+        # Neighbouring chunks of a page are merged, dropping the text repeated by chunk_overlap
+        return pack_context(
+            docs,
+            self.config["context_token_budget"],
+            lambda doc: doc.metadata.get("url"),
+            lambda passage: f"{passage.text}\nSource: {passage.metadata.get('url', 'N/A')}"
         )
 
+    async def aretrieve(self, vector: List[float]) -> str:
+        with span("retrieve"):
+            docs = await self.asearch(vector, self.config["top_k"])
+        await asyncio.to_thread(self.catalog.touch, [doc.id for doc in docs if doc.id])
+        return self.format_docs(docs)
+
     def get_top_k(self) -> int:
         return self.config["top_k"]
 
@@ -118,6 +242,44 @@ class WebSearchRAG:
         self.save_config()
         self.setup_chain()
 
+    def create_llm(self, model: str) -> ChatOllama:
+        return self.model_pool.llm(model, get_model_options(self.config, model))
+
+    @property
+    def llm(self) -> ChatOllama:
+        # The client of the default model, for requests that don't pick one
+        return self.create_llm(self.model_data.get_current_model())
+
+    def get_model_options(self) -> dict:
+        return self.config["model_options"]
+
+    def set_model_options(self, model_options: dict) -> None:
+        """Merge per-model keep_alive/num_ctx overrides; the pool hands out clients built with them"""
+        for model, options in model_options.items():
+            merged = {**self.config["model_options"].get(model, {}), **options}
+            self.config["model_options"][model] = {key: value for key, value in merged.items() if value is not None}
+        self.save_config()
+
+    def get_store_stats(self) -> dict:
+        return {
+            **self.catalog.stats(),
+            "max_chunks": self.config["web_store_max_chunks"],
+            "eviction": self.config["web_store_eviction"],
+        }
+
+    def get_index_config(self) -> dict:
+        return {key: self.config[key] for key in DEFAULT_INDEX_CONFIG}
+
+    def set_index_config(self, **options) -> None:
+        index_type = options.get("index_type")
+        if index_type and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}, expected one of {', '.join(INDEX_TYPES)}")
+        self.config.update({key: value for key, value in options.items() if value is not None})
+        self.save_config()
+        apply_search_params(self.vector_store.index, self.config)
+        # Promotes or demotes the index in the background if the type changed
+        self.schedule_compaction()
+
     def clean_text(self, text: str) -> str:
         """Clean extracted text"""
         text = re.sub(r"(\w)-\n(\w)", r"\1\2", text)
@@ -126,10 +288,22 @@ class WebSearchRAG:
         return text
 
     def perform_web_search(self, query: str) -> List[Dict]:
-        """Perform web search using DuckDuckGo"""
+        """Perform web search, reusing cached results for the same query"""
+        cached = self.web_cache.get_search(query, self.config["top_k"])
+        if cached is not None:
+            return cached
+
+        search_results = self.search(query, self.config["top_k"])
+        if search_results:
+            self.web_cache.put_search(query, self.config["top_k"], search_results)
+        return search_results
+
+    def search(self, query: str, max_results: int) -> List[Dict]:
+        """Search DuckDuckGo; the offline benchmarks replace this with their stub search engine"""
+        from duckduckgo_search import DDGS
         search_results = []
         with DDGS() as ddgs:
-            results = ddgs.text(query, backend="lite", max_results=self.config["top_k"])
+            results = ddgs.text(query, backend="lite", max_results=max_results)
             for r in results:
                 search_results.append({
                     "title": r["title"],
@@ -138,75 +312,220 @@ class WebSearchRAG:
                 })
         return search_results
 
-    def extract_web_content(self, url: str) -> tuple:
-        """Extract and process web content"""
-        try:
-            response = requests.get(url, timeout=10)
-            if response.status_code != 200:
-                return None, None
+    async def aperform_web_search(self, query: str) -> List[Dict]:
+        # duckduckgo_search only has a blocking client
+        with span("search"):
+            return await asyncio.to_thread(self.perform_web_search, query)
 
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Remove scripts and styles
-            for script in soup(["script", "style"]):
-                script.extract()
-
-            # Convert to markdown
-            h2t = html2text.HTML2Text()
-            h2t.ignore_links = False
-            h2t.ignore_images = True
-            text = h2t.handle(str(soup))
-            
-            # Get metadata
-            title = soup.title.string if soup.title else url
-            metadata = {
-                'title': title,
-                'url': url
-            }
-            
-            return self.clean_text(text), metadata
-            
-        except Exception as e:
-            print(f"Error extracting content from {url}: {e}")
-            return None, None
+    def html_to_markdown(self, url: str, html: bytes) -> tuple:
+        from bs4 import BeautifulSoup
+        import html2text
+        soup = BeautifulSoup(html, 'html.parser')
+        
+        # Remove scripts and styles
+        for script in soup(["script", "style"]):
+            script.extract()
 
-    def process_query(self, query: str, status_callback=None) -> dict:
+        # Convert to markdown
+        h2t = html2text.HTML2Text()
+        h2t.ignore_links = False
+        h2t.ignore_images = True
+        text = h2t.handle(str(soup))
+        
+        # Get metadata
+        title = soup.title.string if soup.title else url
+        metadata = {
+            'title': title,
+            'url': url
+        }
+        
+        return self.clean_text(text), metadata
+
+    async def aextract_web_content(self, url: str) -> tuple:
+        """Extract and process web content without blocking the event loop"""
+        return await self.fetcher.fetch(url, self.html_to_markdown)
+
+    def split_pages(self, pages: List[tuple]) -> List[Document]:
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            add_start_index=True
+        )
+        documents = []
+        for content, metadata in pages:
+            if content:
+                for doc in text_splitter.create_documents([content], [metadata]):
+                    doc.metadata["content_hash"] = chunk_hash(doc.page_content)
+                    documents.append(doc)
+        return documents
+
+    async def afetch_documents(self, query: str) -> List[Document]:
+        results = await self.aperform_web_search(query)
+        print("websearch over , now extracting content")
+
+        # Pages are fetched concurrently, so this costs roughly the slowest fetch
+        with span("fetch", urls=len(results)):
+            pages = await self.fetcher.fetch_all(
+                [result['link'] for result in results],
+                self.html_to_markdown
+            )
+        return self.split_pages(pages)
+
+    async def aindex_search_results(self, query: str) -> None:
+        documents = await self.afetch_documents(query)
+
+        print("content extracted, adding to vector store")
+
+        if documents:
+            # Only chunks that aren't stored yet are embedded, outside the lock
+            to_add, _, _ = await asyncio.to_thread(self.catalog.plan, documents)
+            await self.astore_documents(documents, await self.embed_by_hash(to_add, {}))
+
+    async def astore_documents(self, documents: List[Document], embedded: Dict[str, List[float]]) -> None:
+        async with self.index_lock:
+            # Planned again now that concurrent searches can't change the store
+            to_add, stale_ids, duplicates = await asyncio.to_thread(self.catalog.plan, documents)
+            embedded = await self.embed_by_hash(to_add, embedded)
+            vectors = [embedded[doc.metadata["content_hash"]] for doc in to_add]
+            # Deletes rewrite the index and sync the docstore log, keep them off the event loop
+            await run_in_pool_shielded(self.store_documents, to_add, vectors, stale_ids, duplicates)
+        self.schedule_compaction()
+
+    def store_documents(self, to_add: List[Document], vectors: list, stale_ids: List[str], duplicates: int) -> None:
+        self.persistence.ensure_writable(self.vector_store)
+        self.replace_documents(to_add, vectors, stale_ids, duplicates)
+        self.persistence.append(vectors)
+        self.evict_over_capacity()
+
+    def schedule_store(self, documents: List[Document], embedded: Dict[str, List[float]], used: List[str]) -> None:
+        """Keep the fetched chunks for later fallback searches without delaying the answer"""
+        async def store():
+            try:
+                await self.astore_documents(documents, embedded)
+                await asyncio.to_thread(self.catalog.touch, hashes=used)
+            except Exception as e:
+                print(f"Error storing web search results: {str(e)}")
+
+        task = asyncio.ensure_future(store())
+        self._store_tasks.add(task)
+        task.add_done_callback(self._store_tasks.discard)
+
+    async def embed_by_hash(self, documents: List[Document], embedded: Dict[str, List[float]]) -> Dict[str, List[float]]:
+        """Embed the documents not in embedded, in concurrent batches, keyed by content hash"""
+        missing = list({
+            doc.metadata["content_hash"]: doc for doc in documents
+            if doc.metadata["content_hash"] not in embedded
+        }.values())
+        if not missing:
+            return embedded
+
+        batch_size = self.config["embed_batch_size"]
+        semaphore = asyncio.Semaphore(self.config["embed_concurrency"])
+
+        async def embed(batch):
+            async with semaphore:
+                return await self.embeddings.aembed_documents([doc.page_content for doc in batch])
+
+        batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+        embedded = dict(embedded)
+        for batch, vectors in zip(batches, await asyncio.gather(*(embed(batch) for batch in batches))):
+            embedded.update((doc.metadata["content_hash"], vector) for doc, vector in zip(batch, vectors))
+        return embedded
+
+    async def aquery_context(self, query: str, vector: List[float]) -> str:
+        """
+        Context for the answer. In query mode only the chunks of the pages
+        fetched for this question are ranked, in a throwaway index, so the
+        cost depends on those pages alone and chunks from unrelated earlier
+        searches can't crowd them out.
+        """
+        if self.config["web_retrieval_mode"] == "global":
+            await self.aindex_search_results(query)
+            return await self.aretrieve(vector)
+
+        documents = await self.afetch_documents(query)
+        embedded = await self.embed_by_hash(documents, {})
+        unique = list({doc.metadata["content_hash"]: doc for doc in documents}.values())
+        top_k = self.config["top_k"]
+        with span("retrieve", chunks=len(unique)):
+            positions = await run_in_pool(
+                nearest, [embedded[doc.metadata["content_hash"]] for doc in unique], vector, top_k
+            )
+            docs = [unique[position] for position in positions]
+
+            if len(docs) < top_k and self.config["web_retrieval_fallback"]:
+                current = {doc.metadata["content_hash"] for doc in documents}
+                stored = await self.asearch(vector, top_k + len(current))
+                extra = [doc for doc in stored if doc.metadata.get("content_hash", chunk_hash(doc.page_content)) not in current]
+                extra = extra[:top_k - len(docs)]
+                await asyncio.to_thread(self.catalog.touch, [doc.id for doc in extra if doc.id])
+                docs.extend(extra)
+
+        if documents:
+            self.schedule_store(documents, embedded, [doc.metadata["content_hash"] for doc in docs])
+        return self.format_docs(docs)
+
+    def replace_documents(self, to_add: List[Document], vectors: list, stale_ids: List[str], duplicates: int) -> None:
+        """Drop the chunks re-fetched pages no longer contain and add the new ones"""
+        if stale_ids:
+            self.persistence.delete(self.vector_store, stale_ids)
+        ids = []
+        if to_add:
+            ids = self.vector_store.add_embeddings(
+                list(zip([doc.page_content for doc in to_add], vectors)),
+                metadatas=[doc.metadata for doc in to_add]
+            )
+        self.catalog.record(to_add, ids, stale_ids, duplicates)
+
+    def evict_over_capacity(self) -> None:
+        ids = self.catalog.eviction_candidates(self.config["web_store_max_chunks"], self.config["web_store_eviction"])
+        if ids:
+            print(f"Web store over capacity, evicting {len(ids)} chunks")
+            self.persistence.delete(self.vector_store, ids)
+            self.catalog.evicted(ids)
+
+    async def aprocess_query(self, query: str, metadata: dict = None, model: str = None) -> dict:
+        model = model or self.model_data.get_current_model()
         try:
-            results = self.perform_web_search(query)
-            print("websearch over , now extracting content")
-            
-            documents = []
-            for result in results:
-                url = result['link']
-                content, metadata = self.extract_web_content(url)
-                if content:
-                    text_splitter = RecursiveCharacterTextSplitter(
-                        chunk_size=1000,
-                        chunk_overlap=200
-                    )
-                    chunks = text_splitter.split_text(content)
-                    
-                    for chunk in chunks:
-                        doc = Document(page_content=chunk, metadata=metadata)
-                        documents.append(doc)
-            
-            print("content extracted, adding to vector store")
-            
-            if documents:
-                texts = [doc.page_content for doc in documents]
-                metadatas = [doc.metadata for doc in documents]
-                self.vector_store.add_texts(texts, metadatas=metadatas)
-            
-            res = self.chain.invoke(query)
+            # Web answers are keyed by the question alone, since knowing the
+            # context would mean searching first; the TTL bounds staleness.
+            # Without a context to compare, a merely similar question could get
+            # an answer drawn from different pages, so only the exact tier is used.
+            async def generate():
+                vector = await self.embeddings.aembed_query(query)
+                context = await self.aquery_context(query, vector)
+                return await self.model_pool.ainvoke(
+                    model, get_model_options(self.config, model), self.answer_chain(model),
+                    {"context": context, "question": query}
+                )
+            res = await self.response_cache.aanswer("web", model, query, generate, metadata=metadata)
             print("response: ", res)
             return res
-            
+
+        except (ModelBusyError, SchedulerBusyError):
+            raise
         except Exception as e:
             return {"error": f"Error processing web search: {str(e)}"}
 
-    def ask(self, question: str) -> dict:
+    async def astream(self, query: str, metadata: dict = None, model: str = None):
+        model = model or self.model_data.get_current_model()
+
+        async def generate():
+            # Search and retrieval are not streamed, only the answer generation is
+            vector = await self.embeddings.aembed_query(query)
+            context = await self.aquery_context(query, vector)
+            async for chunk in self.model_pool.astream(
+                model, get_model_options(self.config, model), self.answer_chain(model),
+                {"context": context, "question": query}
+            ):
+                yield chunk
+        async for chunk in self.response_cache.astream("web", model, query, generate, metadata=metadata):
+            yield chunk
+
+    async def aask(self, question: str, metadata: dict = None, model: str = None) -> dict:
         try:
-            return self.process_query(question)
+            return await self.aprocess_query(question, metadata, model)
+        except (ModelBusyError, SchedulerBusyError):
+            raise
         except Exception as e:
             return {"error": f"Error generating response: {str(e)}"}
-
@@ -0,0 +1,136 @@
+from typing import Callable, Dict, Hashable, List, Optional
+
+from langchain_core.documents import Document
+
+from utils.session_store import estimate_tokens
+
+# Shortest shared text treated as splitter overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+# Inverse of estimate_tokens, for cutting text down to a token count
+CHARS_PER_TOKEN = 4
+
+
+def overlap_length(first: str, second: str) -> int:
+    """Length of the longest suffix of first that is a prefix of second"""
+    probe = second[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    start = max(0, len(first) - len(second))
+    while True:
+        position = first.find(probe, start)
+        if position == -1:
+            return 0
+        if second.startswith(first[position:]):
+            return len(first) - position
+        start = position + 1
+
+
+class Passage:
+    """Contiguous text from one source, built from one or more chunks"""
+
+    def __init__(self, doc: Document):
+        self.text = doc.page_content
+        self.start = doc.metadata.get("start_index")
+        self.metadata = doc.metadata
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+    def absorb(self, text: str, start: Optional[int]) -> bool:
+        """Merge text found at offset start into this passage if it overlaps or touches it"""
+        if self.start is not None and start is not None:
+            if start > self.end or start + len(text) < self.start:
+                return False
+            if start < self.start:
+                self.text = text + self.text[start + len(text) - self.start:]
+                self.start = start
+            elif start + len(text) > self.end:
+                self.text = self.text + text[self.end - start:]
+            return True
+
+        # Chunks stored without offsets are matched on the text the splitter repeated
+        if text in self.text:
+            return True
+        if self.text in text:
+            self.text, self.start = text, start
+            return True
+        overlap = overlap_length(self.text, text)
+        if overlap:
+            self.text += text[overlap:]
+            return True
+        overlap = overlap_length(text, self.text)
+        if overlap:
+            self.text = text + self.text[overlap:]
+            self.start = None
+            return True
+        return False
+
+
+def merge(docs: List[Document]) -> List[Passage]:
+    """Merge chunks of one source into passages, in document order where offsets are known"""
+    passages: List[Passage] = []
+    for doc in sorted(docs, key=lambda d: d.metadata.get("start_index", 0)):
+        merged = Passage(doc)
+        # A chunk can bridge two passages, so keep merging until nothing connects
+        connected = True
+        while connected:
+            connected = next((p for p in passages if merged.absorb(p.text, p.start)), None)
+            if connected:
+                passages.remove(connected)
+        passages.append(merged)
+    return passages
+
+
+def truncate(doc: Document, token_budget: int) -> Document:
+    """doc with its text cut, at a word boundary where possible, to fit token_budget"""
+    limit = token_budget * CHARS_PER_TOKEN
+    text = doc.page_content
+    if len(text) <= limit:
+        return doc
+    cut = text.rfind(" ", 0, limit + 1)
+    return Document(page_content=text[:cut if cut > limit // 2 else limit], metadata=doc.metadata, id=doc.id)
+
+
+def check_chunk_budget(chunk_size: int, token_budget: int) -> None:
+    """Reject settings under which a single chunk can't fit in the prompt context"""
+    if estimate_tokens("x" * chunk_size) > token_budget:
+        raise ValueError(
+            f"chunk_size {chunk_size} (about {estimate_tokens('x' * chunk_size)} tokens) "
+            f"exceeds context_token_budget {token_budget}"
+        )
+
+
+def pack_context(docs: List[Document],
+                 token_budget: int,
+                 source_key: Callable[[Document], Hashable],
+                 format_passage: Callable[[Passage], str] = lambda passage: passage.text) -> str:
+    """
+    Build the prompt context from docs, given most relevant first. Chunks
+    are taken in relevance order while the packed context stays within
+    token_budget, counting text repeated by the splitter's chunk_overlap
+    only once. The most relevant chunk is always used, cut down to the
+    budget if it is larger. Chunks from the same source are merged into
+    contiguous passages, and sources are ordered by their best chunk.
+    """
+    groups: Dict[Hashable, List[Document]] = {}
+    costs: Dict[Hashable, int] = {}
+    used = 0
+    for position, doc in enumerate(docs):
+        if position == 0:
+            doc = truncate(doc, token_budget)
+        key = source_key(doc)
+        candidate = groups.get(key, []) + [doc]
+        cost = sum(estimate_tokens(passage.text) for passage in merge(candidate))
+        delta = cost - costs.get(key, 0)
+        if used + delta > token_budget:
+            # A smaller chunk further down may still fit
+            continue
+        groups[key] = candidate
+        costs[key] = cost
+        used += delta
+
+    sections = []
+    for group in groups.values():
+        sections.extend(format_passage(passage) for passage in merge(group))
+    return "\n\n".join(sections)
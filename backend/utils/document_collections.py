@@ -0,0 +1,437 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from utils.bm25_index import BM25Index
+from utils.executors import run_in_pool, run_in_pool_shielded
+from utils.locks import ReadWriteLock
+from utils.response_cache import fingerprint
+from utils.vector_index import apply_search_params, needs_rebuild, rebuild_index
+from utils.vector_persistence import IncrementalPersistence
+
+DEFAULT_COLLECTION = "default"
+
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+CATALOG_FILE = "documents.sqlite"
+
+
+def validate_collection_name(name: str) -> str:
+    # Names become directory names, so keep them to a safe alphabet
+    if not COLLECTION_NAME_PATTERN.match(name or ""):
+        raise ValueError(
+            f"Invalid collection name: {name!r}, use up to 64 letters, digits, '-' and '_'"
+        )
+    return name
+
+
+def document_name(source: str) -> str:
+    """Original file name of an upload saved as temp/<uuid>_<name>"""
+    name = os.path.basename(source or "")
+    prefix, _, rest = name.partition("_")
+    return rest if rest and len(prefix) == 32 else name
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentCatalog:
+    """
+    The documents of a collection and the docstore ids of their chunks, so a
+    document can be deleted from the index without rebuilding it. Each
+    document also keeps the hash of the uploaded file and of every page,
+    so a re-upload only re-embeds the pages that changed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                document_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                added_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                document_id TEXT NOT NULL
+            )
+        """)
+        self._add_column("documents", "file_hash", "TEXT")
+        self._add_column("chunks", "page", "INTEGER")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                document_id TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                page_hash TEXT NOT NULL,
+                PRIMARY KEY (document_id, page)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_file_hash ON documents (file_hash)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('created_at', ?)", (str(time.time()),))
+        self._conn.commit()
+
+    def _add_column(self, table: str, column: str, kind: str) -> None:
+        # Catalogs created before the column existed are migrated in place
+        columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+    def reconcile(self, store: FAISS) -> None:
+        """Bring the catalog in line with the store after loading, e.g. a crash between the two"""
+        stored = set(store.index_to_docstore_id.values())
+        with self._lock:
+            cataloged = {row[0] for row in self._conn.execute("SELECT chunk_id FROM chunks")}
+            self._conn.executemany(
+                "DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in cataloged - stored]
+            )
+
+            # Chunks stored before the catalog existed are grouped by the upload they came from
+            now = time.time()
+            for chunk_id in stored - cataloged:
+                doc = store.docstore.search(chunk_id)
+                if not isinstance(doc, Document):
+                    continue
+                source = doc.metadata.get("source", "")
+                document_id = doc.metadata.get("document_id") or fingerprint(source)[:32]
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO documents (document_id, name, added_at) VALUES (?, ?, ?)",
+                    (document_id, document_name(source), now)
+                )
+                self._conn.execute(
+                    "INSERT INTO chunks (chunk_id, document_id, page) VALUES (?, ?, ?)",
+                    (chunk_id, document_id, doc.metadata.get("page"))
+                )
+            self._conn.execute(
+                "DELETE FROM documents WHERE document_id NOT IN (SELECT document_id FROM chunks)"
+            )
+            self._conn.execute(
+                "DELETE FROM pages WHERE document_id NOT IN (SELECT document_id FROM documents)"
+            )
+            self._conn.commit()
+
+    def add_document(self, document_id: str, name: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO documents (document_id, name, added_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (document_id) DO UPDATE SET name = excluded.name",
+                (document_id, name, time.time())
+            )
+            self._conn.commit()
+
+    def find_document(self, name: str, file_hash: str) -> Tuple[Optional[str], bool]:
+        """
+        Return (document id, unchanged) for an upload: the document with the
+        same file contents, else the latest one with the same name, else None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT document_id FROM documents WHERE file_hash = ? LIMIT 1", (file_hash,)
+            ).fetchone()
+            if row is not None:
+                return row[0], True
+            row = self._conn.execute(
+                "SELECT document_id FROM documents WHERE name = ? ORDER BY added_at DESC LIMIT 1", (name,)
+            ).fetchone()
+            return (row[0] if row else None), False
+
+    def page_hashes(self, document_id: str) -> Dict[int, str]:
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT page, page_hash FROM pages WHERE document_id = ?", (document_id,)
+            ))
+
+    def record_pages(self, document_id: str, page_hashes: Dict[int, str], total_pages: int, file_hash: str) -> None:
+        """Store the hashes of re-embedded pages and the file hash once an upload is fully ingested"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages (document_id, page, page_hash) VALUES (?, ?, ?)",
+                [(document_id, page, page_hash) for page, page_hash in page_hashes.items()]
+            )
+            self._conn.execute("DELETE FROM pages WHERE document_id = ? AND page >= ?", (document_id, total_pages))
+            self._conn.execute("UPDATE documents SET file_hash = ? WHERE document_id = ?", (file_hash, document_id))
+            self._conn.commit()
+
+    def add_chunks(self, document_id: str, chunk_ids: List[str], pages: List[Optional[int]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, document_id, page) VALUES (?, ?, ?)",
+                [(chunk_id, document_id, page) for chunk_id, page in zip(chunk_ids, pages)]
+            )
+            self._conn.commit()
+
+    def page_chunk_ids(self, document_id: str, pages: List[int] = (), from_page: int = None) -> List[str]:
+        """Ids of the document's chunks on the given pages, on pages from from_page on, or on no known page"""
+        conditions, params = ["page IS NULL"], [document_id]
+        if pages:
+            conditions.append(f"page IN ({', '.join('?' * len(pages))})")
+            params += list(pages)
+        if from_page is not None:
+            conditions.append("page >= ?")
+            params.append(from_page)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                f"SELECT chunk_id FROM chunks WHERE document_id = ? AND ({' OR '.join(conditions)})", params
+            )]
+
+    def has_document(self, document_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM documents WHERE document_id = ?", (document_id,)
+            ).fetchone() is not None
+
+    def chunk_ids(self, document_id: str) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT chunk_id FROM chunks WHERE document_id = ?", (document_id,)
+            )]
+
+    def remove_chunks(self, chunk_ids: List[str]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+            self._conn.commit()
+
+    def remove_document(self, document_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+            self._conn.execute("DELETE FROM pages WHERE document_id = ?", (document_id,))
+            self._conn.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
+            self._conn.commit()
+
+    def documents(self) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT d.document_id, d.name, d.added_at, COUNT(c.chunk_id)
+                FROM documents d LEFT JOIN chunks c ON c.document_id = d.document_id
+                GROUP BY d.document_id ORDER BY d.added_at
+            """).fetchall()
+        return [
+            {"document_id": document_id, "name": name, "added_at": added_at, "chunks": chunks}
+            for document_id, name, added_at, chunks in rows
+        ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            chunks = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            created_at = float(self._conn.execute("SELECT value FROM meta WHERE key = 'created_at'").fetchone()[0])
+        return {"documents": documents, "chunks": chunks, "created_at": created_at}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class Collection:
+    """
+    A named set of documents with its own FAISS store, BM25 index and
+    document catalog. A query only searches the collections it names, so
+    its cost depends on their size rather than on the whole corpus. The
+    store is loaded on first use; listing a collection only reads its
+    catalog.
+    """
+
+    def __init__(self, name: str, directory: str, config: Dict):
+        self.name = name
+        self.directory = directory
+        # Shared with ChatWithFiles so index settings apply to every collection
+        self.config = config
+        os.makedirs(directory, exist_ok=True)
+        self.catalog = DocumentCatalog(os.path.join(directory, CATALOG_FILE))
+        self.persistence: Optional[IncrementalPersistence] = None
+        self.vector_store: Optional[FAISS] = None
+        # Built from the docstore on the first hybrid query
+        self.bm25: Optional[BM25Index] = None
+        self._compaction = None
+        self._index_lock = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.vector_store is not None
+
+    def load(self, embeddings, get_dim: Callable[[], int]) -> FAISS:
+        """Open the store, rebuilding it from the snapshot and append log if they exist"""
+        self.persistence = IncrementalPersistence(self.directory)
+        self._compaction = None
+        self.bm25 = None
+
+        self.vector_store = self.persistence.load(embeddings)
+        if self.vector_store is not None:
+            apply_search_params(self.vector_store.index, self.config)
+        elif os.path.exists(os.path.join(self.directory, "index.faiss")):
+            # Index saved with save_local by an older version, migrate it
+            self.vector_store = FAISS.load_local(self.directory, embeddings, allow_dangerous_deserialization=True)
+            self.persistence.compact(self.vector_store)
+        else:
+            self.vector_store = self.persistence.create(embeddings, get_dim())
+
+        self.catalog.reconcile(self.vector_store)
+        return self.vector_store
+
+    @property
+    def index_lock(self) -> ReadWriteLock:
+        # Writes hold it exclusively, so concurrent ingestion jobs don't race and
+        # no search runs while a delete or compaction changes the index in place
+        if self._index_lock is None:
+            self._index_lock = ReadWriteLock()
+        return self._index_lock
+
+    def build_bm25(self) -> BM25Index:
+        """Index every stored chunk; afterwards the index is kept up to date as chunks are added"""
+        bm25 = BM25Index()
+        ids = list(self.vector_store.index_to_docstore_id.values())
+        bm25.add(ids, [self.vector_store.docstore.search(doc_id).page_content for doc_id in ids])
+        return bm25
+
+    async def abm25(self) -> BM25Index:
+        if self.bm25 is None:
+            async with self.index_lock:
+                if self.bm25 is None:
+                    self.bm25 = await run_in_pool(self.build_bm25)
+        return self.bm25
+
+    def chunks_added(self, document_id: str, ids: List[str], chunks: List[Document]) -> None:
+        if self.bm25 is not None:
+            self.bm25.add(ids, [chunk.page_content for chunk in chunks])
+        self.catalog.add_chunks(document_id, ids, [chunk.metadata.get("page") for chunk in chunks])
+
+    async def aadd_embeddings(self, document_id: str, chunks: List[Document], vectors: list,
+                              ids: List[str] = None) -> List[str]:
+        texts = [chunk.page_content for chunk in chunks]
+        async with self.index_lock:
+            await run_in_pool_shielded(self.persistence.ensure_writable, self.vector_store)
+            ids = self.vector_store.add_embeddings(
+                list(zip(texts, vectors)),
+                metadatas=[chunk.metadata for chunk in chunks],
+                ids=ids
+            )
+            # Only the new vectors are written, so ingest I/O scales with the document
+            await run_in_pool_shielded(self.persistence.append, vectors)
+            await asyncio.to_thread(self.chunks_added, document_id, ids, chunks)
+        return ids
+
+    def delete_chunks(self, chunk_ids: List[str]) -> None:
+        """Delete chunks by id through the append log, without rebuilding the index"""
+        if not chunk_ids:
+            return
+        self.persistence.delete(self.vector_store, chunk_ids)
+        if self.bm25 is not None:
+            self.bm25.remove(chunk_ids)
+        self.catalog.remove_chunks(chunk_ids)
+
+    async def adelete_chunks(self, chunk_ids: List[str]) -> None:
+        if not chunk_ids:
+            return
+        async with self.index_lock:
+            await run_in_pool_shielded(self.delete_chunks, chunk_ids)
+        self.schedule_compaction()
+
+    async def adelete_document(self, document_id: str) -> int:
+        """Delete a document's chunks by id; returns how many were removed"""
+        chunk_ids = await asyncio.to_thread(self.catalog.chunk_ids, document_id)
+        await self.adelete_chunks(chunk_ids)
+        await asyncio.to_thread(self.catalog.remove_document, document_id)
+        return len(chunk_ids)
+
+    async def asearch(self, question: str, vector: List[float], fetch_k: int,
+                      hybrid: bool) -> Tuple[List[Tuple[Document, float]], List[Tuple[str, float]]]:
+        """Return (dense [(doc, distance)], sparse [(doc id, BM25 score)]) candidates"""
+        # Built before the shared lock is taken, building takes it exclusively
+        bm25 = await self.abm25() if hybrid else None
+        async with self.index_lock.shared():
+            # Shielded, so a cancelled request doesn't release the lock mid-search
+            dense = run_in_pool_shielded(self.vector_store.similarity_search_with_score_by_vector, vector, k=fetch_k)
+            if bm25 is None:
+                return await dense, []
+            dense, sparse = await asyncio.gather(dense, run_in_pool(bm25.search, question, fetch_k))
+        return dense, sparse
+
+    def search_batch(self, questions: List[str], vectors: List[List[float]], fetch_k: int,
+                     bm25: Optional[BM25Index]) -> List[Tuple[List[Tuple[Document, float]], List[Tuple[str, float]]]]:
+        """asearch for many questions, with one FAISS search over the matrix of their embeddings"""
+        store = self.vector_store
+        k = min(fetch_k, store.index.ntotal)
+        dense = [[] for _ in questions]
+        if k:
+            distances, positions = store.index.search(np.asarray(vectors, dtype="float32"), k)
+            for hits, row_distances, row_positions in zip(dense, distances, positions):
+                for distance, position in zip(row_distances, row_positions):
+                    # FAISS pads rows with -1 when fewer than k vectors match
+                    if position == -1:
+                        continue
+                    doc = store.docstore.search(store.index_to_docstore_id.get(position))
+                    # A miss comes back as a "not found" string rather than a document
+                    if isinstance(doc, Document):
+                        hits.append((doc, float(distance)))
+        sparse = [bm25.search(question, fetch_k) for question in questions] if bm25 else [[] for _ in questions]
+        return list(zip(dense, sparse))
+
+    async def asearch_batch(self, questions: List[str], vectors: List[List[float]], fetch_k: int,
+                            hybrid: bool) -> List[Tuple[List[Tuple[Document, float]], List[Tuple[str, float]]]]:
+        bm25 = await self.abm25() if hybrid else None
+        # FAISS releases the GIL while searching, so the batch runs in the pool
+        async with self.index_lock.shared():
+            return await run_in_pool_shielded(self.search_batch, questions, vectors, fetch_k, bm25)
+
+    def schedule_compaction(self) -> None:
+        """
+        Compact the on-disk store in the background once the append log has
+        grown enough, promoting the index to the configured ANN type first
+        when it has crossed the promotion threshold.
+        """
+        if not (self.persistence.needs_compaction() or needs_rebuild(self.vector_store.index, self.config)):
+            return
+        if self._compaction is not None and not self._compaction.done():
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Called outside the server loop, the next async ingest picks it up
+            return
+
+        async def compact():
+            async with self.index_lock:
+                if needs_rebuild(self.vector_store.index, self.config):
+                    # Training an IVF index or building an HNSW graph is CPU heavy
+                    self.vector_store.index = await run_in_pool_shielded(
+                        rebuild_index, self.vector_store.index, self.config
+                    )
+                await run_in_pool_shielded(self.persistence.compact, self.vector_store)
+
+        self._compaction = asyncio.ensure_future(compact())
+
+    async def astop_compaction(self) -> None:
+        """Cancel a running compaction, returning once its current write has finished"""
+        if self._compaction is not None and not self._compaction.done():
+            self._compaction.cancel()
+            await asyncio.gather(self._compaction, return_exceptions=True)
+
+    def info(self) -> Dict:
+        return {"name": self.name, **self.catalog.stats()}
+
+    def close(self) -> None:
+        if self.persistence is not None:
+            self.persistence.close()
+        self.catalog.close()
@@ -0,0 +1,30 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Bounded pool for CPU-bound work (PDF parsing, HTML conversion, index writes)
+# so that it never runs on the event loop
+cpu_pool = ThreadPoolExecutor(
+    max_workers=min(4, os.cpu_count() or 1),
+    thread_name_prefix="cpu-worker"
+)
+
+
+async def run_in_pool(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_pool, partial(func, *args, **kwargs))
+
+
+async def run_in_pool_shielded(func, *args, **kwargs):
+    """
+    Like run_in_pool, but if the caller is cancelled it still waits for the
+    call to finish before re-raising, so locks held by the caller are not
+    released while the write is in flight.
+    """
+    future = asyncio.ensure_future(run_in_pool(func, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await future
+        raise
@@ -0,0 +1,145 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    def __init__(self, func: Callable[["Job"], Awaitable[Any]], name: str, cleanup: Callable[[], None] = None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.func = func
+        self.cleanup = cleanup
+        self.status = QUEUED
+        self.progress: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED, CANCELLED)
+
+    def update_progress(self, progress: Dict[str, Any]) -> None:
+        self.progress = progress
+
+    def finish(self, status: str, error: str = None) -> None:
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        if self.cleanup:
+            try:
+                self.cleanup()
+            except Exception as e:
+                print(f"Error cleaning up job {self.id}: {str(e)}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """Local queue of background jobs drained by a fixed number of worker tasks"""
+
+    def __init__(self, num_workers: Union[int, Callable[[], int]] = 2, max_finished_jobs: int = 1000):
+        # A callable is resolved when the workers start, so reading the
+        # worker count from config doesn't force the subsystem to load early
+        self.num_workers = num_workers
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._closing = False
+
+    def _ensure_workers(self) -> None:
+        # Workers are started on first use since they need the running event loop
+        if self._queue is None:
+            if callable(self.num_workers):
+                self.num_workers = self.num_workers()
+            self._queue = asyncio.Queue()
+            self._workers = [
+                asyncio.create_task(self._worker()) for _ in range(self.num_workers)
+            ]
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if job.done:
+                # Cancelled while still queued
+                continue
+
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.task = asyncio.create_task(job.func(job))
+            try:
+                await job.task
+                job.finish(SUCCEEDED)
+            except asyncio.CancelledError:
+                job.finish(CANCELLED)
+                if self._closing:
+                    raise
+            except Exception as e:
+                job.finish(FAILED, str(e))
+            finally:
+                job.task = None
+                self._prune()
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def submit(self, func: Callable[[Job], Awaitable[Any]], name: str = "", cleanup: Callable[[], None] = None) -> Job:
+        self._ensure_workers()
+        job = Job(func, name, cleanup)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job is None or job.done:
+            return job
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            job.finish(CANCELLED)
+        return job
+
+    async def cancel_all(self) -> None:
+        """Cancel every queued and running job, returning once the running ones have stopped"""
+        running = [job.task for job in self.jobs.values() if not job.done and job.task is not None]
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        await asyncio.gather(*running, return_exceptions=True)
+
+    async def shutdown(self) -> None:
+        self._closing = True
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._closing = False
@@ -0,0 +1,80 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class ReadWriteLock:
+    """
+    asyncio lock held either by any number of readers or by one writer.
+    Entering the lock itself (async with lock) takes it exclusively, so it
+    replaces an asyncio.Lock that serialized writers; readers use
+    shared(). Waiters are served in arrival order, so a writer isn't
+    starved by a stream of readers.
+    """
+
+    def __init__(self):
+        self.readers = 0
+        self.writing = False
+        self._waiters: deque = deque()
+
+    def _can_start(self, exclusive: bool) -> bool:
+        return not self.writing and not (exclusive and self.readers)
+
+    def _grant(self, exclusive: bool) -> None:
+        if exclusive:
+            self.writing = True
+        else:
+            self.readers += 1
+
+    def _release(self, exclusive: bool) -> None:
+        if exclusive:
+            self.writing = False
+        else:
+            self.readers -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            waiter, exclusive = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if not self._can_start(exclusive):
+                return
+            self._waiters.popleft()
+            self._grant(exclusive)
+            waiter.set_result(None)
+
+    async def _acquire(self, exclusive: bool) -> None:
+        if not self._waiters and self._can_start(exclusive):
+            self._grant(exclusive)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((waiter, exclusive))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the caller was cancelled
+                self._release(exclusive)
+            else:
+                self._wake()
+            raise
+
+    def locked(self) -> bool:
+        return self.writing or self.readers > 0
+
+    async def __aenter__(self):
+        await self._acquire(True)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._release(True)
+
+    @asynccontextmanager
+    async def shared(self):
+        await self._acquire(False)
+        try:
+            yield self
+        finally:
+            self._release(False)
@@ -0,0 +1,277 @@
+import bisect
+import contextvars
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Metrics are kept in process and rendered in the Prometheus text format on
+# scrape, so the instrumentation needs no client library or background thread.
+
+NAMESPACE = "ollama_web_ui"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        self.name = f"{NAMESPACE}_{name}"
+        self.description = description
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels) -> None:
+        """Export a running total another component keeps, such as a cache's hit count"""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts, made cumulative when rendered, then sum and count
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "stage_seconds", "Time spent in each pipeline stage", ("stage",)
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "request_seconds", "HTTP request latency until the last byte of the response", ("method", "path", "status")
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_tokens_total", "Tokens evaluated by Ollama, kind is prompt or generated", ("model", "kind")
+))
+LLM_EVAL_SECONDS = REGISTRY.register(Counter(
+    "llm_eval_seconds_total", "Time Ollama reported evaluating tokens, kind is prompt or generated", ("model", "kind")
+))
+LLM_TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    "llm_generation_tokens_per_second", "Generation speed of each LLM call", ("model",),
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+))
+EMBEDDED_TEXTS = REGISTRY.register(Counter(
+    "embedded_texts_total", "Texts sent to the embedding model, cache hits excluded", ("model",)
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "cache_requests_total", "Cache lookups since start by result", ("cache", "result")
+))
+CACHE_ENTRIES = REGISTRY.register(Gauge(
+    "cache_entries", "Entries held by each cache", ("cache",)
+))
+QUEUE_ACTIVE = REGISTRY.register(Gauge(
+    "queue_active", "Calls running per scheduler lane, model or job queue", ("queue", "name")
+))
+QUEUE_WAITING = REGISTRY.register(Gauge(
+    "queue_waiting", "Calls waiting per scheduler lane, model or job queue", ("queue", "name")
+))
+QUEUE_REJECTED = REGISTRY.register(Counter(
+    "queue_rejected_total", "Calls rejected since start per scheduler lane or model", ("queue", "name")
+))
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+
+
+def record_span(stage: str, seconds: float, start: float = None, **attributes) -> None:
+    """Record a stage that took seconds, in the stage histogram and the current request's trace"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        offset = (start if start is not None else time.perf_counter() - seconds) - trace.start
+        trace.spans.append({"stage": stage, "offset": round(offset, 6), "seconds": round(seconds, 6), **attributes})
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start, start, **attributes)
+
+
+def start_trace(name: str) -> Tuple[Trace, contextvars.Token]:
+    trace = Trace(name)
+    return trace, _current_trace.set(trace)
+
+
+def log_trace(trace: Trace, **attributes) -> None:
+    print(json.dumps({
+        "trace_id": trace.id,
+        "name": trace.name,
+        "started_at": trace.started_at,
+        "seconds": round(time.perf_counter() - trace.start, 6),
+        **attributes,
+        "spans": trace.spans,
+    }))
+
+
+def record_llm_call(model: str, info: Dict[str, Any], start: float = None) -> None:
+    """
+    Token counts and timings from the final frame of an Ollama generation.
+    start is when the call was made; the prompt_eval and generation spans
+    are laid out from it in the order Ollama ran them. Loads are recorded
+    by the model pool, which times them itself.
+    """
+    prompt_tokens = info.get("prompt_eval_count") or 0
+    generated_tokens = info.get("eval_count") or 0
+    prompt_seconds = (info.get("prompt_eval_duration") or 0) / 1e9
+    generation_seconds = (info.get("eval_duration") or 0) / 1e9
+    load_seconds = (info.get("load_duration") or 0) / 1e9
+    LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    LLM_TOKENS.inc(generated_tokens, model=model, kind="generated")
+    LLM_EVAL_SECONDS.inc(prompt_seconds, model=model, kind="prompt")
+    LLM_EVAL_SECONDS.inc(generation_seconds, model=model, kind="generated")
+    if generated_tokens and generation_seconds:
+        LLM_TOKENS_PER_SECOND.observe(generated_tokens / generation_seconds, model=model)
+    if start is None:
+        total_seconds = (info.get("total_duration") or 0) / 1e9
+        start = time.perf_counter() - (total_seconds or load_seconds + prompt_seconds + generation_seconds)
+    prompt_start = start + load_seconds
+    record_span("prompt_eval", prompt_seconds, prompt_start, model=model, tokens=prompt_tokens)
+    record_span("generation", generation_seconds, prompt_start + prompt_seconds, model=model, tokens=generated_tokens)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware timing every request until its response is complete,
+    so streamed answers are measured to their last token, and logging its
+    trace as one JSON line. Paths in skip_paths (the metrics scrape) are
+    not traced.
+    """
+
+    def __init__(self, app, skip_paths: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        trace, token = start_trace(f'{scope["method"]} {scope["path"]}')
+        status = 500
+
+        async def traced_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            _current_trace.reset(token)
+            # The route template keeps ids out of the path label
+            path = getattr(scope.get("route"), "path", None) or scope["path"]
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - trace.start, method=scope["method"], path=path, status=status
+            )
+            log_trace(trace, status=status)
@@ -0,0 +1,59 @@
+import os
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+DEFAULT_OLLAMA_PORT = 11434
+
+
+def parse_ollama_host(host: str) -> str:
+    """
+    Base URL for an OLLAMA_HOST value, read the way the ollama client reads
+    it: a bare host or address gets http and port 11434, an explicit scheme
+    gets that scheme's default port, e.g. "0.0.0.0" is http://0.0.0.0:11434.
+    """
+    scheme, _, rest = (host or "").partition("://")
+    port = {"http": 80, "https": 443}.get(scheme) if rest else DEFAULT_OLLAMA_PORT
+    if not rest:
+        scheme, rest = "http", host or ""
+    split = urlsplit(f"{scheme}://{rest}")
+    hostname = split.hostname or "127.0.0.1"
+    if ":" in hostname:
+        # urlsplit drops the brackets around an IPv6 address
+        hostname = f"[{hostname}]"
+    path = split.path.strip("/")
+    return f"{scheme}://{hostname}:{split.port or port}" + (f"/{path}" if path else "")
+
+
+# Where Ollama listens; OLLAMA_HOST is the variable the ollama client library reads too
+OLLAMA_BASE_URL = parse_ollama_host(os.environ.get("OLLAMA_HOST", ""))
+
+# Keep models resident between turns so Ollama can reuse the prompt cache
+# instead of reloading the model and re-evaluating the whole prompt
+DEFAULT_MODEL_OPTIONS = {
+    "keep_alive": "30m",
+    "num_ctx": None
+}
+
+
+def get_model_options(config: Dict[str, Any], model: str) -> Dict[str, Any]:
+    """keep_alive/num_ctx for model, with per-model overrides from config["model_options"]"""
+    options = {**DEFAULT_MODEL_OPTIONS, **config.get("model_options", {}).get(model, {})}
+    return {key: value for key, value in options.items() if value is not None}
+
+
+async def warm_up_model(model: str, options: Dict[str, Any], base_url: str = OLLAMA_BASE_URL) -> Dict[str, Any]:
+    """Load model into memory with the same options chat requests use, so the first turn doesn't pay for it"""
+    import ollama
+    client = ollama.AsyncClient(host=base_url)
+    request_options = {"num_ctx": options["num_ctx"]} if "num_ctx" in options else None
+    # An empty prompt only loads the model
+    response = await client.generate(
+        model=model,
+        prompt="",
+        keep_alive=options.get("keep_alive"),
+        options=request_options
+    )
+    return {
+        "model": model,
+        "load_duration": (response.load_duration or 0) / 1e9,
+    }
@@ -0,0 +1,239 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Set, Tuple
+
+from utils.metrics import record_llm_call, record_span, span
+from utils.model_options import OLLAMA_BASE_URL, warm_up_model
+from utils.scheduler import get_scheduler
+
+DEFAULT_MODEL_POOL_CONFIG = {
+    # Requests a model serves at once; the rest wait in that model's queue
+    "model_max_concurrency": 2,
+    # Per-model overrides of model_max_concurrency, e.g. {"llama3:70b": 1}
+    "model_concurrency": {},
+    "model_queue_timeout_seconds": 120,
+    # How long the list of models Ollama has loaded is trusted
+    "model_resident_ttl_seconds": 5
+}
+
+
+class ModelBusyError(Exception):
+    """A request waited longer than the queue timeout for a model slot"""
+
+    def __init__(self, model: str, waited: float):
+        super().__init__(f"Model {model} is busy, waited {waited:.1f}s for a slot")
+        self.model = model
+        self.waited = waited
+
+
+class ModelSlots:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.served = 0
+        self.rejected = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "served": self.served,
+            "rejected": self.rejected,
+            "avg_queue_seconds": self.queue_seconds / self.served if self.served else 0.0,
+            "max_queue_seconds": self.max_queue_seconds,
+        }
+
+
+class ModelPool:
+    """
+    Chat clients shared by every subsystem, one per model and option set,
+    so requests can pick their model without touching anyone else's. Each
+    model has its own concurrency limit and a FIFO queue in front of it.
+    A model Ollama doesn't have loaded is loaded by one request at a time,
+    so concurrent first requests don't trigger competing loads.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_BASE_URL):
+        self.base_url = base_url
+        self.max_concurrency = 2
+        self.concurrency: Dict[str, int] = {}
+        self.queue_timeout = 120.0
+        self.resident_ttl = 5.0
+        self.loads = 0
+        self._clients: Dict[Tuple[str, Tuple], Any] = {}
+        self._slots: Dict[str, ModelSlots] = {}
+        self._resident: Set[str] = set()
+        self._resident_checked = 0.0
+        self._load_lock: Optional[asyncio.Lock] = None
+        self.scheduler = None
+        self._callbacks = None
+        self._lock = threading.Lock()
+
+    def llm(self, model: str, options: Dict[str, Any]):
+        # Imported here so the API layer can catch ModelBusyError without loading langchain
+        from langchain_ollama import ChatOllama
+        key = (model, tuple(sorted(options.items())))
+        with self._lock:
+            if key not in self._clients:
+                if self._callbacks is None:
+                    self._callbacks = [llm_metrics_handler()]
+                self._clients[key] = ChatOllama(
+                    model=model, base_url=self.base_url, callbacks=self._callbacks, **options
+                )
+            return self._clients[key]
+
+    def limit(self, model: str) -> int:
+        return max(1, self.concurrency.get(model, self.max_concurrency))
+
+    def _model_slots(self, model: str) -> ModelSlots:
+        slots = self._slots.get(model)
+        limit = self.limit(model)
+        # A changed limit takes effect once the model is idle
+        if slots is None or (slots.limit != limit and not slots.active and not slots.waiting):
+            slots = self._slots[model] = ModelSlots(limit)
+        return slots
+
+    async def resident(self) -> Set[str]:
+        """Models Ollama has loaded, refreshed at most every resident_ttl seconds"""
+        if time.monotonic() - self._resident_checked > self.resident_ttl:
+            try:
+                import ollama
+                response = await ollama.AsyncClient(host=self.base_url).ps()
+                self._resident = {model.model for model in response.models}
+            except Exception as e:
+                print(f"Error listing loaded models: {str(e)}")
+            self._resident_checked = time.monotonic()
+        return self._resident
+
+    async def ensure_loaded(self, model: str, options: Dict[str, Any]) -> None:
+        if model in await self.resident():
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            # Another request may have loaded it while this one waited
+            if model in self._resident:
+                return
+            with span("model_load", model=model):
+                await warm_up_model(model, options, self.base_url)
+            self._resident.add(model)
+            self.loads += 1
+
+    @asynccontextmanager
+    async def slot(self, model: str, options: Dict[str, Any] = None):
+        """Hold one of model's slots and a scheduler slot, waiting up to queue_timeout for the former"""
+        if self.scheduler is None:
+            async with self._slot(model):
+                await self._load(model, options)
+                yield
+        else:
+            # An overloaded lane still rejects at once, but the lane slot is
+            # only taken once the model is free, so a call queued for a busy
+            # model doesn't keep calls to other models out of the lane
+            self.scheduler.admit()
+            async with self._slot(model):
+                async with self.scheduler.slot():
+                    await self._load(model, options)
+                    yield
+
+    async def _load(self, model: str, options: Dict[str, Any] = None) -> None:
+        if options is not None:
+            await self.ensure_loaded(model, options)
+
+    @asynccontextmanager
+    async def _slot(self, model: str):
+        slots = self._model_slots(model)
+        start = time.perf_counter()
+        slots.waiting += 1
+        try:
+            await asyncio.wait_for(slots.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            slots.rejected += 1
+            raise ModelBusyError(model, time.perf_counter() - start)
+        finally:
+            slots.waiting -= 1
+        waited = time.perf_counter() - start
+        record_span("model_queue", waited, start, model=model)
+        slots.served += 1
+        slots.queue_seconds += waited
+        slots.max_queue_seconds = max(slots.max_queue_seconds, waited)
+        slots.active += 1
+        try:
+            yield
+        finally:
+            slots.active -= 1
+            slots.semaphore.release()
+
+    async def ainvoke(self, model: str, options: Dict[str, Any], chain, inputs: Dict[str, Any]):
+        async with self.slot(model, options):
+            with span("llm", model=model):
+                return await chain.ainvoke(inputs)
+
+    async def astream(self, model: str, options: Dict[str, Any], chain, inputs: Dict[str, Any]):
+        async with self.slot(model, options):
+            with span("llm", model=model):
+                async for chunk in chain.astream(inputs):
+                    yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "models": {model: slots.stats() for model, slots in self._slots.items()},
+            "resident": sorted(self._resident),
+            "loads": self.loads,
+            "clients": len(self._clients),
+        }
+
+
+def llm_metrics_handler():
+    """Callback recording the token counts and timings Ollama returns with each generation"""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class LLMMetricsHandler(BaseCallbackHandler):
+        # Run in the caller's task so spans land in the request's trace
+        run_inline = True
+
+        def __init__(self):
+            # Start of each call in flight, so its spans are placed where it ran
+            self.starts: Dict[Any, float] = {}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+            self.starts[run_id] = time.perf_counter()
+
+        def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+            start = self.starts.pop(run_id, None)
+            for generations in response.generations:
+                for generation in generations:
+                    info = generation.generation_info or {}
+                    record_llm_call(info.get("model", ""), info, start)
+
+        def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+            self.starts.pop(run_id, None)
+
+    return LLMMetricsHandler()
+
+
+_pool: Optional[ModelPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_model_pool(config: Dict[str, Any] = None) -> ModelPool:
+    """Return the process-wide pool, updated with the settings in config if given"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ModelPool()
+            config = {**DEFAULT_MODEL_POOL_CONFIG, **(config or {})}
+        if config is not None:
+            _pool.max_concurrency = config["model_max_concurrency"]
+            _pool.concurrency = config["model_concurrency"]
+            _pool.queue_timeout = config["model_queue_timeout_seconds"]
+            _pool.resident_ttl = config["model_resident_ttl_seconds"]
+            _pool.scheduler = get_scheduler(config)
+        return _pool
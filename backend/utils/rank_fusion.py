@@ -0,0 +1,39 @@
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """
+    Merge ranked id lists by summing 1 / (k + rank) over the lists each id
+    appears in. Only ranks matter, so BM25 and vector scores don't need to
+    be on the same scale.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def maximal_marginal_relevance(query_vector, doc_vectors, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """
+    Positions of k documents picked greedily for relevance to the query
+    minus similarity to the documents already picked, so near-duplicate
+    chunks don't fill the context.
+    """
+    if not len(doc_vectors) or k <= 0:
+        return []
+    docs = np.asarray(doc_vectors, dtype="float32")
+    docs = docs / np.maximum(np.linalg.norm(docs, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype="float32")
+    query = query / max(np.linalg.norm(query), 1e-12)
+
+    relevance = docs @ query
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(docs)):
+        redundancy = (docs @ docs[selected].T).max(axis=1)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
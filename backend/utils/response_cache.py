@@ -0,0 +1,213 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_RESPONSE_CACHE_CONFIG = {
+    "response_cache_enabled": True,
+    "response_cache_max_entries": 1000,
+    "response_cache_ttl_seconds": 3600,
+    # Cosine similarity a new question's embedding needs to reuse an answer
+    # given for the same context; 0 disables the semantic tier
+    "response_cache_semantic_threshold": 0.95
+}
+
+
+def normalize_query(query: str) -> str:
+    # Case, spacing and trailing punctuation don't change the question
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?!. ")
+
+
+def fingerprint(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CachedResponse:
+    def __init__(self, mode: str, group: str, text: str, vector: Optional[np.ndarray]):
+        self.mode = mode
+        self.group = group
+        self.text = text
+        self.vector = vector
+        self.created = time.time()
+
+
+class ResponseCache:
+    """
+    In-memory LRU of generated answers. The exact tier is keyed by
+    (mode, model, normalized query, context fingerprint). Entries with the
+    same mode, model and context form a group, and the semantic tier
+    answers a question from its group when the query embeddings are close
+    enough. Entries expire after ttl_seconds.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600, semantic_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self.enabled = True
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._groups: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _group(mode: str, model: str, context_fingerprint: str) -> str:
+        return fingerprint(mode, model, context_fingerprint)
+
+    @staticmethod
+    def _normalize_vector(vector) -> Optional[np.ndarray]:
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        keys = self._groups.get(entry.group)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._groups[entry.group]
+
+    def _expired(self, entry: CachedResponse, now: float) -> bool:
+        return now - entry.created > self.ttl_seconds
+
+    def lookup(self, mode: str, model: str, query: str, context_fingerprint: str = "",
+               vector: Optional[List[float]] = None) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Return (cached answer or None, cache metadata for the response)"""
+        if not self.enabled:
+            return None, {"hit": False}
+        group = self._group(mode, model, context_fingerprint)
+        key = fingerprint(group, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.text, {"hit": True, "tier": "exact", "age": now - entry.created}
+
+            query_vector = self._normalize_vector(vector)
+            if query_vector is not None and self.semantic_threshold > 0:
+                best_key, best_similarity = None, self.semantic_threshold
+                for candidate in list(self._groups.get(group, ())):
+                    entry = self._entries[candidate]
+                    if self._expired(entry, now):
+                        self._remove(candidate)
+                        continue
+                    if entry.vector is None or entry.vector.shape != query_vector.shape:
+                        continue
+                    similarity = float(entry.vector @ query_vector)
+                    if similarity >= best_similarity:
+                        best_key, best_similarity = candidate, similarity
+                if best_key is not None:
+                    entry = self._entries[best_key]
+                    self._entries.move_to_end(best_key)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return entry.text, {
+                        "hit": True,
+                        "tier": "semantic",
+                        "similarity": best_similarity,
+                        "age": now - entry.created,
+                    }
+
+            self.misses += 1
+            return None, {"hit": False}
+
+    def put(self, mode: str, model: str, query: str, text: str, context_fingerprint: str = "",
+            vector: Optional[List[float]] = None) -> None:
+        if not self.enabled or not text:
+            return
+        group = self._group(mode, model, context_fingerprint)
+        key = fingerprint(group, normalize_query(query))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CachedResponse(mode, group, text, self._normalize_vector(vector))
+            self._groups.setdefault(group, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    async def aanswer(self, mode: str, model: str, query: str, generate, context_fingerprint: str = "",
+                      vector: Optional[List[float]] = None, metadata: Optional[dict] = None) -> str:
+        """Return the cached answer, or await generate() and cache what it returns"""
+        text, info = self.lookup(mode, model, query, context_fingerprint, vector)
+        if metadata is not None:
+            metadata["cache"] = info
+        if text is None:
+            text = await generate()
+            self.put(mode, model, query, text, context_fingerprint, vector)
+        return text
+
+    async def astream(self, mode: str, model: str, query: str, generate, context_fingerprint: str = "",
+                      vector: Optional[List[float]] = None, metadata: Optional[dict] = None):
+        """Yield the cached answer as one chunk, or stream generate() and cache the whole answer"""
+        text, info = self.lookup(mode, model, query, context_fingerprint, vector)
+        if metadata is not None:
+            metadata["cache"] = info
+        if text is not None:
+            yield text
+            return
+        chunks = []
+        async for chunk in generate():
+            chunks.append(chunk)
+            yield chunk
+        # Only answers streamed to the end are cached
+        self.put(mode, model, query, "".join(chunks), context_fingerprint, vector)
+
+    def invalidate(self, *modes: str) -> None:
+        """Drop the cached answers of the given modes, or all of them"""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if not modes or entry.mode in modes:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache(config: Dict[str, Any]) -> ResponseCache:
+    """Return the process-wide cache, updated with the settings in config"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        _cache.enabled = config["response_cache_enabled"]
+        _cache.max_entries = config["response_cache_max_entries"]
+        _cache.ttl_seconds = config["response_cache_ttl_seconds"]
+        _cache.semantic_threshold = config["response_cache_semantic_threshold"]
+        return _cache
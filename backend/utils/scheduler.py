@@ -0,0 +1,201 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+
+from utils.metrics import record_span
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+DEFAULT_SCHEDULER_CONFIG = {
+    # Ollama calls (generations and embeddings) running at once per lane
+    "scheduler_interactive_concurrency": 4,
+    "scheduler_bulk_concurrency": 2,
+    # Calls allowed to wait per lane; beyond that they are rejected with 429
+    "scheduler_interactive_queue": 32,
+    "scheduler_bulk_queue": 256,
+    # Lower bound of the Retry-After sent with a rejection
+    "scheduler_retry_after_seconds": 1
+}
+
+# Calls made while handling a request are interactive; background work
+# (ingest jobs, history summaries) switches its task to the bulk lane
+_current_lane = contextvars.ContextVar("scheduler_lane", default=INTERACTIVE)
+
+
+@contextmanager
+def scheduler_lane(name: str):
+    """Route the Ollama calls made inside the block, and the tasks it starts, through lane name"""
+    token = _current_lane.set(name)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+class SchedulerBusyError(Exception):
+    """A lane's queue was full, the caller should retry after retry_after seconds"""
+
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"The {lane} queue is full, retry in {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Lane:
+    def __init__(self, name: str, concurrency: int, max_queue: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue: deque = deque()
+        self.active = 0
+        self.served = 0
+        self.rejected = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        # Recent waits for percentiles, and a moving average of how long a call holds its slot
+        self.recent_waits: deque = deque(maxlen=1000)
+        self.service_seconds = 0.0
+
+    def record_wait(self, waited: float) -> None:
+        self.served += 1
+        self.queue_seconds += waited
+        self.max_queue_seconds = max(self.max_queue_seconds, waited)
+        self.recent_waits.append(waited)
+
+    def record_service(self, seconds: float) -> None:
+        self.service_seconds = seconds if not self.service_seconds else 0.9 * self.service_seconds + 0.1 * seconds
+
+    def percentile(self, fraction: float) -> float:
+        if not self.recent_waits:
+            return 0.0
+        waits = sorted(self.recent_waits)
+        return waits[min(len(waits) - 1, int(fraction * len(waits)))]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": len(self.queue),
+            "served": self.served,
+            "rejected": self.rejected,
+            "avg_queue_seconds": self.queue_seconds / self.served if self.served else 0.0,
+            "p50_queue_seconds": self.percentile(0.5),
+            "p95_queue_seconds": self.percentile(0.95),
+            "max_queue_seconds": self.max_queue_seconds,
+        }
+
+
+class Scheduler:
+    """
+    Admission control in front of every call to Ollama. Interactive calls
+    and bulk calls have their own concurrency and their own bounded FIFO
+    queue, so an ingest burst can't take the slots chat requests need, and
+    a bulk call doesn't start while interactive calls are waiting. A call
+    arriving at a full queue is rejected at once instead of timing out.
+    """
+
+    def __init__(self):
+        self.lanes = {
+            INTERACTIVE: Lane(INTERACTIVE, 4, 32),
+            BULK: Lane(BULK, 2, 256),
+        }
+        self.min_retry_after = 1
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        for name, lane in self.lanes.items():
+            lane.concurrency = max(1, config[f"scheduler_{name}_concurrency"])
+            lane.max_queue = max(0, config[f"scheduler_{name}_queue"])
+        self.min_retry_after = config["scheduler_retry_after_seconds"]
+        # A raised limit lets waiting calls start now
+        self._wake()
+
+    def _can_start(self, lane: Lane) -> bool:
+        if lane.active >= lane.concurrency:
+            return False
+        # Interactive calls go first
+        return lane.name == INTERACTIVE or not self.lanes[INTERACTIVE].queue
+
+    def _wake(self) -> None:
+        for lane in self.lanes.values():
+            while lane.queue and self._can_start(lane):
+                waiter = lane.queue.popleft()
+                if waiter.done():
+                    continue
+                lane.active += 1
+                waiter.set_result(None)
+
+    def retry_after(self, lane: Lane) -> int:
+        # Time for the calls ahead to drain, assuming they take as long as recent ones
+        estimate = (len(lane.queue) + 1) * lane.service_seconds / lane.concurrency
+        return max(self.min_retry_after, math.ceil(estimate))
+
+    def admit(self, lane_name: str = None) -> None:
+        """Reject up front when lane_name's queue is full, before any work is done for the request"""
+        lane = self.lanes[lane_name or _current_lane.get()]
+        if len(lane.queue) >= lane.max_queue and not self._can_start(lane):
+            lane.rejected += 1
+            raise SchedulerBusyError(lane.name, self.retry_after(lane))
+
+    async def acquire(self, lane_name: str = None) -> Lane:
+        lane = self.lanes[lane_name or _current_lane.get()]
+        start = time.perf_counter()
+        if not lane.queue and self._can_start(lane):
+            lane.active += 1
+        else:
+            self.admit(lane.name)
+            waiter = asyncio.get_running_loop().create_future()
+            lane.queue.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted a slot just as the caller was cancelled
+                    self.release(lane)
+                elif waiter in lane.queue:
+                    lane.queue.remove(waiter)
+                    self._wake()
+                raise
+        waited = time.perf_counter() - start
+        lane.record_wait(waited)
+        record_span("scheduler_queue", waited, start, lane=lane.name)
+        return lane
+
+    def release(self, lane: Lane) -> None:
+        lane.active -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, lane_name: str = None):
+        lane = await self.acquire(lane_name)
+        start = time.perf_counter()
+        try:
+            yield lane
+        finally:
+            lane.record_service(time.perf_counter() - start)
+            self.release(lane)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(config: Dict[str, Any] = None) -> Scheduler:
+    """Return the process-wide scheduler, updated with the settings in config if given"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+            _scheduler.configure({**DEFAULT_SCHEDULER_CONFIG, **(config or {})})
+        elif config is not None:
+            _scheduler.configure(config)
+        return _scheduler
@@ -0,0 +1,167 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+DEFAULT_SESSION_DB_PATH = "../temp/sessions.sqlite"
+DEFAULT_SESSION_ID = "default"
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text on llama-style tokenizers
+    return max(1, len(text) // 4)
+
+
+class Message:
+    def __init__(self, seq: int, role: str, content: str):
+        self.seq = seq
+        self.role = role
+        self.content = content
+        self.tokens = estimate_tokens(content)
+
+
+class Session:
+    """A conversation: a rolling summary plus the turns not yet folded into it"""
+
+    def __init__(self, session_id: str, summary: str, messages: List[Message]):
+        self.id = session_id
+        self.summary = summary
+        self.messages = messages
+        self.last_active = time.time()
+        self.summarizing = False
+
+    @property
+    def tokens(self) -> int:
+        return sum(message.tokens for message in self.messages)
+
+
+class SessionStore:
+    """
+    Per-session conversations in SQLite. Only the summary and the
+    unsummarized turns are stored; turns are deleted once folded into the
+    summary. Active sessions are cached in memory and dropped from the
+    cache after idle_seconds without activity.
+    """
+
+    def __init__(self, path: str = DEFAULT_SESSION_DB_PATH, idle_seconds: float = 1800):
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL DEFAULT '',
+                last_active REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, session_id: str) -> Session:
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._load(session_id)
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            session.last_active = time.time()
+            return session
+
+    def _load(self, session_id: str) -> Session:
+        row = self._conn.execute(
+            "SELECT summary FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        rows = self._conn.execute(
+            "SELECT seq, role, content FROM messages WHERE session_id = ? ORDER BY seq",
+            (session_id,)
+        ).fetchall()
+        return Session(session_id, row[0] if row else "", [Message(*r) for r in rows])
+
+    def _evict_idle(self) -> None:
+        cutoff = time.time() - self.idle_seconds
+        # Sessions are kept in least-recently-active order
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_active >= cutoff or session.summarizing:
+                break
+            del self._sessions[session_id]
+
+    def append(self, session: Session, role: str, content: str) -> None:
+        with self._lock:
+            seq = session.messages[-1].seq + 1 if session.messages else self._next_seq(session.id)
+            session.messages.append(Message(seq, role, content))
+            self._conn.execute(
+                "INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                (session.id, seq, role, content)
+            )
+            self._touch(session)
+            self._conn.commit()
+
+    def _next_seq(self, session_id: str) -> int:
+        row = self._conn.execute(
+            "SELECT MAX(seq) FROM messages WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return (row[0] or 0) + 1
+
+    def _touch(self, session: Session) -> None:
+        self._conn.execute(
+            "INSERT INTO sessions (session_id, summary, last_active) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, last_active = excluded.last_active",
+            (session.id, session.summary, time.time())
+        )
+
+    def set_summary(self, session: Session, summary: str, upto_seq: int) -> None:
+        """Replace the summary and drop the turns it now covers"""
+        with self._lock:
+            session.summary = summary
+            session.messages = [message for message in session.messages if message.seq > upto_seq]
+            self._conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND seq <= ?", (session.id, upto_seq)
+            )
+            self._touch(session)
+            self._conn.commit()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "active_sessions": len(self._sessions),
+                "stored_sessions": self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+            }
+
+
+_stores: Dict[str, SessionStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_session_store(path: str = DEFAULT_SESSION_DB_PATH, idle_seconds: float = 1800) -> SessionStore:
+    """Return the process-wide store for path, kept across model switches"""
+    key = os.path.abspath(path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SessionStore(path, idle_seconds)
+        store = _stores[key]
+        store.idle_seconds = idle_seconds
+        return store
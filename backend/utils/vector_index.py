@@ -0,0 +1,169 @@
+import math
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+DEFAULT_INDEX_CONFIG = {
+    "index_type": "flat",
+    "ann_promotion_threshold": 100000,
+    "ivf_nlist": 0,
+    "ivf_nprobe": 16,
+    "pq_m": 16,
+    "pq_nbits": 8,
+    "hnsw_m": 32,
+    "hnsw_ef_construction": 200,
+    "hnsw_ef_search": 64
+}
+
+# Below this a flat scan is as fast as any ANN index, and PQ cannot train its codebooks
+MIN_ANN_VECTORS = 1024
+# Enough training points per centroid to keep k-means from warning
+TRAINING_POINTS_PER_CENTROID = 39
+MAX_TRAINING_POINTS = 100000
+
+
+def index_kind(index: faiss.Index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def target_kind(index: faiss.Index, config: Dict) -> str:
+    """Index type the store should use: the configured ANN type once the promotion threshold is crossed"""
+    configured = config["index_type"]
+    if configured == "flat" or index.ntotal >= max(config["ann_promotion_threshold"], MIN_ANN_VECTORS):
+        return configured
+    return index_kind(index)
+
+
+def needs_rebuild(index: faiss.Index, config: Dict) -> bool:
+    return target_kind(index, config) != index_kind(index)
+
+
+def _nlist(num_vectors: int, config: Dict) -> int:
+    nlist = config["ivf_nlist"] or int(4 * math.sqrt(num_vectors))
+    return max(1, min(nlist, num_vectors // TRAINING_POINTS_PER_CENTROID or 1))
+
+
+def _pq_m(dim: int, m: int) -> int:
+    # PQ needs the number of sub-quantizers to divide the dimension
+    while dim % m:
+        m -= 1
+    return m
+
+
+def build_index(vectors: np.ndarray, kind: str, config: Dict) -> faiss.Index:
+    """Build (and train, for IVF types) an index of the given kind holding vectors in order"""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    num_vectors, dim = vectors.shape
+
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config["hnsw_m"])
+        index.hnsw.efConstruction = config["hnsw_ef_construction"]
+    elif kind in ("ivf_flat", "ivf_pq"):
+        nlist = _nlist(num_vectors, config)
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(dim, config["pq_m"]), config["pq_nbits"])
+        training = vectors
+        if num_vectors > MAX_TRAINING_POINTS:
+            rng = np.random.default_rng(0)
+            training = vectors[rng.choice(num_vectors, MAX_TRAINING_POINTS, replace=False)]
+        index.train(training)
+        # Needed for reconstruct(), which rebuilds and demotions rely on
+        index.make_direct_map()
+    else:
+        raise ValueError(f"Unknown index type: {kind}")
+
+    if num_vectors:
+        index.add(vectors)
+    apply_search_params(index, config)
+    return index
+
+
+def apply_search_params(index: faiss.Index, config: Dict) -> None:
+    kind = index_kind(index)
+    if kind in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = config["ivf_nprobe"]
+    elif kind == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = config["hnsw_ef_search"]
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """Stored vectors in insertion order (approximate for IVF-PQ, exact otherwise)"""
+    if index.ntotal == 0:
+        return np.empty((0, index.d), dtype="float32")
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def rebuild_index(index: faiss.Index, config: Dict) -> faiss.Index:
+    return build_index(reconstruct_all(index), target_kind(index, config), config)
+
+
+def copy_search_params(source: faiss.Index, target: faiss.Index) -> None:
+    kind = index_kind(source)
+    if kind != index_kind(target):
+        return
+    if kind in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(target).nprobe = faiss.extract_index_ivf(source).nprobe
+    elif kind == "hnsw":
+        faiss.downcast_index(target).hnsw.efSearch = faiss.downcast_index(source).hnsw.efSearch
+
+
+def nearest(vectors, query_vector, k: int) -> List[int]:
+    """Positions of the k vectors closest to query_vector, using a throwaway flat index"""
+    vectors = np.asarray(vectors, dtype="float32")
+    if not len(vectors) or k <= 0:
+        return []
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    _, positions = index.search(np.asarray([query_vector], dtype="float32"), min(k, len(vectors)))
+    return [int(position) for position in positions[0] if position != -1]
+
+
+def remove_positions(index: faiss.Index, positions: List[int]) -> faiss.Index:
+    """
+    Remove vectors by position, shifting later positions down like a flat
+    index does. IVF labels don't shift on removal and HNSW can't remove at
+    all, so for ANN indexes the kept vectors are re-added to an emptied
+    clone that keeps the trained quantizer and graph parameters.
+    """
+    if not positions:
+        return index
+    if index_kind(index) == "flat":
+        index.remove_ids(np.array(positions, dtype="int64"))
+        return index
+
+    keep = np.setdiff1d(np.arange(index.ntotal), np.array(positions, dtype="int64"))
+    vectors = reconstruct_all(index)[keep]
+    rebuilt = faiss.clone_index(index)
+    rebuilt.reset()
+    if len(vectors):
+        rebuilt.add(vectors)
+    copy_search_params(index, rebuilt)
+    return rebuilt
+
+
+def delete_from_store(store, ids: List[str]) -> None:
+    """FAISS.delete that also works for ANN indexes, ignoring ids that aren't stored"""
+    to_delete = set(ids)
+    ordered = [doc_id for _, doc_id in sorted(store.index_to_docstore_id.items())]
+    positions = [position for position, doc_id in enumerate(ordered) if doc_id in to_delete]
+    if not positions:
+        return
+
+    store.index = remove_positions(store.index, positions)
+    store.index_to_docstore_id = dict(enumerate(doc_id for doc_id in ordered if doc_id not in to_delete))
+    store.docstore.delete([ordered[position] for position in positions])
@@ -0,0 +1,397 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from utils.vector_index import copy_search_params, delete_from_store, remove_positions
+
+MANIFEST = "manifest.json"
+
+# Zero-copy mapping of the index file where faiss supports it
+MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def atomic_write(path: str, write) -> None:
+    """Write through a temp file and rename it into place so readers never see a partial file"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def encode_record(record: Dict) -> bytes:
+    return (json.dumps(record, default=str) + "\n").encode("utf-8")
+
+
+class LogDocstore(Docstore, AddableMixin):
+    """
+    Docstore backed by the append-only docstore log. Only the byte range of
+    each document is kept in memory; documents are read from disk when a
+    search returns them. Adds and deletes are appended to the log.
+    """
+
+    def __init__(self, path: str, offsets: Dict[str, Tuple[int, int]]):
+        self.path = path
+        self._offsets = offsets
+        self._lock = threading.Lock()
+        self._reader = None
+        self._writer = None
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def search(self, search: str) -> Union[str, Document]:
+        location = self._offsets.get(search)
+        if location is None:
+            return f"ID {search} not found."
+        offset, length = location
+        with self._lock:
+            if self._reader is None:
+                self._reader = open(self.path, "rb")
+            self._reader.seek(offset)
+            record = json.loads(self._reader.read(length))
+        return Document(id=search, page_content=record["page_content"], metadata=record["metadata"])
+
+    def _append(self, records: List[Dict]) -> List[Tuple[int, int]]:
+        if self._writer is None:
+            self._writer = open(self.path, "ab")
+        offset = self._writer.seek(0, os.SEEK_END)
+        locations = []
+        for record in records:
+            data = encode_record(record)
+            self._writer.write(data)
+            locations.append((offset, len(data)))
+            offset += len(data)
+        # Flushed so that searches can read the new documents straight away
+        self._writer.flush()
+        return locations
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = set(texts).intersection(self._offsets)
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        with self._lock:
+            locations = self._append([
+                {"op": "add", "id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata}
+                for doc_id, doc in texts.items()
+            ])
+            self._offsets.update(zip(texts, locations))
+
+    def delete(self, ids: List) -> None:
+        ids = [doc_id for doc_id in ids if doc_id in self._offsets]
+        if not ids:
+            return
+        with self._lock:
+            self._append([{"op": "delete", "ids": ids}])
+            for doc_id in ids:
+                del self._offsets[doc_id]
+
+    def sync(self) -> None:
+        with self._lock:
+            if self._writer is not None:
+                os.fsync(self._writer.fileno())
+
+    def switch(self, path: str, offsets: Dict[str, Tuple[int, int]]) -> None:
+        """Point the docstore at a freshly compacted log"""
+        with self._lock:
+            self._close_handles()
+            self.path = path
+            self._offsets = offsets
+
+    def _close_handles(self) -> None:
+        for handle in (self._reader, self._writer):
+            if handle is not None:
+                handle.close()
+        self._reader = None
+        self._writer = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_handles()
+
+
+class IncrementalPersistence:
+    """
+    Append-only on-disk layout for a LangChain FAISS store.
+
+    Each generation has a compacted snapshot (index.<gen>.faiss, the
+    matching documents at the head of docstore.<gen>.log and their ids and
+    byte ranges in docstore.<gen>.idx) followed by appended vectors in
+    segment.<gen>.f32 and add/delete records in the docstore log. Ingest
+    I/O is proportional to the new vectors only; the snapshot is rewritten
+    by compaction once the appended tail grows past a fraction of it.
+    manifest.json is replaced atomically and is the commit point of a
+    compaction.
+
+    Loading reads only the manifest, the id file and the appended tail.
+    When there is no tail the index is memory-mapped, so cold start and
+    resident memory don't grow with the corpus; it is read into memory on
+    the first write.
+    """
+
+    def __init__(self, directory: str, compact_ratio: float = 0.5, compact_min_rows: int = 5000):
+        self.directory = directory
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        self.generation = 0
+        self.dim: Optional[int] = None
+        self.snapshot_rows = 0
+        self.snapshot_log_bytes = 0
+        self.segment_rows = 0
+        self.deleted_rows = 0
+        self.docstore: Optional[LogDocstore] = None
+        self._mapped_index = None
+        self._lock = threading.Lock()
+
+    def _path(self, kind: str, generation: int = None) -> str:
+        generation = self.generation if generation is None else generation
+        names = {
+            "index": f"index.{generation}.faiss",
+            "segment": f"segment.{generation}.f32",
+            "log": f"docstore.{generation}.log",
+            "ids": f"docstore.{generation}.idx",
+        }
+        return os.path.join(self.directory, names[kind])
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.directory, MANIFEST))
+
+    def create(self, embeddings, dim: int) -> FAISS:
+        """Start an empty store and commit it as generation 0"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.generation = 0
+        self.dim = dim
+        self.snapshot_rows = 0
+        self.snapshot_log_bytes = 0
+        self.segment_rows = 0
+        self.deleted_rows = 0
+        faiss.write_index(faiss.IndexFlatL2(dim), self._path("index"))
+        for kind in ("segment", "log"):
+            atomic_write(self._path(kind), lambda f: None)
+        atomic_write(self._path("ids"), lambda f: f.write(b"[]"))
+        self._write_manifest()
+
+        self.docstore = LogDocstore(self._path("log"), {})
+        return FAISS(
+            embedding_function=embeddings,
+            index=faiss.IndexFlatL2(dim),
+            docstore=self.docstore,
+            index_to_docstore_id={}
+        )
+
+    def load(self, embeddings) -> Optional[FAISS]:
+        """Open the latest snapshot and replay the appended tail"""
+        if not self.exists():
+            return None
+
+        with open(os.path.join(self.directory, MANIFEST), "r") as f:
+            manifest = json.load(f)
+        self.generation = manifest["generation"]
+        self.dim = manifest["dim"]
+        self.snapshot_rows = manifest["snapshot_rows"]
+        self.snapshot_log_bytes = manifest["snapshot_log_bytes"]
+
+        with open(self._path("ids"), "r") as f:
+            snapshot = json.load(f)
+        ids = [doc_id for doc_id, _, _ in snapshot]
+        offsets = {doc_id: (offset, length) for doc_id, offset, length in snapshot}
+
+        segment_path = self._path("segment")
+        segment = np.fromfile(segment_path, dtype="float32") \
+            if os.path.exists(segment_path) else np.empty(0, dtype="float32")
+        # Drop a torn trailing row from an interrupted append
+        segment = segment[:len(segment) - len(segment) % self.dim].reshape(-1, self.dim)
+
+        log_size = os.path.getsize(self._path("log")) if os.path.exists(self._path("log")) else 0
+        has_tail = len(segment) > 0 or log_size > self.snapshot_log_bytes
+        if has_tail:
+            index = faiss.read_index(self._path("index"))
+            self._mapped_index = None
+        else:
+            index = faiss.read_index(self._path("index"), MMAP_FLAG)
+            self._mapped_index = index
+
+        cursor = 0
+        added = 0
+        self.deleted_rows = 0
+        good_offset = self.snapshot_log_bytes
+        if has_tail:
+            with open(self._path("log"), "rb") as f:
+                f.seek(self.snapshot_log_bytes)
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("partial record")
+                        record = json.loads(line)
+                    except ValueError:
+                        # Partial record from an interrupted append
+                        break
+                    if record["op"] == "add":
+                        if cursor >= len(segment):
+                            # Record written without its vector, stop here
+                            break
+                        ids.append(record["id"])
+                        offsets[record["id"]] = (good_offset, len(line))
+                        cursor += 1
+                    elif record["op"] == "delete":
+                        if cursor > added:
+                            index.add(segment[added:cursor])
+                            added = cursor
+                        to_delete = set(record["ids"])
+                        positions = [position for position, doc_id in enumerate(ids) if doc_id in to_delete]
+                        index = remove_positions(index, positions)
+                        ids = [doc_id for doc_id in ids if doc_id not in to_delete]
+                        for doc_id in to_delete:
+                            offsets.pop(doc_id, None)
+                        self.deleted_rows += len(positions)
+                    good_offset += len(line)
+            if cursor > added:
+                index.add(segment[added:cursor])
+
+        # Trim anything past the last consistent record so later appends stay aligned
+        self.segment_rows = cursor
+        self._truncate(segment_path, cursor * self.dim * 4)
+        self._truncate(self._path("log"), good_offset)
+
+        self.docstore = LogDocstore(self._path("log"), offsets)
+        return FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=self.docstore,
+            index_to_docstore_id=dict(enumerate(ids))
+        )
+
+    @staticmethod
+    def _truncate(path: str, size: int) -> None:
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    def ensure_writable(self, store: FAISS) -> None:
+        """Swap a memory-mapped index for an in-memory copy before it is modified"""
+        if self._mapped_index is not None and store.index is self._mapped_index:
+            index = faiss.read_index(self._path("index"))
+            copy_search_params(store.index, index)
+            store.index = index
+        self._mapped_index = None
+
+    def append(self, vectors) -> None:
+        """
+        Persist the vectors of documents just added to the store. The
+        documents themselves were already written to the log by the
+        docstore; replay only trusts log records that have their vector.
+        """
+        vectors = np.asarray(vectors, dtype="float32")
+        if not len(vectors):
+            return
+        with self._lock:
+            with open(self._path("segment"), "ab") as f:
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.docstore.sync()
+            self.segment_rows += len(vectors)
+
+    def delete(self, store: FAISS, ids: List[str]) -> None:
+        """Delete documents from the store, logging the delete for replay"""
+        self.ensure_writable(store)
+        before = store.index.ntotal
+        delete_from_store(store, ids)
+        with self._lock:
+            self.docstore.sync()
+            self.deleted_rows += before - store.index.ntotal
+
+    def _write_manifest(self, **overrides) -> None:
+        manifest = {
+            "generation": self.generation,
+            "dim": self.dim,
+            "snapshot_rows": self.snapshot_rows,
+            "snapshot_log_bytes": self.snapshot_log_bytes,
+            **overrides
+        }
+        atomic_write(
+            os.path.join(self.directory, MANIFEST),
+            lambda f: f.write(json.dumps(manifest).encode("utf-8"))
+        )
+
+    def needs_compaction(self) -> bool:
+        tail = self.segment_rows + self.deleted_rows
+        return tail >= max(self.compact_min_rows, self.compact_ratio * self.snapshot_rows)
+
+    def compact(self, store: FAISS) -> None:
+        """Write the whole store as the snapshot of a new generation"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            old_generation = self.generation if self.exists() else None
+            # The new generation only becomes current once its manifest is written,
+            # until then appends keep going to the files the manifest names
+            generation = 0 if old_generation is None else old_generation + 1
+            snapshot = []
+
+            def write_docs(f):
+                offset = 0
+                for position in range(store.index.ntotal):
+                    doc_id = store.index_to_docstore_id[position]
+                    doc = store.docstore.search(doc_id)
+                    data = encode_record({
+                        "op": "add",
+                        "id": doc_id,
+                        "page_content": doc.page_content,
+                        "metadata": doc.metadata
+                    })
+                    f.write(data)
+                    snapshot.append((doc_id, offset, len(data)))
+                    offset += len(data)
+
+            try:
+                atomic_write(
+                    self._path("index", generation), lambda f: f.write(faiss.serialize_index(store.index).tobytes())
+                )
+                atomic_write(self._path("log", generation), write_docs)
+                atomic_write(self._path("ids", generation), lambda f: f.write(json.dumps(snapshot).encode("utf-8")))
+                atomic_write(self._path("segment", generation), lambda f: None)
+                snapshot_log_bytes = os.path.getsize(self._path("log", generation))
+                self._write_manifest(
+                    generation=generation, dim=store.index.d,
+                    snapshot_rows=store.index.ntotal, snapshot_log_bytes=snapshot_log_bytes
+                )
+            except BaseException:
+                # A half-written generation is never read, don't leave it behind
+                for kind in ("index", "segment", "log", "ids"):
+                    path = self._path(kind, generation)
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise
+
+            self.generation = generation
+            self.dim = store.index.d
+            self.snapshot_rows = store.index.ntotal
+            self.snapshot_log_bytes = snapshot_log_bytes
+            self.segment_rows = 0
+            self.deleted_rows = 0
+
+            offsets = {doc_id: (offset, length) for doc_id, offset, length in snapshot}
+            if isinstance(store.docstore, LogDocstore):
+                store.docstore.switch(self._path("log"), offsets)
+            else:
+                # Migrating a store that was loaded from a pickle
+                store.docstore = LogDocstore(self._path("log"), offsets)
+            self.docstore = store.docstore
+
+            if old_generation is not None:
+                for kind in ("index", "segment", "log", "ids"):
+                    path = self._path(kind, old_generation)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def close(self) -> None:
+        if self.docstore is not None:
+            self.docstore.close()
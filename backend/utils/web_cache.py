@@ -0,0 +1,233 @@
+import hashlib
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+DEFAULT_WEB_CACHE_PATH = "../temp/web_cache.sqlite"
+
+DEFAULT_WEB_CACHE_CONFIG = {
+    "web_cache_search_ttl_seconds": 3600,
+    # Pages older than this are revalidated with a conditional request
+    "web_cache_page_ttl_seconds": 86400,
+    "web_cache_max_bytes": 256 * 1024 * 1024
+}
+
+# Eviction frees space down to this fraction of max_bytes, so a full cache
+# evicts once per batch of inserts rather than on every insert
+EVICT_TO_FRACTION = 0.9
+
+
+class CachedPage:
+    def __init__(self, url: str, content: str, metadata: dict, etag: Optional[str],
+                 last_modified: Optional[str], fetched_at: float, fresh: bool):
+        self.url = url
+        self.content = content
+        self.metadata = metadata
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.fresh = fresh
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class WebCache:
+    """
+    On-disk cache of search-result lists per query and of extracted page
+    markdown per URL. Search results are served until search_ttl expires.
+    Pages past page_ttl are kept with their ETag/Last-Modified so they can
+    be revalidated instead of downloaded again. The least recently used
+    entries are evicted once the stored content exceeds max_bytes. The
+    total size is kept in memory, updated as entries are written.
+    """
+
+    def __init__(self, path: str = DEFAULT_WEB_CACHE_PATH, search_ttl: float = 3600,
+                 page_ttl: float = 86400, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.search_ttl = search_ttl
+        self.page_ttl = page_ttl
+        self.max_bytes = max_bytes
+        self.search_hits = 0
+        self.search_misses = 0
+        self.page_hits = 0
+        self.page_revalidations = 0
+        self.page_misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS searches (
+                key TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        # Eviction walks both tables oldest first without sorting them
+        self._conn.execute("CREATE INDEX IF NOT EXISTS searches_last_used ON searches (last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)")
+        self._conn.commit()
+        self.size_bytes = self._size()
+
+    @staticmethod
+    def search_key(query: str, max_results: int) -> str:
+        normalized = " ".join(query.lower().split())
+        return hashlib.sha256(f"{max_results}:{normalized}".encode("utf-8")).hexdigest()
+
+    def get_search(self, query: str, max_results: int) -> Optional[List[Dict]]:
+        key = self.search_key(query, max_results)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results, fetched_at FROM searches WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.search_ttl:
+                self.search_misses += 1
+                return None
+            self._conn.execute("UPDATE searches SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.search_hits += 1
+            return json.loads(row[0])
+
+    def put_search(self, query: str, max_results: int, results: List[Dict]) -> None:
+        data = json.dumps(results)
+        key = self.search_key(query, max_results)
+        now = time.time()
+        with self._lock:
+            self.size_bytes += len(data) - self._stored_size("searches", "key", key)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO searches (key, results, fetched_at, last_used, size) VALUES (?, ?, ?, ?, ?)",
+                (key, data, now, now, len(data))
+            )
+            self._evict()
+            self._conn.commit()
+
+    def get_page(self, url: str) -> Optional[CachedPage]:
+        """Return the cached page, fresh or not, or None if it was never stored"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, metadata, etag, last_modified, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                self.page_misses += 1
+                return None
+            content, metadata, etag, last_modified, fetched_at = row
+            fresh = time.time() - fetched_at <= self.page_ttl
+            if fresh:
+                self.page_hits += 1
+                self._conn.execute("UPDATE pages SET last_used = ? WHERE url = ?", (time.time(), url))
+                self._conn.commit()
+            return CachedPage(url, content, json.loads(metadata), etag, last_modified, fetched_at, fresh)
+
+    def put_page(self, url: str, content: str, metadata: dict,
+                 etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        now = time.time()
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            self.size_bytes += size - self._stored_size("pages", "url", url)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, content, metadata, etag, last_modified, fetched_at, last_used, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, content, json.dumps(metadata), etag, last_modified, now, now, size)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def revalidated(self, url: str) -> None:
+        """The server answered 304 Not Modified, the cached copy is fresh again"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE pages SET fetched_at = ?, last_used = ? WHERE url = ?", (now, now, url))
+            self._conn.commit()
+            self.page_revalidations += 1
+
+    def _size(self) -> int:
+        return self._conn.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM pages) + (SELECT COALESCE(SUM(size), 0) FROM searches)"
+        ).fetchone()[0]
+
+    def _stored_size(self, table: str, column: str, key: str) -> int:
+        row = self._conn.execute(f"SELECT size FROM {table} WHERE {column} = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _evict(self) -> None:
+        if self.size_bytes <= self.max_bytes:
+            return
+        overflow = self.size_bytes - int(self.max_bytes * EVICT_TO_FRACTION)
+        # Both cursors read in last_used order through their index, and only
+        # as many rows are read as are evicted
+        oldest = heapq.merge(
+            self._conn.execute("SELECT last_used, 'pages', url, size FROM pages ORDER BY last_used"),
+            self._conn.execute("SELECT last_used, 'searches', key, size FROM searches ORDER BY last_used"),
+        )
+        victims = []
+        for _, table, key, size in oldest:
+            if overflow <= 0:
+                break
+            victims.append((table, key))
+            overflow -= size
+            self.size_bytes -= size
+        for table in ("pages", "searches"):
+            column = "url" if table == "pages" else "key"
+            self._conn.executemany(
+                f"DELETE FROM {table} WHERE {column} = ?", [(key,) for kind, key in victims if kind == table]
+            )
+        self.evictions += len(victims)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "search_hits": self.search_hits,
+                "search_misses": self.search_misses,
+                "page_hits": self.page_hits,
+                "page_revalidations": self.page_revalidations,
+                "page_misses": self.page_misses,
+                "evictions": self.evictions,
+                "searches": self._conn.execute("SELECT COUNT(*) FROM searches").fetchone()[0],
+                "pages": self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0],
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_caches: Dict[str, WebCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_web_cache(config: dict, path: str = DEFAULT_WEB_CACHE_PATH) -> WebCache:
+    """Return the process-wide cache for path, updated with the settings in config"""
+    key = os.path.abspath(path)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = WebCache(path)
+        cache = _caches[key]
+        cache.search_ttl = config["web_cache_search_ttl_seconds"]
+        cache.page_ttl = config["web_cache_page_ttl_seconds"]
+        cache.max_bytes = config["web_cache_max_bytes"]
+        return cache
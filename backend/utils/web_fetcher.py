@@ -0,0 +1,100 @@
+import asyncio
+from typing import Callable, Dict, List
+from urllib.parse import urlsplit
+
+import httpx
+
+from utils.executors import run_in_pool
+from utils.web_cache import WebCache
+
+
+class WebFetcher:
+    """Fetch pages concurrently over a pooled keep-alive client"""
+
+    def __init__(self,
+                 timeout: float = 10.0,
+                 deadline: float = 15.0,
+                 per_host_limit: int = 2,
+                 max_connections: int = 20,
+                 transport: httpx.AsyncBaseTransport = None,
+                 cache: WebCache = None):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.per_host_limit = per_host_limit
+        self.max_connections = max_connections
+        # Allows pointing the fetcher at a stub server or an httpx.MockTransport
+        self.transport = transport
+        self.cache = cache
+        self._client = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                transport=self.transport
+            )
+        return self._client
+
+    def host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_limits[host]
+
+    async def fetch(self, url: str, convert: Callable[[str, bytes], tuple]) -> tuple:
+        """
+        Download a page and convert it in the worker pool, returning
+        (content, metadata). Fresh cached pages skip the network, stale ones
+        are revalidated with a conditional request.
+        """
+        try:
+            cached = await asyncio.to_thread(self.cache.get_page, url) if self.cache else None
+            if cached is not None and cached.fresh:
+                return cached.content, cached.metadata
+
+            headers = cached.conditional_headers() if cached is not None else None
+            async with self.host_limit(url):
+                response = await self.get_client().get(url, headers=headers)
+            if response.status_code == 304 and cached is not None:
+                await asyncio.to_thread(self.cache.revalidated, url)
+                return cached.content, cached.metadata
+            if response.status_code != 200:
+                return None, None
+
+            content, metadata = await run_in_pool(convert, url, response.content)
+            if self.cache and content:
+                await asyncio.to_thread(
+                    self.cache.put_page, url, content, metadata,
+                    response.headers.get("etag"), response.headers.get("last-modified")
+                )
+            return content, metadata
+
+        except Exception as e:
+            print(f"Error extracting content from {url}: {e}")
+            return None, None
+
+    async def fetch_all(self, urls: List[str], convert: Callable[[str, bytes], tuple]) -> List[tuple]:
+        """Fetch all urls concurrently, keeping whatever finished before the deadline"""
+        if not urls:
+            return []
+
+        tasks = [asyncio.create_task(self.fetch(url, convert)) for url in urls]
+        done, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            print(f"Fetch deadline reached, using {len(done)} of {len(tasks)} pages")
+
+        # Keep the search-result order for the pages that made it
+        return [task.result() for task in tasks if task in done]
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
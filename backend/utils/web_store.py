@@ -0,0 +1,181 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from utils.embedding_cache import chunk_hash
+
+DEFAULT_WEB_STORE_CONFIG = {
+    "web_store_max_chunks": 20000,
+    # "lru" evicts the pages retrieved least recently, "age" the pages fetched longest ago
+    "web_store_eviction": "lru"
+}
+
+EVICTION_POLICIES = ("lru", "age")
+
+
+class WebStoreCatalog:
+    """
+    Catalog of the chunks in the web search vector store: the page each
+    chunk came from, its content hash and when it was added and last
+    retrieved. It decides which fetched chunks are new, which stored chunks
+    a re-fetched page no longer has, and which pages to evict once the
+    store is over capacity. Pages are evicted whole.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.inserted = 0
+        self.duplicates = 0
+        self.replaced = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                doc_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                added_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_url ON chunks (url)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_hash ON chunks (content_hash)")
+        self._conn.commit()
+
+    def reconcile(self, store) -> None:
+        """Bring the catalog in line with the store after loading, e.g. a crash between the two"""
+        stored = set(store.index_to_docstore_id.values())
+        with self._lock:
+            cataloged = {row[0] for row in self._conn.execute("SELECT doc_id FROM chunks")}
+            stale = cataloged - stored
+            self._conn.executemany("DELETE FROM chunks WHERE doc_id = ?", [(doc_id,) for doc_id in stale])
+
+            # Stores written before the catalog existed are read once to backfill it
+            now = time.time()
+            rows = []
+            for doc_id in stored - cataloged:
+                doc = store.docstore.search(doc_id)
+                if isinstance(doc, Document):
+                    rows.append((doc_id, doc.metadata.get("url", ""), chunk_hash(doc.page_content), now, now))
+            self._conn.executemany(
+                "INSERT INTO chunks (doc_id, url, content_hash, added_at, last_used) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def plan(self, documents: List[Document]) -> Tuple[List[Document], List[str], int]:
+        """
+        Split freshly fetched chunks, which carry their content_hash in their
+        metadata, into (chunks to add, ids of stored chunks their pages no
+        longer contain, number of duplicates skipped). A chunk is a duplicate
+        if its content is already stored for any page or appears earlier in
+        the batch.
+        """
+        by_url: Dict[str, List[Document]] = {}
+        for doc in documents:
+            by_url.setdefault(doc.metadata.get("url", ""), []).append(doc)
+
+        to_add, stale_ids, duplicates = [], [], 0
+        seen = set()
+        with self._lock:
+            hashes = {}
+            for url, docs in by_url.items():
+                hashes[url] = [doc.metadata["content_hash"] for doc in docs]
+                current = set(hashes[url])
+                for doc_id, content_hash in self._conn.execute(
+                    "SELECT doc_id, content_hash FROM chunks WHERE url = ?", (url,)
+                ):
+                    if content_hash not in current:
+                        stale_ids.append(doc_id)
+
+            stale = set(stale_ids)
+            for url, docs in by_url.items():
+                for doc, content_hash in zip(docs, hashes[url]):
+                    # A copy that is about to be replaced doesn't count as stored
+                    stored = any(
+                        row[0] not in stale for row in self._conn.execute(
+                            "SELECT doc_id FROM chunks WHERE content_hash = ?", (content_hash,)
+                        )
+                    )
+                    if stored or content_hash in seen:
+                        duplicates += 1
+                        continue
+                    seen.add(content_hash)
+                    to_add.append(doc)
+        return to_add, stale_ids, duplicates
+
+    def record(self, added: List[Document], ids: List[str], replaced: List[str], duplicates: int) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE doc_id = ?", [(doc_id,) for doc_id in replaced])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (doc_id, url, content_hash, added_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(doc_id, doc.metadata.get("url", ""), doc.metadata["content_hash"], now, now)
+                 for doc, doc_id in zip(added, ids)]
+            )
+            self._conn.commit()
+            self.inserted += len(added)
+            self.replaced += len(replaced)
+            self.duplicates += duplicates
+
+    def touch(self, ids: List[str] = (), hashes: List[str] = ()) -> None:
+        """Mark chunks, by id or content hash, as just retrieved for LRU eviction"""
+        if not ids and not hashes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("UPDATE chunks SET last_used = ? WHERE doc_id = ?", [(now, doc_id) for doc_id in ids])
+            self._conn.executemany(
+                "UPDATE chunks SET last_used = ? WHERE content_hash = ?", [(now, content_hash) for content_hash in hashes]
+            )
+            self._conn.commit()
+
+    def eviction_candidates(self, max_chunks: int, policy: str = "lru") -> List[str]:
+        """Ids of the chunks of the oldest pages that need to go to get back under max_chunks"""
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}, expected one of {', '.join(EVICTION_POLICIES)}")
+        column = "last_used" if policy == "lru" else "added_at"
+        with self._lock:
+            overflow = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0] - max_chunks
+            if overflow <= 0:
+                return []
+            ids = []
+            for url, count in self._conn.execute(
+                f"SELECT url, COUNT(*) FROM chunks GROUP BY url ORDER BY MAX({column})"
+            ).fetchall():
+                if overflow <= 0:
+                    break
+                ids.extend(row[0] for row in self._conn.execute("SELECT doc_id FROM chunks WHERE url = ?", (url,)))
+                overflow -= count
+            return ids
+
+    def evicted(self, ids: List[str]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE doc_id = ?", [(doc_id,) for doc_id in ids])
+            self._conn.commit()
+            self.evictions += len(ids)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            chunks, pages = self._conn.execute("SELECT COUNT(*), COUNT(DISTINCT url) FROM chunks").fetchone()
+            offered = self.inserted + self.duplicates
+            return {
+                "chunks": chunks,
+                "pages": pages,
+                "inserted": self.inserted,
+                "duplicates": self.duplicates,
+                "duplicate_rate": self.duplicates / offered if offered else 0.0,
+                "replaced": self.replaced,
+                "evictions": self.evictions,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()